@@ -0,0 +1,101 @@
+"""Fixtures of the benchmark suite.
+
+The benchmarks use pytest-benchmark and are kept out of the test suite. Run them, saving
+the timings of the current commit to ``.benchmarks/``, with
+
+    pytest benchmarks --benchmark-autosave
+
+and compare a later commit with the last saved run, failing on regressions, with
+
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:20%
+
+Synthetic fixtures scale the model size and the number of conditions. Real fixtures use
+the model and processed data of the repository, and are skipped if these are missing.
+"""
+
+import cobra
+import pytest
+from syn_bmca import bundle, pymc_model
+from synthetic import synthetic_inputs, synthetic_model
+
+# Number of reactions in the chain of each synthetic model, and of synthetic conditions
+MODEL_SIZES = (25, 100, 400)
+CONDITION_COUNTS = (4, 16, 64)
+
+
+@pytest.fixture(scope="session", params=MODEL_SIZES, ids=lambda n: f"chain{n}")
+def chain_model(request):
+    """Build a synthetic cobra model of each size."""
+    return synthetic_model(request.param)
+
+
+@pytest.fixture(scope="session")
+def chain_model_path(chain_model, tmp_path_factory):
+    """Save a synthetic cobra model of each size as JSON."""
+    path = tmp_path_factory.mktemp("models").joinpath(f"{chain_model.id}.json")
+    cobra.io.save_json_model(chain_model, path)
+    return path
+
+
+@pytest.fixture(params=CONDITION_COUNTS, ids=lambda n: f"{n}conditions")
+def n_conditions(request):
+    """Return each number of synthetic conditions."""
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def real_model_path():
+    """Return the path to the cobra model of the repository."""
+    if not pymc_model.MODEL.exists():
+        pytest.skip(f"{pymc_model.MODEL} not found")
+    return pymc_model.MODEL
+
+
+@pytest.fixture(scope="session")
+def real_inputs(real_model_path):
+    """Return the reference fluxes and measurements of the repository, as SynBMCA reads them."""
+    paths = (pymc_model.VSTAR, pymc_model.METAB, pymc_model.PROT, pymc_model.EFLUX)
+    missing = [path for path in paths if not path.exists()]
+    if missing:
+        pytest.skip(f"{missing} not found")
+    return {
+        "v_star": bundle.read_v_star(pymc_model.VSTAR),
+        "metabolites": bundle.read_table(pymc_model.METAB),
+        "enzymes": bundle.read_table(pymc_model.PROT),
+        "fluxes": bundle.read_table(pymc_model.EFLUX),
+        "reference_state": "L_T16_B",
+    }
+
+
+@pytest.fixture
+def chain_inputs(chain_model, n_conditions):
+    """Build reference fluxes and measurements of each synthetic model and number of conditions."""
+    return synthetic_inputs(chain_model, n_conditions)
+
+
+@pytest.fixture(scope="session")
+def real_model(real_model_path):
+    """Load the cobra model of the repository."""
+    return cobra.io.load_json_model(real_model_path)
+
+
+def _qp_copy(model: cobra.Model) -> cobra.Model:
+    """Return a copy of a model using a solver of quadratic programs, as E-Flux2 needs."""
+    available = [s for s in cobra.util.solver.qp_solvers if s in cobra.util.solver.solvers]
+    if not available:
+        pytest.skip("No solver of quadratic programs installed")
+    model = model.copy()
+    model.solver = available[0]
+    return model
+
+
+@pytest.fixture(scope="session")
+def chain_qp_model(chain_model):
+    """Return a synthetic cobra model of each size, with a solver of quadratic programs."""
+    return _qp_copy(chain_model)
+
+
+@pytest.fixture(scope="session")
+def real_qp_model(real_model):
+    """Return the cobra model of the repository, with a solver of quadratic programs."""
+    return _qp_copy(real_model)
@@ -0,0 +1,95 @@
+"""Synthetic models and data of the benchmarks, scaled by model size and condition count."""
+
+import cobra
+import numpy as np
+import pandas as pd
+
+
+def synthetic_model(n_chain: int) -> cobra.Model:
+    """Return a linear pathway with side branches, genes and gene reaction rules.
+
+    A substrate is taken up and converted along a chain of ``n_chain`` reactions into a
+    product. Every fourth intermediate also leaks into a waste product at a fixed minimum
+    rate, so all reactions carry flux at the maximal product secretion.
+    """
+    model = cobra.Model(f"chain_{n_chain}")
+    s_e = cobra.Metabolite("s_e", compartment="e")
+    p_e = cobra.Metabolite("p_e", compartment="e")
+    w_e = cobra.Metabolite("w_e", compartment="e")
+    chain = [cobra.Metabolite(f"m{i}_c", compartment="c") for i in range(n_chain + 1)]
+
+    def reaction(rxn_id, metabolites, lower_bound=0.0, upper_bound=1000.0, rule=""):
+        rxn = cobra.Reaction(rxn_id, lower_bound=lower_bound, upper_bound=upper_bound)
+        rxn.add_metabolites(metabolites)
+        rxn.gene_reaction_rule = rule
+        return rxn
+
+    reactions = [
+        reaction("EX_s_e", {s_e: 1}, upper_bound=10.0),
+        reaction("T_s", {s_e: -1, chain[0]: 1}, rule="gts"),
+        reaction("T_p", {chain[-1]: -1, p_e: 1}, rule="gtp"),
+        reaction("EX_p_e", {p_e: -1}),
+        reaction("EX_w_e", {w_e: -1}),
+    ]
+    for i in range(1, n_chain + 1):
+        # Alternate isozymes, complexes and single genes
+        rule = (f"g{i}a or g{i}b", f"g{i}a and g{i}b", f"g{i}a")[i % 3]
+        reactions.append(reaction(f"R{i}", {chain[i - 1]: -1, chain[i]: 1}, rule=rule))
+        if i % 4 == 0:
+            reactions.append(reaction(f"L{i}", {chain[i]: -1, w_e: 1}, lower_bound=0.1))
+    model.add_reactions(reactions)
+    model.objective = "EX_p_e"
+    return model
+
+
+def synthetic_inputs(model: cobra.Model, n_conditions: int, seed: int = 0) -> dict:
+    """Return reference fluxes and measurements of a synthetic model, as SynBMCA reads them."""
+    rng = np.random.default_rng(seed)
+    v_star = model.optimize().fluxes
+    conditions = [f"c{i}" for i in range(n_conditions + 1)]
+    metabolite_ids = [m.id for m in model.metabolites if m.compartment == "c"][::2]
+    enzyme_ids = [r.id for r in model.reactions if r.id.startswith("R")][::2]
+    flux_ids = ["EX_s_e", "EX_p_e"]
+
+    def table(ids, values):
+        return pd.DataFrame(values, index=pd.Index(ids, dtype=object), columns=conditions)
+
+    return {
+        "v_star": v_star,
+        "metabolites": table(metabolite_ids, rng.normal(size=(len(metabolite_ids), len(conditions)))),
+        "enzymes": table(enzyme_ids, rng.lognormal(0, 0.2, (len(enzyme_ids), len(conditions)))),
+        "fluxes": table(
+            flux_ids,
+            v_star[flux_ids].to_numpy()[:, None] * rng.lognormal(0, 0.1, (2, len(conditions))),
+        ),
+        "reference_state": conditions[0],
+    }
+
+
+def synthetic_transcriptomics(model: cobra.Model, n_conditions: int, seed: int = 0) -> pd.DataFrame:
+    """Return random gene expression of every gene of a model, genes by conditions."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        # Activities well above the fluxes of the synthetic models, so E-Flux2 stays feasible
+        rng.lognormal(3, 0.5, (len(model.genes), n_conditions)),
+        index=[g.id for g in model.genes],
+        columns=[f"c{i}" for i in range(n_conditions)],
+    )
+
+
+def synthetic_metabolomics(
+    n_days: int, n_metabolites: int = 100, n_samples: int = 3, n_replicates: int = 3, seed: int = 0
+) -> pd.DataFrame:
+    """Return random metabolite abundances with columns named <sample>_d<day>_<replicate>."""
+    rng = np.random.default_rng(seed)
+    columns = [
+        f"S{sample}_d{day}_{replicate}"
+        for sample in range(n_samples)
+        for day in range(n_days)
+        for replicate in range(1, n_replicates + 1)
+    ]
+    return pd.DataFrame(
+        rng.lognormal(0, 1, (n_metabolites, len(columns))),
+        index=[f"m{i}" for i in range(n_metabolites)],
+        columns=columns,
+    )
@@ -0,0 +1,44 @@
+"""Benchmarks of the ADVI iteration rate of each compilation backend on the circadian data."""
+
+import pytest
+from syn_bmca import backends
+from syn_bmca.inference import ADVIRunner
+from syn_bmca.pymc_model import SynBMCA
+
+# Layout each backend is benchmarked with; the JAX backend needs the batched solve
+BACKENDS = {
+    "c": {"batched": True},
+    "numba": {"batched": True},
+    "jax": {"batched": True},
+    "c-scan": {},
+    "numba-scan": {},
+}
+
+
+@pytest.mark.parametrize("backend", list(BACKENDS))
+def test_advi_step_backend(benchmark, real_model_path, real_inputs, tmp_path, backend):
+    """Time one ADVI step of the repository's model; the ops/s are its iterations/s."""
+    name = backend.removesuffix("-scan")
+    if name != "c":
+        pytest.importorskip(name)
+    bmca = SynBMCA(
+        real_model_path,
+        real_inputs["v_star"],
+        real_inputs["metabolites"],
+        real_inputs["enzymes"],
+        real_inputs["fluxes"],
+        real_inputs["reference_state"],
+        run_inference=False,
+        output_dir=tmp_path,
+        backend=name,
+        **BACKENDS[backend],
+    )
+    runner = ADVIRunner(
+        bmca.pymc_model,
+        convergence_window=None,
+        random_seed=0,
+        progressbar=False,
+        mode=backends.get_mode(name),
+    )
+    runner.compile()
+    benchmark(runner.step)
@@ -0,0 +1,99 @@
+"""Benchmarks of building SynBMCA models and of their ADVI steps."""
+
+import cobra
+import pytest
+from syn_bmca.inference import ADVIRunner
+from syn_bmca.pymc_model import SynBMCA
+
+LAYOUTS = {
+    "dense": {},
+    "batched": {"batched": True},
+    "sparse": {"sparse": True},
+    "sparse_elasticity": {"sparse": True, "sparse_elasticity": True},
+    "minibatch": {"batched": True, "batch_size": 2},
+}
+
+
+def build(model_path, inputs, output_dir, **kwargs):
+    """Build a SynBMCA model without fitting it."""
+    return SynBMCA(
+        model_path,
+        inputs["v_star"],
+        inputs["metabolites"],
+        inputs["enzymes"],
+        inputs["fluxes"],
+        inputs["reference_state"],
+        run_inference=False,
+        output_dir=output_dir,
+        **kwargs,
+    )
+
+
+def compile_runner(bmca):
+    """Compile the ADVI step function of a model, returning its runner."""
+    runner = ADVIRunner(bmca.pymc_model, convergence_window=None, random_seed=0, progressbar=False)
+    runner.compile()
+    return runner
+
+
+def test_load_model(benchmark, chain_model_path):
+    """Time parsing a synthetic cobra model."""
+    benchmark(cobra.io.load_json_model, chain_model_path)
+
+
+def test_load_model_real(benchmark, real_model_path):
+    """Time parsing the cobra model of the repository."""
+    benchmark(cobra.io.load_json_model, real_model_path)
+
+
+@pytest.mark.parametrize("layout", ["dense", "sparse"])
+def test_build_structure(benchmark, chain_model_path, chain_inputs, tmp_path, layout):
+    """Time loading a synthetic model and building its matrices and linlog model."""
+    bmca = build(chain_model_path, chain_inputs, tmp_path, **LAYOUTS[layout])
+    benchmark(bmca.build_structure)
+
+
+@pytest.mark.parametrize("layout", ["dense", "sparse"])
+def test_build_structure_real(benchmark, real_model_path, real_inputs, tmp_path, layout):
+    """Time loading the model of the repository and building its matrices and linlog model."""
+    bmca = build(real_model_path, real_inputs, tmp_path, **LAYOUTS[layout])
+    benchmark.pedantic(bmca.build_structure, rounds=3)
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_build_pymc_model(benchmark, chain_model_path, chain_inputs, tmp_path, layout):
+    """Time building the PyMC graph of a synthetic model."""
+    bmca = build(chain_model_path, chain_inputs, tmp_path, **LAYOUTS[layout])
+    benchmark.pedantic(bmca.build_pymc_model, rounds=3)
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_compile(benchmark, chain_model_path, chain_inputs, tmp_path, layout):
+    """Time compiling the ADVI step function of a synthetic model.
+
+    Compiled C modules are cached by pytensor, so after the first round this mostly
+    measures graph rewriting and linking.
+    """
+    bmca = build(chain_model_path, chain_inputs, tmp_path, **LAYOUTS[layout])
+    benchmark.pedantic(compile_runner, args=(bmca,), rounds=3)
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_compile_real(benchmark, real_model_path, real_inputs, tmp_path, layout):
+    """Time compiling the ADVI step function of the model of the repository."""
+    bmca = build(real_model_path, real_inputs, tmp_path, **LAYOUTS[layout])
+    benchmark.pedantic(compile_runner, args=(bmca,), rounds=1)
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_advi_step(benchmark, chain_model_path, chain_inputs, tmp_path, layout):
+    """Time one ADVI gradient step of a synthetic model."""
+    runner = compile_runner(build(chain_model_path, chain_inputs, tmp_path, **LAYOUTS[layout]))
+    benchmark(runner.step)
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_advi_step_real(benchmark, real_model_path, real_inputs, tmp_path, layout):
+    """Time one ADVI gradient step of the model of the repository."""
+    runner = compile_runner(build(real_model_path, real_inputs, tmp_path, **LAYOUTS[layout]))
+    benchmark(runner.step)
@@ -0,0 +1,57 @@
+"""Benchmarks of the flux balance utilities."""
+
+import pytest
+from syn_bmca.eflux2 import EFlux2, eflux2_batch
+from syn_bmca.fba_utils import convert_transcriptomics_to_enzyme_activity, get_flux_bounds
+from synthetic import synthetic_transcriptomics
+
+
+def test_convert_transcriptomics(benchmark, chain_model, n_conditions):
+    """Time converting the expression of every gene of a synthetic model to enzyme activity."""
+    transcriptomics = synthetic_transcriptomics(chain_model, n_conditions)
+    benchmark(convert_transcriptomics_to_enzyme_activity, transcriptomics, chain_model)
+
+
+def test_convert_transcriptomics_real(benchmark, real_model, n_conditions):
+    """Time converting the expression of every gene of the repository's model."""
+    transcriptomics = synthetic_transcriptomics(real_model, n_conditions)
+    benchmark(convert_transcriptomics_to_enzyme_activity, transcriptomics, real_model)
+
+
+def test_eflux2(benchmark, chain_qp_model):
+    """Time E-Flux2 of a single condition on a synthetic model."""
+    transcriptomics = synthetic_transcriptomics(chain_qp_model, 1)["c0"]
+    benchmark.pedantic(EFlux2, args=(chain_qp_model, transcriptomics), rounds=3)
+
+
+def test_eflux2_batch(benchmark, chain_qp_model, n_conditions):
+    """Time E-Flux2 of several conditions on a synthetic model."""
+    transcriptomics = synthetic_transcriptomics(chain_qp_model, n_conditions)
+    benchmark.pedantic(eflux2_batch, args=(chain_qp_model, transcriptomics), rounds=3)
+
+
+def test_eflux2_batch_real(benchmark, real_qp_model):
+    """Time E-Flux2 of several conditions on the repository's model."""
+    transcriptomics = synthetic_transcriptomics(real_qp_model, 8)
+    benchmark.pedantic(eflux2_batch, args=(real_qp_model, transcriptomics), rounds=1)
+
+
+@pytest.mark.parametrize("processes", [1, None], ids=["serial", "parallel"])
+def test_get_flux_bounds(benchmark, chain_model, processes):
+    """Time the flux bounds of a synthetic model."""
+    benchmark.pedantic(
+        get_flux_bounds,
+        setup=lambda: ((chain_model.copy(), ["EX_p_e"]), {"processes": processes}),
+        rounds=3,
+    )
+
+
+@pytest.mark.parametrize("processes", [1, None], ids=["serial", "parallel"])
+def test_get_flux_bounds_real(benchmark, real_model, processes):
+    """Time the flux bounds of the repository's model, fixing its objective reactions."""
+    objective = [r.id for r in real_model.reactions if r.objective_coefficient]
+    benchmark.pedantic(
+        get_flux_bounds,
+        setup=lambda: ((real_model.copy(), objective), {"processes": processes}),
+        rounds=1,
+    )
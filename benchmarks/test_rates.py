@@ -0,0 +1,26 @@
+"""Benchmarks of the metabolite rate calculation of the data scripts."""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from synthetic import synthetic_metabolomics
+
+DATA = Path(__file__).parent.parent.joinpath("data").resolve()
+sys.path.insert(0, str(DATA))
+
+from calculate_rates import METAB, calculate_rates  # noqa: E402
+
+
+@pytest.mark.parametrize("n_days", [6, 24, 96])
+def test_calculate_rates(benchmark, n_days):
+    """Time the rates of synthetic time series of several lengths."""
+    benchmark(calculate_rates, synthetic_metabolomics(n_days))
+
+
+def test_calculate_rates_real(benchmark):
+    """Time the rates of the processed metabolomics data of the repository."""
+    if not METAB.exists():
+        pytest.skip(f"{METAB} not found")
+    benchmark(calculate_rates, pd.read_csv(METAB, index_col="Sample"))
@@ -1,29 +1,63 @@
 """File to process Omics data collected for Synechococcus elongatus."""
 
+import argparse
 import json
 import logging
+from dataclasses import dataclass
 from pathlib import Path
 from zipfile import ZipFile
 
 import calculate_rates
 import numpy as np
 import pandas as pd
+from pipeline import Stage, read_excel_cached, run_pipeline
 
 HERE = Path(__file__).parent.resolve()
-RAW_DATA = HERE.joinpath("raw_data")
-KEGG_TO_BIGG_MAP = RAW_DATA.joinpath("KEGG_to_BIGG_mapper_for_Syn_Rt.json")
-ZIP_DATA = RAW_DATA.joinpath("Selon_omics_Pavlo.zip")
-UNZIPPED = RAW_DATA.joinpath("Selon_omics_Pavlo")
-OUTPUT = HERE.joinpath("processed_data")
-METAB = UNZIPPED.joinpath("Metabolomics")
-TRANS = UNZIPPED.joinpath("Transcript")
-EXP_ID_MAP = METAB.joinpath("Metaboites_Se_Rt_IDs_9day.xlsx")
-RATES = OUTPUT.joinpath("calculated_metabolomic_abundance_rates.csv")
+# Metabolomics tables to combine, from the most to the least preferred for redundant metabolites
+METABOLOMICS_SOURCES = ("EMSL", "JHU")
+# Changes to the build scripts rebuild every stage
+SCRIPTS = [HERE.joinpath(name) for name in ("build.py", "calculate_rates.py", "pipeline.py")]
 
 
 logging.basicConfig(level=logging.INFO)
 
 
+@dataclass(frozen=True)
+class BuildPaths:
+    """Raw and processed data files of an experiment directory."""
+
+    raw_data: Path
+    kegg_to_bigg_map: Path
+    zip_data: Path
+    unzipped: Path
+    output: Path
+    metab: Path
+    trans: Path
+    exp_id_map: Path
+    rates: Path
+    cache: Path
+
+    @classmethod
+    def from_root(cls, root: Path) -> "BuildPaths":
+        """Return the paths of an experiment with raw_data and processed_data in ``root``."""
+        raw_data = root.joinpath("raw_data")
+        unzipped = raw_data.joinpath("Selon_omics_Pavlo")
+        output = root.joinpath("processed_data")
+        metab = unzipped.joinpath("Metabolomics")
+        return cls(
+            raw_data=raw_data,
+            kegg_to_bigg_map=raw_data.joinpath("KEGG_to_BIGG_mapper_for_Syn_Rt.json"),
+            zip_data=raw_data.joinpath("Selon_omics_Pavlo.zip"),
+            unzipped=unzipped,
+            output=output,
+            metab=metab,
+            trans=unzipped.joinpath("Transcript"),
+            exp_id_map=metab.joinpath("Metaboites_Se_Rt_IDs_9day.xlsx"),
+            rates=output.joinpath("calculated_metabolomic_abundance_rates.csv"),
+            cache=root.joinpath(".cache", "build"),
+        )
+
+
 def _unzip_data(zip_path: Path, out_dir: Path) -> list:
     """Unzip a zip file to the specified output directory.
 
@@ -42,25 +76,36 @@ def _unzip_data(zip_path: Path, out_dir: Path) -> list:
         zip_obj.extractall(out_dir)
 
 
-def _load_metabolomics() -> pd.DataFrame:
-    """Loads metabolomic data."""
+def _metabolomics_files(metab_dir: Path) -> list:
+    """Returns the metabolomics tables to combine and their sources, in order of source priority."""
+    files = []
+    for f in sorted(metab_dir.glob("*.csv")):
+        source = next((source for source in METABOLOMICS_SOURCES if source in f.name), None)
+        if source is not None and "metadata" not in f.name:
+            files.append((source, f))
+    return sorted(files, key=lambda file: METABOLOMICS_SOURCES.index(file[0]))
+
+
+def _load_metabolomics(metab_dir: Path) -> tuple:
+    """Loads metabolomic data and the source of each row."""
     logging.info("Parsing Metabolomics Data...")
-    df = pd.concat(
-        [
-            pd.read_csv(f, index_col=0)
-            for f in METAB.glob("*.csv")
-            if ("EMSL" in f.name or "JHU" in f.name) and "metadata" not in f.name
-        ]
+    files = _metabolomics_files(metab_dir)
+    tables = [pd.read_csv(f, index_col=0) for _, f in files]
+    df = pd.concat(tables)
+    sources = pd.Series(
+        np.repeat([source for source, _ in files], [len(t) for t in tables]),
+        index=df.index,
+        name="Source",
     )
     # df.index = [label.split(")", 1)[-1] for label in df.index]
     logging.info("Loaded Metabolomics Data")
-    return df
+    return df, sources
 
 
-def _load_transcriptomics() -> pd.DataFrame:
-    """Loads transcriptomic data."""
+def _load_transcriptomics(trans_dir: Path, cache_dir: Path) -> pd.DataFrame:
+    """Loads transcriptomic data, parsing the Excel sheet only when it has changed."""
     logging.info("Parsing Transcriptomics Data...")
-    df = pd.read_excel(next(TRANS.glob("*.xlsx")), index_col=0)
+    df = read_excel_cached(next(trans_dir.glob("*.xlsx")), cache_dir, index_col=0)
     logging.info("Loaded Transcriptomics Data")
     return df
 
@@ -78,12 +123,30 @@ def _extract_timepoints(this_df: pd.DataFrame) -> list:
     return list(col_timepts)
 
 
-def _clean_metabolomics(metabolomics_df: pd.DataFrame, transcriptomics_timepts: list) -> pd.DataFrame:
+def _load_id_maps(paths: BuildPaths) -> tuple:
+    """Loads the KEGG to BIGG mapping and the experiment's metabolite ID table."""
+    with open(paths.kegg_to_bigg_map) as f:
+        kegg_to_bigg_map = json.load(f)
+    exp_map = read_excel_cached(paths.exp_id_map, paths.cache, skiprows=1, header=0, index_col=0)
+    return kegg_to_bigg_map, exp_map
+
+
+def _clean_metabolomics(
+    metabolomics_df: pd.DataFrame,
+    transcriptomics_timepts: list,
+    kegg_to_bigg_map: dict,
+    exp_map: pd.DataFrame,
+    sources: pd.Series | None = None,
+    source_priority: tuple = METABOLOMICS_SOURCES,
+) -> pd.DataFrame:
     """Reduces the metabolomics data
 
     We remove metabolomics data based on the criteria:
     1. Unnamed metabolites from data
     2. Time points of data that don't match transcriptomics data
+    3. Redundant rows mapped to the same BIGG-ID, keeping the row whose source (given by
+       `sources`, one per row of `metabolomics_df`) comes first in `source_priority`, and
+       the first such row among rows of the same source
 
     We also rename rows and columns using the following criteria:
     1. Rename rows using BIGG-IDs
@@ -105,53 +168,50 @@ def _clean_metabolomics(metabolomics_df: pd.DataFrame, transcriptomics_timepts:
     metabolomics_df = metabolomics_df.loc[:, col_keep_idx]
 
     # Rename rows using BIGG-IDs
-    # Get KEGG_to_BIGG mapping
-    with open(KEGG_TO_BIGG_MAP) as f:
-        kegg_to_bigg_map = json.load(f)
-
-    # Create mapping from short names in experiment to BIGG IDs
-    exp_map = pd.read_excel(EXP_ID_MAP, skiprows=1, header=0, index_col=0)
-
-    exp_to_bigg_map = {}
-    count_missing_IDs = 0
-    for idx in exp_map.index:
-        # Only include known metabolites with higher certainty
-        if '*' not in idx and 'unk-' not in idx:
-            kid = exp_map.loc[idx, 'Kegg']
-            bid = exp_map.loc[idx, 'BiGG']
-            # shortname = exp_map.loc[idx,'Abbr name']
-            if not (kid == '' or pd.isna(kid)):
-                if kid in kegg_to_bigg_map:
-                    # exp_to_bigg_map[shortname] = kegg_to_bigg_map[kid]
-                    exp_to_bigg_map[idx] = kegg_to_bigg_map[kid]
-                elif not (bid == '' or pd.isna(bid)):
-                    # exp_to_bigg_map[shortname] = bid
-                    exp_to_bigg_map[idx] = bid
-                else:
-                    print(f"{kid} not found in any mappings")
-                    count_missing_IDs += 1
-
-    print(f"Missing IDs for {count_missing_IDs} metabolites. These rows will be removed for now")
+    exp_to_bigg_map = _experiment_to_bigg_map(exp_map, kegg_to_bigg_map)
 
     # Cleanup metabolics df by renaming index is KEGG and BIGG IDs are available, drop row otherwise
-    metabolomics_df = metabolomics_df.loc[[k for k in exp_to_bigg_map if k in metabolomics_df.index]]
-    metabolomics_df = metabolomics_df.rename(index=exp_to_bigg_map)
-
-    # Remove redundant metabolite names & keep first one only (bias preference to EMSL data vs JHU)
-    metab_idx = [i for i in metabolomics_df.index]
-    metab_idx_idx = np.arange(0, len(metab_idx))
-    remove_idx = []
-    for i, this_idx in enumerate(metab_idx):
-        match_idx = [x == this_idx for x in metab_idx]
-        if sum(match_idx) > 1:
-            other_bad_idx = [x for x in metab_idx_idx[match_idx] if x != i]
-            if all([i < x for x in other_bad_idx]):
-                remove_idx.extend(other_bad_idx)
-    print(f"Remove these indices: {remove_idx}")
-    print(f"Remove these rows-ids: {[metab_idx[i] for i in remove_idx]}")
-    metabolomics_df = metabolomics_df.drop([metab_idx[i] for i in remove_idx])
-
-    return metabolomics_df
+    # Rows are selected by position, as tables of different sources can share row labels
+    measured = metabolomics_df.index.isin(exp_to_bigg_map.index)
+    rows = pd.DataFrame({"Sample": metabolomics_df.index[measured]})
+    if sources is not None:
+        rows["Source"] = np.asarray(sources)[measured]
+    metabolomics_df = metabolomics_df.loc[measured].rename(index=exp_to_bigg_map)
+    rows.insert(0, "BiGG", metabolomics_df.index)
+
+    # Remove redundant metabolite names & keep the one from the preferred source only
+    priority = {source: i for i, source in enumerate(source_priority)}
+    rank = rows["Source"].map(priority).fillna(len(source_priority)) if sources is not None else 0
+    # Stable sort, so the first row is kept among rows of the same source
+    kept = rows.assign(rank=rank).sort_values("rank", kind="stable").drop_duplicates("BiGG")
+    redundant = ~rows.index.isin(kept.index)
+
+    dropped = rows.loc[redundant]
+    logging.info("Removed %d redundant rows:\n%s", len(dropped), dropped.to_string(index=False))
+
+    return metabolomics_df.loc[~redundant]
+
+
+def _experiment_to_bigg_map(exp_map: pd.DataFrame, kegg_to_bigg_map: dict) -> pd.Series:
+    """Maps short names in the experiment to BIGG IDs, through their KEGG IDs where possible."""
+    # Only include known metabolites with higher certainty
+    known = ~(
+        exp_map.index.str.contains("*", regex=False, na=False)
+        | exp_map.index.str.contains("unk-", regex=False, na=False)
+    )
+    kegg_ids = exp_map["Kegg"].replace("", np.nan)
+    bigg_ids = exp_map["BiGG"].replace("", np.nan)
+    has_kegg = known & kegg_ids.notna().to_numpy()
+
+    # Prefer the BIGG ID mapped from the KEGG ID, then the one given in the table
+    exp_to_bigg_map = kegg_ids.map(kegg_to_bigg_map).fillna(bigg_ids)[has_kegg]
+
+    missing = exp_to_bigg_map.isna()
+    for kid in kegg_ids[has_kegg][missing]:
+        logging.info("%s not found in any mappings", kid)
+    logging.info("Missing IDs for %d metabolites. These rows will be removed for now", missing.sum())
+
+    return exp_to_bigg_map[~missing]
 
 
 def _clean_transcriptomics(transcriptomics_df: pd.DataFrame, new_col_names) -> pd.DataFrame:
@@ -171,56 +231,128 @@ def _clean_transcriptomics(transcriptomics_df: pd.DataFrame, new_col_names) -> p
     return transcriptomics_df
 
 
-def main():
-    """Returns a placeholder."""
-    if UNZIPPED.exists():
-        logging.info("Directory '%s' found, proceeding...", UNZIPPED.name)
+def build_stages(paths: BuildPaths) -> list:
+    """Returns the build stages of an experiment, with their input and output files."""
+    metabolomics_csv = paths.output.joinpath("metabolomics.csv")
+    sources_csv = paths.output.joinpath("metabolomics_sources.csv")
+    transcriptomics_csv = paths.output.joinpath("transcriptomics.csv")
+    cleaned = [
+        paths.output.joinpath(name)
+        for name in (
+            "cleaned_metabolomics.csv",
+            "cleaned_transcriptomics.csv",
+            "cleaned_metabolomic_abundance_rates.csv",
+        )
+    ]
+
+    def load():
+        metabolomics, sources = _load_metabolomics(paths.metab)
+        transcriptomics = _load_transcriptomics(paths.trans, paths.cache)
+
+        print("Metabolomics data:")
+        print(metabolomics)
+
+        print("Transcriptomics data:")
+        print(transcriptomics)
+
+        # Save preprocessed dataframes to file
+        metabolomics.to_csv(metabolomics_csv)
+        sources.to_csv(sources_csv)
+        transcriptomics.to_csv(transcriptomics_csv)
+
+    def rates():
+        # Generate and save metabolomic abundance rates (using original metabolomics data)
+        metab_rates = calculate_rates.calculate_rates(pd.read_csv(metabolomics_csv, index_col=0))
+        metab_rates.to_csv(paths.rates)
+
+    def clean():
+        metabolomics = pd.read_csv(metabolomics_csv, index_col=0)
+        transcriptomics = pd.read_csv(transcriptomics_csv, index_col=0)
+        metab_rates = pd.read_csv(paths.rates, index_col=0)
+        # One source per row, in the order of the rows of the metabolomics and rates tables
+        sources = pd.read_csv(sources_csv, index_col=0)["Source"].to_numpy()
+        kegg_to_bigg_map, exp_map = _load_id_maps(paths)
+
+        # Get time points from Transcriptomics data
+        transcript_timepts = _extract_timepoints(transcriptomics)
+
+        print("Timepoints from Transcriptomics data:")
+        print(transcript_timepts)
+
+        # Clean Metabolomics data
+        reduced_metabolomics = _clean_metabolomics(
+            metabolomics, transcript_timepts, kegg_to_bigg_map, exp_map, sources
+        )
+        print("Reduced Metabolomics data:")
+        print(reduced_metabolomics)
+
+        # Clean Transcriptomics data
+        reduced_transcriptomics = _clean_transcriptomics(
+            transcriptomics, new_col_names=reduced_metabolomics.columns
+        )
+        print("Reduced Transcriptomics data:")
+        print(reduced_transcriptomics)
+
+        # Clean rates data
+        reduced_metab_rates = _clean_metabolomics(
+            metab_rates, transcript_timepts, kegg_to_bigg_map, exp_map, sources
+        )
+
+        # Save cleaned dataframes to file
+        reduced = (reduced_metabolomics, reduced_transcriptomics, reduced_metab_rates)
+        for df, path in zip(reduced, cleaned, strict=True):
+            df.to_csv(path)
+
+    return [
+        Stage(
+            "load",
+            load,
+            inputs=[
+                *(f for _, f in _metabolomics_files(paths.metab)),
+                *paths.trans.glob("*.xlsx"),
+                *SCRIPTS,
+            ],
+            outputs=[metabolomics_csv, sources_csv, transcriptomics_csv],
+        ),
+        Stage("rates", rates, inputs=[metabolomics_csv, *SCRIPTS], outputs=[paths.rates]),
+        Stage(
+            "clean",
+            clean,
+            inputs=[
+                metabolomics_csv,
+                sources_csv,
+                transcriptomics_csv,
+                paths.rates,
+                paths.kegg_to_bigg_map,
+                paths.exp_id_map,
+                *SCRIPTS,
+            ],
+            outputs=cleaned,
+        ),
+    ]
+
+
+def main(root: Path = HERE, force: bool = False):
+    """Builds the processed data of the experiment in ``root``, skipping up-to-date stages."""
+    paths = BuildPaths.from_root(root)
+    if paths.unzipped.exists():
+        logging.info("Directory '%s' found, proceeding...", paths.unzipped.name)
     else:
-        logging.info("Directory '%s' not found, unzipping...", UNZIPPED.name)
-        _unzip_data(ZIP_DATA, RAW_DATA)
+        logging.info("Directory '%s' not found, unzipping...", paths.unzipped.name)
+        _unzip_data(paths.zip_data, paths.raw_data)
         logging.info("Unzipping complete, proceeding...")
 
-    metabolomics = _load_metabolomics()
-    transcriptomics = _load_transcriptomics()
-
-    print("Metabolomics data:")
-    print(metabolomics)
-
-    print("Transcriptomics data:")
-    print(transcriptomics)
-
-    # Save preprocessed dataframes to file
-    metabolomics.to_csv(OUTPUT.joinpath("metabolomics.csv"))
-    transcriptomics.to_csv(OUTPUT.joinpath("transcriptomics.csv"))
-
-    # Get time points from Transcriptomics data
-    transcript_timepts = _extract_timepoints(transcriptomics)
+    run_pipeline(build_stages(paths), paths.cache.joinpath("manifest.json"), force=force)
 
-    print("Timepoints from Transcriptomics data:")
-    print(transcript_timepts)
 
-    # Clean Metabolomics data
-    reduced_metabolomics = _clean_metabolomics(metabolomics, transcript_timepts)
-    print("Reduced Metabolomics data:")
-    print(reduced_metabolomics)
-
-    # Clean Transcriptomics data
-    reduced_transcriptomics = _clean_transcriptomics(transcriptomics, new_col_names=reduced_metabolomics.columns)
-    print("Reduced Transcriptomics data:")
-    print(reduced_transcriptomics)
-
-    # Generate and save metabolomic abundance rates (using original metabolomics data)
-    metab_rates = calculate_rates.calculate_rates(metabolomics)
-    metab_rates.to_csv(RATES)
-
-    # Clean rates data
-    reduced_metab_rates = _clean_metabolomics(metab_rates, transcript_timepts)
-
-    # Save cleaned dataframes to file
-    reduced_metabolomics.to_csv(OUTPUT.joinpath("cleaned_metabolomics.csv"))
-    reduced_transcriptomics.to_csv(OUTPUT.joinpath("cleaned_transcriptomics.csv"))
-    reduced_metab_rates.to_csv(OUTPUT.joinpath("cleaned_metabolomic_abundance_rates.csv"))
+def parse_args(description: str) -> argparse.Namespace:
+    """Parses the command line options of the build scripts."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--force", action="store_true", help="rebuild every stage, even if it is up to date"
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    main()
+    main(force=parse_args(__doc__).force)
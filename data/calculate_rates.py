@@ -7,10 +7,12 @@
 #           we take average differences between metabolite abundances
 #           when possible, and take just a difference of consecutive
 #           measurements at the first/last time steps accordingly.
-#           This is calculated for each replicate in the data separately
+#           This is calculated for each sample and replicate in the data separately
 
+import re
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 HERE = Path(__file__).parent.resolve()
@@ -18,47 +20,81 @@ OUTPUT = HERE.joinpath("processed_data")
 METAB = OUTPUT.joinpath("metabolomics.csv")
 RATES = OUTPUT.joinpath("calculated_metabolomic_abundance_rates.csv")
 
+# Sample columns are named <sample>_d<day>_<replicate>, e.g. Se_axen_d1_1
+COLUMN_PATTERN = re.compile(r'(?P<sample>.+)_d(?P<day>\d+)_(?P<replicate>\d+)$')
+
 
 def load_metabolomics_data() -> pd.DataFrame:
     return pd.read_csv(METAB, index_col='Sample')
 
 
-def calculate_rates(metab_df) -> pd.DataFrame:
-    rates_df = pd.DataFrame(index=metab_df.index, columns=metab_df.columns)
-
-    # Calculate rates for day 1: f(d2) - f(d1)
-    day1_cols = [c for c in metab_df.columns if 'd1' in c]
-    day2_cols = [c for c in metab_df.columns if 'd2' in c]
-    for rep in range(1, 4):  # We know there are 3 replicates per day
-        day1_c = [c for c in day1_cols if c[-1] == str(rep)]
-        day2_c = [c for c in day2_cols if c[-1] == str(rep)]
-        for i in range(len(day1_c)):
-            rates_df.loc[:, day1_c[i]] = metab_df.loc[:, day2_c[i]] - metab_df.loc[:, day1_c[i]]
-
-    # Calculate rates for day 2-8: Mean( f(dB) - f(dA), f(dC) - f(dB) )
-    for day in range(2, 9):
-        dayA_cols = [c for c in metab_df.columns if f'd{day - 1}' in c]
-        dayB_cols = [c for c in metab_df.columns if f'd{day}' in c]
-        dayC_cols = [c for c in metab_df.columns if f'd{day + 1}' in c]
-        for rep in range(1, 4):  # We know there are 3 replicates per day
-            dayA_c = [c for c in dayA_cols if c[-1] == str(rep)]
-            dayB_c = [c for c in dayB_cols if c[-1] == str(rep)]
-            dayC_c = [c for c in dayC_cols if c[-1] == str(rep)]
-            for i in range(len(dayB_c)):
-                this_rate_df = pd.DataFrame({'Pre': metab_df.loc[:, dayB_c[i]] - metab_df.loc[:, dayA_c[i]],
-                                             'Post': metab_df.loc[:, dayC_c[i]] - metab_df.loc[:, dayB_c[i]]})
-                rates_df.loc[:, dayB_c[i]] = this_rate_df.mean(axis=1)
-
-    # Calculate rates for day 9: f(d9) - f(d8)
-    day8_cols = [c for c in metab_df.columns if 'd8' in c]
-    day9_cols = [c for c in metab_df.columns if 'd9' in c]
-    for rep in range(1, 4):  # We know there are 3 replicates per day
-        day8_c = [c for c in day8_cols if c[-1] == str(rep)]
-        day9_c = [c for c in day9_cols if c[-1] == str(rep)]
-        for i in range(len(day9_c)):
-            rates_df.loc[:, day9_c[i]] = metab_df.loc[:, day9_c[i]] - metab_df.loc[:, day8_c[i]]
-
-    return rates_df
+def parse_columns(columns) -> pd.MultiIndex:
+    """Parse sample column names into a (sample, day, replicate) MultiIndex."""
+    parsed = pd.Index(columns).str.extract(COLUMN_PATTERN)
+    unparsed = parsed.isna().any(axis=1).to_numpy()
+    if unparsed.any():
+        raise ValueError(f"Columns not named like <sample>_d<day>_<replicate>: {list(pd.Index(columns)[unparsed])}")
+    return pd.MultiIndex.from_arrays(
+        [parsed['sample'], parsed['day'].astype(int), parsed['replicate'].astype(int)],
+        names=['sample', 'day', 'replicate'],
+    )
+
+
+def finite_differences(values, times) -> np.ndarray:
+    """Rates along the last axis: one-sided differences at the ends, the mean of both neighbouring ones inside.
+
+    As in pandas' mean, a missing neighbour is skipped, so an inner rate is only missing when
+    both of its one-sided differences are.
+    """
+    rates = np.full(values.shape, np.nan)
+    if values.shape[-1] < 2:
+        return rates
+    slopes = np.diff(values, axis=-1) / np.diff(times)
+    rates[..., 0] = slopes[..., 0]
+    rates[..., -1] = slopes[..., -1]
+
+    pre, post = slopes[..., :-1], slopes[..., 1:]
+    count = (~np.isnan(pre)).astype(int) + ~np.isnan(post)
+    total = np.where(np.isnan(pre), 0.0, pre) + np.where(np.isnan(post), 0.0, post)
+    with np.errstate(invalid='ignore'):
+        rates[..., 1:-1] = np.where(count > 0, total / count, np.nan)
+    return rates
+
+
+def calculate_rates(metab_df, times=None) -> pd.DataFrame:
+    """Calculate metabolite abundance rates of each sample and replicate over its days.
+
+    inputs:
+        metab_df: dataframe of metabolite abundances, with metabolites as rows and sample columns
+            named <sample>_d<day>_<replicate>
+        times: optional mapping of day to sampling time, for unevenly spaced samples. By default
+            consecutive sampled days are one time unit apart
+    outputs:
+        rates_df: dataframe of rates with the same rows and columns as metab_df
+    """
+    data = metab_df.set_axis(parse_columns(metab_df.columns), axis=1).astype(float)
+
+    blocks = {}
+    for sample in data.columns.unique('sample'):
+        sample_df = data[sample]
+        days = np.sort(sample_df.columns.unique('day'))
+        replicates = np.sort(sample_df.columns.unique('replicate'))
+        if times is None:
+            sample_times = np.arange(len(days), dtype=float)
+        else:
+            sample_times = pd.Series(times, dtype=float).reindex(days)
+            if sample_times.isna().any():
+                raise ValueError(f"No time given for days {list(days[sample_times.isna().to_numpy()])}")
+            sample_times = sample_times.to_numpy()
+
+        # (metabolite, replicate, day) array; replicates missing on a day are NaN
+        columns = pd.MultiIndex.from_product([replicates, days], names=['replicate', 'day'])
+        values = sample_df.reorder_levels(['replicate', 'day'], axis=1).reindex(columns=columns).to_numpy()
+        rates = finite_differences(values.reshape(len(data), len(replicates), len(days)), sample_times)
+        blocks[sample] = pd.DataFrame(rates.reshape(len(data), -1), index=data.index, columns=columns)
+
+    rates_df = pd.concat(blocks, axis=1, names=['sample']).reorder_levels(['sample', 'day', 'replicate'], axis=1)
+    return rates_df.reindex(columns=data.columns).set_axis(metab_df.columns, axis=1)
 
 
 def main():
@@ -0,0 +1,145 @@
+"""Incremental build pipeline for processed omics data.
+
+Each stage declares the files it reads and writes. A manifest records the content hashes
+of the inputs and outputs of every stage's last successful run, and a stage is skipped
+while its inputs are unchanged and its outputs are still in place.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+
+
+@dataclass
+class Stage:
+    """A build step with declared input and output files.
+
+    Parameters
+    ----------
+    name: str
+        Name of the stage in the manifest and log.
+    run: Callable
+        Function without arguments reading the inputs and writing the outputs.
+    inputs: list
+        Paths of the files the stage reads, including the scripts defining it.
+    outputs: list
+        Paths of the files the stage writes.
+    """
+
+    name: str
+    run: Callable[[], None]
+    inputs: list[Path] = field(default_factory=list)
+    outputs: list[Path] = field(default_factory=list)
+
+
+def file_hash(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Content hashes of the inputs and outputs of each stage's last run, stored as JSON."""
+
+    def __init__(self, path: Path):
+        """Load the manifest at ``path``, or start an empty one."""
+        self.path = Path(path)
+        self.stages = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    @staticmethod
+    def _hashes(paths) -> dict:
+        return {str(path): file_hash(path) if path.exists() else None for path in map(Path, paths)}
+
+    def is_current(self, stage: Stage) -> bool:
+        """Return whether the stage's inputs and outputs match its last recorded run."""
+        recorded = self.stages.get(stage.name)
+        return (
+            recorded is not None
+            and recorded["inputs"] == self._hashes(stage.inputs)
+            and recorded["outputs"] == self._hashes(stage.outputs)
+            and None not in recorded["outputs"].values()
+        )
+
+    def record(self, stage: Stage) -> None:
+        """Record the current inputs and outputs of the stage and save the manifest."""
+        self.stages[stage.name] = {
+            "inputs": self._hashes(stage.inputs),
+            "outputs": self._hashes(stage.outputs),
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        tmp.write_text(json.dumps(self.stages, indent=2, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+def run_pipeline(stages: list[Stage], manifest_path: Path, force: bool = False) -> None:
+    """Run the stages in order, skipping those that are up to date.
+
+    Parameters
+    ----------
+    stages: list
+        Stages in dependency order.
+    manifest_path: Path
+        JSON manifest of the previous runs.
+    force: bool
+        Run every stage, even if it is up to date.
+    """
+    manifest = Manifest(manifest_path)
+    for stage in stages:
+        if not force and manifest.is_current(stage):
+            logging.info("Stage '%s' is up to date, skipping", stage.name)
+            continue
+        logging.info("Running stage '%s'...", stage.name)
+        stage.run()
+        manifest.record(stage)
+
+
+def read_excel_cached(path: Path, cache_dir: Path, **kwargs) -> pd.DataFrame:
+    """Read an Excel sheet, caching the parsed dataframe by file content and read options.
+
+    The cache is a Parquet file when pyarrow is installed and the frame is supported, and a
+    pickle otherwise. Both load much faster than openpyxl parses the workbook.
+
+    Parameters
+    ----------
+    path: Path
+        Excel file.
+    cache_dir: Path
+        Directory of the cached dataframes.
+    **kwargs
+        Options passed to ``pd.read_excel``.
+
+    Returns
+    -------
+    pd.DataFrame
+        Parsed sheet.
+    """
+    options = json.dumps(kwargs, sort_keys=True, default=str)
+    key = hashlib.sha256(f"{file_hash(path)}{options}".encode()).hexdigest()[:16]
+    stem = Path(cache_dir).joinpath(f"{Path(path).stem}-{key}")
+
+    if stem.with_suffix(".parquet").exists():
+        return pd.read_parquet(stem.with_suffix(".parquet"))
+    if stem.with_suffix(".pkl").exists():
+        return pd.read_pickle(stem.with_suffix(".pkl"))
+
+    logging.info("Parsing '%s'...", Path(path).name)
+    df = pd.read_excel(path, **kwargs)
+    stem.parent.mkdir(parents=True, exist_ok=True)
+    tmp = stem.with_name(f".{stem.name}.tmp")
+    try:
+        df.to_parquet(tmp)
+        os.replace(tmp, stem.with_suffix(".parquet"))
+    except (ImportError, ValueError, TypeError):  # no pyarrow, or e.g. non-string column names
+        df.to_pickle(tmp)
+        os.replace(tmp, stem.with_suffix(".pkl"))
+    return df
@@ -0,0 +1,124 @@
+"""Compilation backends of the SynBMCA graph.
+
+pytensor compiles the ADVI step function with its C backend by default. The "numba" and
+"jax" backends compile it through pytensor's Numba or JAX (CPU) linkers instead, which
+need numba or jax to be installed. The custom Ops of ``linlog`` get implementations for
+these backends, registered the first time a backend is selected:
+
+- the batched least-squares solve and its gradient are compiled by both;
+- the sparse steady-state solve relies on scipy's sparse factorizations, which the Numba
+  backend runs in object mode and the JAX backend cannot run;
+- emll's per-condition solve in the dense Scan has no JAX implementation, so the JAX
+  backend needs the batched solve.
+"""
+
+import functools
+
+import numpy as np
+
+from syn_bmca import linlog
+
+# pytensor compilation mode of each backend, the default mode for "c"
+MODES = {"c": None, "numba": "NUMBA", "jax": "JAX"}
+
+
+def check_backend(backend: str, sparse: bool = False, batched: bool = False) -> None:
+    """Raise a ValueError if the backend cannot compile a model with these options."""
+    if backend not in MODES:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {list(MODES)}")
+    if backend == "jax" and sparse:
+        raise ValueError("The sparse steady-state solve has no JAX implementation")
+    if backend == "jax" and not batched:
+        raise ValueError("The JAX backend needs the batched steady-state solve (batched=True)")
+
+
+def get_mode(backend: str):
+    """Return the pytensor mode of a backend, registering the linlog Ops with it."""
+    if backend not in MODES:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {list(MODES)}")
+    if backend == "numba":
+        _register_numba()
+    elif backend == "jax":
+        _register_jax()
+    return MODES[backend]
+
+
+@functools.cache
+def _register_numba() -> None:
+    import numba
+    from pytensor.link.numba.dispatch import numba_funcify
+
+    @numba.njit
+    def pinv(A, eps):  # noqa: N803
+        # Same cutoff as numpy's lstsq, see linlog._batched_pinv
+        return np.linalg.pinv(A, max(A.shape[0], A.shape[1]) * eps)
+
+    @numba_funcify.register(linlog.BatchedLeastSquaresSolve)
+    def numba_funcify_batched_solve(op, node, **kwargs):
+        eps = np.finfo(node.inputs[0].dtype).eps
+
+        @numba.njit
+        def batched_solve(A, b):  # noqa: N803
+            x = np.empty((A.shape[0], A.shape[2]), dtype=A.dtype)
+            for i in range(A.shape[0]):
+                x[i] = pinv(np.ascontiguousarray(A[i]), eps) @ np.ascontiguousarray(b[i])
+            return x
+
+        return batched_solve
+
+    @numba_funcify.register(linlog.BatchedLeastSquaresSolveGrad)
+    def numba_funcify_batched_solve_grad(op, node, **kwargs):
+        eps = np.finfo(node.inputs[0].dtype).eps
+
+        @numba.njit
+        def batched_solve_grad(A, b, x, g):  # noqa: N803
+            g_A = np.empty_like(A)  # noqa: N806
+            g_b = np.empty_like(b)
+            for i in range(A.shape[0]):
+                A_i = np.ascontiguousarray(A[i])  # noqa: N806
+                P = pinv(A_i, eps)  # noqa: N806
+                Pt = np.ascontiguousarray(P.T)  # noqa: N806
+                x_i, g_i = np.ascontiguousarray(x[i]), np.ascontiguousarray(g[i])
+                Ptg = Pt @ g_i  # noqa: N806
+                r = b[i] - A_i @ x_i
+                null_g = g_i - P @ (A_i @ g_i)
+                g_A[i] = -np.outer(Ptg, x_i) + np.outer(r, P @ Ptg) + np.outer(Pt @ x_i, null_g)
+                g_b[i] = Ptg
+            return g_A, g_b
+
+        return batched_solve_grad
+
+
+@functools.cache
+def _register_jax() -> None:
+    import jax.numpy as jnp
+    from pytensor.link.jax.dispatch import jax_funcify
+
+    def pinv(A):  # noqa: N803
+        # Same cutoff as numpy's lstsq, see linlog._batched_pinv
+        return jnp.linalg.pinv(A, max(A.shape[-2:]) * jnp.finfo(A.dtype).eps)
+
+    @jax_funcify.register(linlog.BatchedLeastSquaresSolve)
+    def jax_funcify_batched_solve(op, **kwargs):
+        def batched_solve(A, b):  # noqa: N803
+            return jnp.einsum("inm,im->in", pinv(A), b)
+
+        return batched_solve
+
+    @jax_funcify.register(linlog.BatchedLeastSquaresSolveGrad)
+    def jax_funcify_batched_solve_grad(op, **kwargs):
+        def batched_solve_grad(A, b, x, g):  # noqa: N803
+            P = pinv(A)  # noqa: N806
+            Ptg = jnp.einsum("inm,in->im", P, g)  # noqa: N806
+            PPtg = jnp.einsum("inm,im->in", P, Ptg)  # noqa: N806
+            Ptx = jnp.einsum("inm,in->im", P, x)  # noqa: N806
+            r = b - jnp.einsum("imn,in->im", A, x)
+            null_g = g - jnp.einsum("inm,im->in", P, jnp.einsum("imn,in->im", A, g))
+            g_A = (  # noqa: N806
+                -jnp.einsum("im,in->imn", Ptg, x)
+                + jnp.einsum("im,in->imn", r, PPtg)
+                + jnp.einsum("im,in->imn", Ptx, null_g)
+            )
+            return g_A, Ptg
+
+        return batched_solve_grad
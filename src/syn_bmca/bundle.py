@@ -0,0 +1,153 @@
+"""Packed binary bundle of the measurements SynBMCA is fit to.
+
+A bundle is a single ``.npz`` file holding the reference fluxes and the metabolite,
+enzyme and flux measurements as float64 arrays, with their reaction, metabolite and
+condition labels as fixed-width strings. Loading a bundle skips CSV parsing, and the
+values round-trip bit for bit.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever the layout of the bundle changes.
+BUNDLE_VERSION = 1
+
+# Measurement tables, with the measured ids as rows and the conditions as columns
+TABLES = ("metabolites", "enzymes", "fluxes")
+
+
+def read_v_star(v_star) -> pd.Series:
+    """Return the reference fluxes, reading them from a headerless CSV if given a path."""
+    if isinstance(v_star, pd.Series):
+        return v_star
+    return pd.read_csv(v_star, header=None, index_col=0)[1]
+
+
+def read_table(table) -> pd.DataFrame:
+    """Return a measurement table, reading it from a CSV if given a path."""
+    if isinstance(table, pd.DataFrame):
+        return table
+    return pd.read_csv(table, index_col=0)
+
+
+def _name(name):
+    """Return an index or series name as a JSON value, e.g. the integer names of headerless CSVs."""
+    return name.item() if isinstance(name, np.generic) else name
+
+
+def save_bundle(path, v_star, metabolites, enzymes, fluxes) -> Path:
+    """Write the inputs of SynBMCA to a bundle.
+
+    The file is written next to its destination first and moved into place.
+
+    Parameters
+    ----------
+    path: str or Path
+        Destination ``.npz`` file.
+    v_star: pd.Series
+        Reference fluxes, indexed by reaction id.
+    metabolites, enzymes, fluxes: pd.DataFrame
+        Measurements, with the measured ids as rows and the conditions as columns.
+
+    Returns
+    -------
+    Path
+        Path of the bundle.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tables = dict(zip(TABLES, (metabolites, enzymes, fluxes), strict=True))
+
+    arrays = {
+        "v_star": v_star.to_numpy(dtype=float),
+        "v_star.index": v_star.index.astype(str).to_numpy(dtype=str),
+    }
+    names = {"v_star": {"index": _name(v_star.index.name), "name": _name(v_star.name)}}
+    for name, table in tables.items():
+        arrays[name] = table.to_numpy(dtype=float)
+        arrays[f"{name}.index"] = table.index.astype(str).to_numpy(dtype=str)
+        arrays[f"{name}.columns"] = table.columns.astype(str).to_numpy(dtype=str)
+        names[name] = {"index": _name(table.index.name), "columns": _name(table.columns.name)}
+    metadata = {"version": BUNDLE_VERSION, "names": names}
+
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, metadata=np.array(json.dumps(metadata, default=str)), **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+def load_bundle(path) -> dict:
+    """Load the inputs of SynBMCA from a bundle written by ``save_bundle``.
+
+    Parameters
+    ----------
+    path: str or Path
+        Bundle ``.npz`` file.
+
+    Returns
+    -------
+    dict
+        The "v_star" Series and the "metabolites", "enzymes" and "fluxes" DataFrames.
+    """
+    with np.load(path, allow_pickle=False) as bundle:
+        metadata = json.loads(bundle["metadata"].item())
+        if metadata["version"] != BUNDLE_VERSION:
+            raise ValueError(
+                f"Bundle version {metadata['version']} of {path} is not supported, "
+                f"expected {BUNDLE_VERSION}"
+            )
+        names = metadata["names"]
+
+        inputs = {
+            "v_star": pd.Series(
+                bundle["v_star"],
+                index=pd.Index(bundle["v_star.index"], dtype=object, name=names["v_star"]["index"]),
+                name=names["v_star"]["name"],
+            )
+        }
+        for name in TABLES:
+            inputs[name] = pd.DataFrame(
+                bundle[name],
+                index=pd.Index(bundle[f"{name}.index"], dtype=object, name=names[name]["index"]),
+                columns=pd.Index(
+                    bundle[f"{name}.columns"], dtype=object, name=names[name]["columns"]
+                ),
+            )
+    return inputs
+
+
+def convert_csvs(
+    path,
+    v_star_path,
+    metabolite_concentrations_path,
+    enzyme_measurements_path,
+    fluxes_path,
+) -> Path:
+    """Pack the CSV inputs of SynBMCA into a bundle.
+
+    The CSVs are read the same way ``SynBMCA`` reads them.
+
+    Parameters
+    ----------
+    path: str or Path
+        Destination ``.npz`` file.
+    v_star_path, metabolite_concentrations_path, enzyme_measurements_path, fluxes_path:
+        CSV files of the reference fluxes and measurements.
+
+    Returns
+    -------
+    Path
+        Path of the bundle.
+    """
+    return save_bundle(
+        path,
+        read_v_star(v_star_path),
+        read_table(metabolite_concentrations_path),
+        read_table(enzyme_measurements_path),
+        read_table(fluxes_path),
+    )
@@ -0,0 +1,224 @@
+"""Content-addressed on-disk cache for the structural inputs of SynBMCA.
+
+Building the stoichiometric and elasticity matrices requires parsing the cobra
+model, which dominates start-up time for repeated runs on the same model. The
+cache stores every array produced by ``SynBMCA.preprocess_data`` as a separate
+``.npy`` file (sparse matrices as their CSR components) so that it can be
+memory-mapped on load, alongside a small JSON file holding the non-array
+metadata (compartments and labels).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Bump whenever the way the cached arrays are derived from the model changes.
+CACHE_VERSION = 2
+
+STRUCTURE_ARRAYS = (
+    "N",
+    "Ex",
+    "Ey",
+    "Nr",
+    "L",
+    "x_inds",
+    "e_inds",
+    "v_inds",
+    "e_laplace_inds",
+    "e_zero_inds",
+    "e_indexer",
+)
+
+METADATA_FILE = "metadata.json"
+
+
+def file_digest(path) -> str:
+    """Return the sha256 hex digest of a file's contents.
+
+    Parameters
+    ----------
+    path: str or Path
+        File to hash.
+
+    Returns
+    -------
+    str
+        Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def preprocess_key(
+    model_path,
+    v_star: pd.Series,
+    compartment_rules: dict,
+    measured: dict,
+    layout: str = "dense",
+    random_seed: int | None = None,
+) -> str:
+    """Build the cache key for a model, reference flux and measurement layout.
+
+    Parameters
+    ----------
+    model_path: str or Path
+        Path to the cobra model file.
+    v_star: pd.Series
+        Reference fluxes, indexed by reaction id.
+    compartment_rules: dict
+        Rules used to assign compartments to reactions.
+    measured: dict
+        Measured metabolite/reaction ids, which determine the index arrays.
+    layout: str
+        Storage layout of the matrices, either "dense" or "sparse".
+    random_seed: int, optional
+        Seed of the random initial elasticities. Unseeded runs share one entry, and so
+        reuse the elasticities drawn by the first of them.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the cached entry.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}-{layout}-{random_seed}".encode())
+    digest.update(file_digest(model_path).encode())
+    digest.update(pd.util.hash_pandas_object(v_star, index=True).to_numpy().tobytes())
+    digest.update(json.dumps(compartment_rules, sort_keys=True).encode())
+    digest.update(json.dumps({k: list(v) for k, v in measured.items()}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def topology_key(arrays: dict, options: dict) -> str:
+    """Build the key of a model's compiled pytensor graph.
+
+    Models with the same key build the same graph, up to the values of its data and
+    initial values, and can share a compile cache.
+
+    Parameters
+    ----------
+    arrays: dict
+        Dense arrays or sparse matrices named in ``STRUCTURE_ARRAYS``. Only the shape of
+        ``Ex`` is used, as its values are the random initial guess.
+    options: dict
+        JSON-serializable options that change the graph, e.g. the number of conditions.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the graph.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}".encode())
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+    for name in STRUCTURE_ARRAYS:
+        array = arrays[name]
+        digest.update(f"{name}{array.shape}".encode())
+        if name == "Ex":
+            continue
+        if sparse.issparse(array):
+            array = sparse.csr_matrix(array)
+            parts = (array.data, array.indices, array.indptr)
+        else:
+            parts = (array,)
+        for part in parts:
+            digest.update(np.ascontiguousarray(part).tobytes())
+    return digest.hexdigest()
+
+
+def load_preprocessed(cache_dir, key: str, mmap_mode: str | None = "r") -> dict | None:
+    """Load a cached preprocessing entry.
+
+    Parameters
+    ----------
+    cache_dir: str or Path
+        Root directory of the cache.
+    key: str
+        Key returned by ``preprocess_key``.
+    mmap_mode: str, optional
+        Memory-map mode passed to ``np.load``; ``None`` reads arrays into memory.
+
+    Returns
+    -------
+    dict or None
+        Arrays and metadata of the entry, or ``None`` on a cache miss.
+    """
+    entry = Path(cache_dir).joinpath(key)
+    if not entry.joinpath(METADATA_FILE).exists():
+        return None
+
+    with open(entry.joinpath(METADATA_FILE)) as f:
+        cached = json.load(f)
+    for name in STRUCTURE_ARRAYS:
+        if name in cached.get("sparse", {}):
+            data, indices, indptr = (
+                np.load(entry.joinpath(f"{name}.{part}.npy"), mmap_mode=mmap_mode)
+                for part in ("data", "indices", "indptr")
+            )
+            cached[name] = sparse.csr_matrix(
+                (data, indices, indptr), shape=tuple(cached["sparse"][name])
+            )
+        else:
+            cached[name] = np.load(entry.joinpath(f"{name}.npy"), mmap_mode=mmap_mode)
+    return cached
+
+
+def save_preprocessed(cache_dir, key: str, arrays: dict, metadata: dict) -> Path:
+    """Write a preprocessing entry to the cache.
+
+    The entry is written to a temporary directory first and moved into place, so
+    concurrent jobs never observe a partially written entry.
+
+    Parameters
+    ----------
+    cache_dir: str or Path
+        Root directory of the cache.
+    key: str
+        Key returned by ``preprocess_key``.
+    arrays: dict
+        Dense arrays or sparse matrices named in ``STRUCTURE_ARRAYS``.
+    metadata: dict
+        JSON-serializable metadata stored next to the arrays.
+
+    Returns
+    -------
+    Path
+        Directory of the cache entry.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry = cache_dir.joinpath(key)
+    if entry.joinpath(METADATA_FILE).exists():
+        return entry
+
+    tmp = Path(tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}-"))
+    try:
+        shapes = {}
+        for name in STRUCTURE_ARRAYS:
+            if sparse.issparse(arrays[name]):
+                matrix = sparse.csr_matrix(arrays[name])
+                shapes[name] = list(matrix.shape)
+                for part in ("data", "indices", "indptr"):
+                    np.save(tmp.joinpath(f"{name}.{part}.npy"), getattr(matrix, part))
+            else:
+                np.save(tmp.joinpath(f"{name}.npy"), np.asarray(arrays[name]))
+        with open(tmp.joinpath(METADATA_FILE), "w") as f:
+            json.dump(metadata | {"sparse": shapes}, f)
+        os.replace(tmp, entry)
+    except OSError:
+        # Another job populated the entry first
+        if not entry.joinpath(METADATA_FILE).exists():
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return entry
@@ -1,50 +1,152 @@
+import logging
+import math
+
 import numpy as np
+import pandas as pd
 from optlang.symbolics import add
 
+from syn_bmca import parallel
+from syn_bmca.fba_utils import compile_gpr, evaluate_gpr
 
-def EFlux2(model, Transcriptomics):
-    eflux2_model = model.copy()
-    # Parse GPR into a dict containing isozymes (separated by 'or')
-    # Each isozyme has a set of subunits (separated by 'and')
-    gpr_dict = dict()
-    for r in eflux2_model.reactions:
-        if r.gene_reaction_rule:
-            temp = set()
-            for x in [x.strip('() ') for x in r.gene_reaction_rule.split(' or ')]:
-                temp.add(frozenset(y.strip('() ') for y in x.split(' and ')))
-            gpr_dict[r.id] = temp
-    # Set the bounds using the transcriptomics data
-    for r in eflux2_model.reactions:
-        if r.gene_reaction_rule:
-            t = np.sum([np.min([Transcriptomics.loc[g] if g in Transcriptomics.index
-                                else np.array([np.Inf]) for g in p])
-                        for p in gpr_dict[r.id]])
-            if r.lower_bound < 0.0:
-                r.lower_bound = -t
-            else:
-                pass
-            if r.upper_bound > 0.0:
-                r.upper_bound = t
-            else:
-                pass
-        else:
-            if r.lower_bound <= -1000.0:
-                r.lower_bound = -np.Inf
-            if r.upper_bound >= 1000.0:
-                r.upper_bound = np.Inf
-    # solve FBA to calculate the maximum biomass
-    eflux2_model.tolerance = 1e-9
-    fba_sol = eflux2_model.optimize()
-    print('FBA status', fba_sol.status)
-    print('FBA solution', fba_sol.objective_value)
-    # Constrain the biomass to the optimal value
-    for r in eflux2_model.reactions:
-        if r.objective_coefficient:
+logger = logging.getLogger(__name__)
+
+
+class EFlux2Engine:
+    """E-Flux2 solver reused across transcriptomic conditions.
+
+    The model is copied, its gene reaction rules are compiled and the quadratic objective is
+    built once. Each condition then only updates reaction bounds and switches between the
+    stored FBA and QP objectives, so the solver keeps its problem (and basis) between solves
+    and starts every condition from the previous solution.
+    inputs:
+        model: cobra model, left unchanged
+        tolerance: solver tolerance
+    """
+
+    def __init__(self, model, tolerance=1e-9):
+        self.model = model.copy()
+        self.model.tolerance = tolerance
+        self.reactions = list(self.model.reactions)
+        self.compiled_gpr = compile_gpr(self.model)
+
+        self.lower_bounds = np.array([r.lower_bound for r in self.reactions], dtype=float)
+        self.upper_bounds = np.array([r.upper_bound for r in self.reactions], dtype=float)
+        self.biomass_reactions = [r for r in self.reactions if r.objective_coefficient]
+
+        self.fba_objective = self.model.solver.objective
+        # minimize the sum of squared flux values, built once as it is slow for large models
+        self.qp_objective = self.model.problem.Objective(
+            add([r.flux_expression**2 for r in self.reactions]), direction='min', sloppy=True
+        )
+
+    def condition_bounds(self, transcriptomics: pd.DataFrame):
+        """Return the E-Flux2 lower and upper bounds of each reaction (rows) in each condition (columns)."""
+        activity = evaluate_gpr(self.compiled_gpr, transcriptomics)
+        has_gpr = self.compiled_gpr['has_gpr'][:, None]
+        lower = self.lower_bounds[:, None]
+        upper = self.upper_bounds[:, None]
+
+        # Reactions with a rule are bounded by their enzyme activity, the others are opened up
+        lower_bounds = np.where(
+            has_gpr,
+            np.where(lower < 0.0, -activity, lower),
+            np.where(lower <= -1000.0, -np.inf, lower),
+        )
+        upper_bounds = np.where(
+            has_gpr,
+            np.where(upper > 0.0, activity, upper),
+            np.where(upper >= 1000.0, np.inf, upper),
+        )
+        return lower_bounds, upper_bounds
+
+    def solve_bounds(self, lower_bounds, upper_bounds, name=None):
+        """Solve E-Flux2 with the given reaction bounds.
+
+        inputs:
+            lower_bounds: array of reaction lower bounds
+            upper_bounds: array of reaction upper bounds
+            name: condition name used in log messages
+        outputs:
+            eflux2_sol: cobra solution of the quadratic program
+        """
+        for r, lb, ub in zip(self.reactions, lower_bounds, upper_bounds, strict=True):
+            r.bounds = (lb, ub)
+
+        # solve FBA to calculate the maximum biomass
+        # (objectives are set on the solver directly, the cobra setter rebuilds the one it replaces)
+        self.model.solver.objective = self.fba_objective
+        fba_sol = self.model.optimize()
+        logger.info('%s FBA status %s, solution %s', name, fba_sol.status, fba_sol.objective_value)
+
+        # Constrain the biomass to the optimal value
+        for r in self.biomass_reactions:
             r.lower_bound = fba_sol.objective_value
-    # minimize the sum of squared flux values
-    eflux2_model.objective = eflux2_model.problem.Objective(add([r.flux_expression**2 for r in eflux2_model.reactions]), direction='min')
-    eflux2_sol = eflux2_model.optimize()
-    print('EFlux2 status', eflux2_sol.status)
-    print('EFlux2 solution', eflux2_sol.objective_value)
-    # return eflux2 solution
-    return (eflux2_sol)
+
+        # minimize the sum of squared flux values
+        self.model.solver.objective = self.qp_objective
+        eflux2_sol = self.model.optimize()
+        logger.info('%s EFlux2 status %s, solution %s', name, eflux2_sol.status, eflux2_sol.objective_value)
+        return eflux2_sol
+
+    def solve(self, transcriptomics: pd.Series):
+        """Solve E-Flux2 for a single condition, returning the cobra solution."""
+        lower_bounds, upper_bounds = self.condition_bounds(transcriptomics.to_frame())
+        return self.solve_bounds(lower_bounds[:, 0], upper_bounds[:, 0], name=transcriptomics.name)
+
+    def solve_many(self, transcriptomics: pd.DataFrame) -> pd.DataFrame:
+        """Solve E-Flux2 for every condition (column) of the transcriptomics data.
+
+        outputs:
+            fluxes: dataframe of E-Flux2 fluxes with reaction ids as rows and conditions as columns
+        """
+        lower_bounds, upper_bounds = self.condition_bounds(transcriptomics)
+        fluxes = {
+            condition: self.solve_bounds(lower_bounds[:, i], upper_bounds[:, i], name=condition).fluxes
+            for i, condition in enumerate(transcriptomics.columns)
+        }
+        return pd.DataFrame(fluxes, index=[r.id for r in self.reactions], columns=transcriptomics.columns)
+
+
+# Engine of each worker process, built once by _init_worker
+_worker_engine = None
+
+
+def _init_worker(model, tolerance):
+    global _worker_engine
+    _worker_engine = EFlux2Engine(model, tolerance=tolerance)
+
+
+def _solve_worker(transcriptomics):
+    return _worker_engine.solve_many(transcriptomics)
+
+
+def eflux2_batch(model, transcriptomics: pd.DataFrame, max_workers=1, tolerance=1e-9):
+    """Run E-Flux2 for every condition of the transcriptomics data.
+
+    With several workers, the conditions are split into contiguous blocks, one per worker,
+    and each worker reuses a single engine for its block.
+    inputs:
+        model: cobra model
+        transcriptomics: dataframe of gene expression, with genes as rows and conditions as columns
+        max_workers: number of worker processes, None for all available CPUs
+        tolerance: solver tolerance
+    outputs:
+        fluxes: dataframe of E-Flux2 fluxes with reaction ids as rows and conditions as columns
+    """
+    n_conditions = transcriptomics.shape[1]
+    max_workers = min(max_workers or parallel.available_cpus(), n_conditions)
+    if max_workers <= 1:
+        return EFlux2Engine(model, tolerance=tolerance).solve_many(transcriptomics)
+
+    block_size = math.ceil(n_conditions / max_workers)
+    blocks = [transcriptomics.iloc[:, i : i + block_size] for i in range(0, n_conditions, block_size)]
+    with parallel.limit_threads(1), parallel.process_pool(
+        max_workers, initializer=_init_worker, initargs=(model, tolerance)
+    ) as pool:
+        fluxes = list(pool.map(_solve_worker, blocks))
+    return pd.concat(fluxes, axis=1)
+
+
+def EFlux2(model, Transcriptomics):
+    """Run E-Flux2 for a single condition, given gene expression as a series indexed by gene."""
+    return EFlux2Engine(model).solve(Transcriptomics)
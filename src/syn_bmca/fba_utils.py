@@ -1,11 +1,15 @@
+import math
 
-import cobra
 import numpy as np
 import pandas as pd
 from cobra import Gene, Reaction
+from cobra.util.solver import fix_objective_as_constraint
+from optlang.symbolics import Zero
 
+from syn_bmca import parallel
 
-def get_flux_bounds(model, rxns_of_interest, zero_threshold=1e-9):
+
+def get_flux_bounds(model, rxns_of_interest, zero_threshold=1e-9, processes=None):
     """Get flux bounds from FVA to use in surrogate model of reference strain.
 
     The model is optimized to get fluxes for reactions of interest and runs FVA to get flux bounds adjusted by FVA for all other reactions.
@@ -13,6 +17,7 @@ def get_flux_bounds(model, rxns_of_interest, zero_threshold=1e-9):
         model: cobra model
         rxns_of_interest: list of reactions of interest, corresponding to reference strain selection criteria
         zero_threshold: magnitude threshold to identify and replace numerically zero flux values
+        processes: number of FVA worker processes, None for all available CPUs
     outputs:
         flux_bounds: flux min and max values to be used as a representative bounds of the reference strain.
     """
@@ -25,16 +30,117 @@ def get_flux_bounds(model, rxns_of_interest, zero_threshold=1e-9):
 
     # Run FVA to get (reasonably) tight bounds for all other reactions
     keep_rxn_list = [r.id for r in model.reactions if (r.id not in rxns_of_interest)]
-    flux_bounds = cobra.flux_analysis.flux_variability_analysis(model=model, reaction_list=keep_rxn_list,
-                                                               fraction_of_optimum=0.85, processes=8)
-    for c in flux_bounds.columns:
-        for r in flux_bounds.index:
-            if (flux_bounds[c][r] > -1 * zero_threshold) and (flux_bounds[c][r] < zero_threshold):
-                flux_bounds[c][r] = 0
+    flux_bounds = flux_variability(model, keep_rxn_list, fraction_of_optimum=0.85, processes=processes)
+    flux_bounds = flux_bounds.mask(flux_bounds.abs() < zero_threshold, 0.0)
 
     return model, flux_bounds
 
 
+class FluxVariability:
+    """Flux variability analysis reusing one solver for all reactions.
+
+    The objective is fixed as a constraint once, and each reaction only swaps the linear
+    coefficients of the objective and its direction, so every solve starts from the
+    previous basis. The primal solution of every solve is also tracked: once any solution
+    reaches a reaction's lower (upper) bound, its minimum (maximum) is known and is not solved.
+    inputs:
+        model: cobra model, left unchanged
+        fraction_of_optimum: fraction of the optimal objective value the fluxes must reach
+        objective_bound: bound on the objective, computed from fraction_of_optimum if not given
+    """
+
+    def __init__(self, model, fraction_of_optimum=0.85, objective_bound=None):
+        self.model = model.copy()
+        self.objective_bound = fix_objective_as_constraint(
+            self.model, fraction=fraction_of_optimum, bound=objective_bound
+        )
+        self.model.objective = self.model.problem.Objective(Zero, direction='max', sloppy=True)
+
+        reactions = self.model.reactions
+        self.index = {r.id: i for i, r in enumerate(reactions)}
+        self.lower_bounds = np.array([r.lower_bound for r in reactions], dtype=float)
+        self.upper_bounds = np.array([r.upper_bound for r in reactions], dtype=float)
+        self.forward_names = [r.forward_variable.name for r in reactions]
+        self.reverse_names = [r.reverse_variable.name for r in reactions]
+        # Extreme fluxes over all primal solutions found so far
+        self.seen_min = np.full(len(reactions), np.inf)
+        self.seen_max = np.full(len(reactions), -np.inf)
+
+    def _record_primal(self):
+        primal = self.model.solver.primal_values
+        fluxes = np.fromiter(
+            (primal[f] - primal[r] for f, r in zip(self.forward_names, self.reverse_names, strict=True)),
+            dtype=float,
+            count=len(self.forward_names),
+        )
+        np.minimum(self.seen_min, fluxes, out=self.seen_min)
+        np.maximum(self.seen_max, fluxes, out=self.seen_max)
+
+    def solve(self, reaction_list) -> pd.DataFrame:
+        """Return the minimum and maximum flux of each reaction id, as cobra's FVA does."""
+        tolerance = self.model.tolerance
+        objective = self.model.solver.objective
+        flux_bounds = np.full((len(reaction_list), 2), np.nan)
+        for n, rxn_id in enumerate(reaction_list):
+            i = self.index[rxn_id]
+            rxn = self.model.reactions[i]
+            objective.set_linear_coefficients({rxn.forward_variable: 1, rxn.reverse_variable: -1})
+            for column, direction in enumerate(('min', 'max')):
+                if direction == 'min' and self.seen_min[i] <= self.lower_bounds[i] + tolerance:
+                    flux_bounds[n, column] = self.lower_bounds[i]
+                elif direction == 'max' and self.seen_max[i] >= self.upper_bounds[i] - tolerance:
+                    flux_bounds[n, column] = self.upper_bounds[i]
+                else:
+                    objective.direction = direction
+                    flux_bounds[n, column] = self.model.slim_optimize()
+                    if self.model.solver.status == 'optimal':
+                        self._record_primal()
+            objective.set_linear_coefficients({rxn.forward_variable: 0, rxn.reverse_variable: 0})
+
+        return pd.DataFrame(flux_bounds, index=list(reaction_list), columns=['minimum', 'maximum'])
+
+
+# Solver of each FVA worker process, built once by _init_fva_worker
+_fva_worker = None
+
+
+def _init_fva_worker(model, fraction_of_optimum, objective_bound):
+    global _fva_worker
+    _fva_worker = FluxVariability(model, fraction_of_optimum, objective_bound)
+
+
+def _solve_fva_block(reaction_list):
+    return _fva_worker.solve(reaction_list)
+
+
+def flux_variability(model, reaction_list=None, fraction_of_optimum=0.85, processes=None):
+    """Run flux variability analysis, split over worker processes.
+
+    inputs:
+        model: cobra model
+        reaction_list: reaction ids to analyse, all reactions if None
+        fraction_of_optimum: fraction of the optimal objective value the fluxes must reach
+        processes: number of worker processes, None for all available CPUs
+    outputs:
+        flux_bounds: dataframe of the minimum and maximum flux of each reaction
+    """
+    if reaction_list is None:
+        reaction_list = [r.id for r in model.reactions]
+    fva = FluxVariability(model, fraction_of_optimum)
+    processes = min(processes or parallel.available_cpus(), len(reaction_list))
+    if processes <= 1:
+        return fva.solve(reaction_list)
+
+    # Contiguous blocks, so each worker reuses its solver over many reactions
+    block_size = math.ceil(len(reaction_list) / processes)
+    blocks = [reaction_list[i : i + block_size] for i in range(0, len(reaction_list), block_size)]
+    initargs = (model, fraction_of_optimum, fva.objective_bound)
+    with parallel.limit_threads(1), parallel.process_pool(
+        processes, initializer=_init_fva_worker, initargs=initargs
+    ) as pool:
+        return pd.concat(pool.map(_solve_fva_block, blocks))
+
+
 # Function to create dictionary of reactions to isozyme sets (corresponding genes from gene reaction rules)
 def get_gpr_dict(model):
     """Returns the gene reaction rule (GPR) for each reaction in the model."""
@@ -84,10 +190,82 @@ def gene_expression_to_enzyme_activity(model, gpr: dict[Reaction, list[list[Gene
     return enzyme_activity
 
 
+def compile_gpr(model, gpr: dict | None = None) -> dict:
+    """Compile the gene reaction rules of a model into index arrays.
+
+    Flattens the isozymes of every reaction into a list of subunit genes, so that
+    `evaluate_gpr` can apply the rules to many conditions with vectorized reductions.
+    inputs:
+        model: cobra model
+        gpr: dictionary returned by get_gpr_dict(model), computed if not given
+    outputs:
+        compiled_gpr: dictionary of
+            reactions: list of all model reactions
+            genes: array of the gene names used in any gene reaction rule
+            subunit_genes: index into genes of the subunits of each isozyme, grouped by isozyme
+            isozyme_starts: offset of the first subunit of each isozyme in subunit_genes
+            reaction_starts: offset of the first isozyme of each reaction with a rule
+            has_gpr: boolean mask of the reactions with a gene reaction rule
+    """
+    if gpr is None:
+        gpr = get_gpr_dict(model)
+
+    genes = {}
+    subunit_genes, isozyme_starts, reaction_starts, has_gpr = [], [], [], []
+    for rxn in model.reactions:
+        has_gpr.append(rxn in gpr)
+        if rxn in gpr:
+            reaction_starts.append(len(isozyme_starts))
+            # Iterate in the same order as gene_expression_to_enzyme_activity, so sums match exactly
+            for isozyme in gpr[rxn]:
+                isozyme_starts.append(len(subunit_genes))
+                subunit_genes.extend(genes.setdefault(gene, len(genes)) for gene in isozyme)
+
+    return {
+        'reactions': list(model.reactions),
+        'genes': np.array(list(genes), dtype=object),
+        'subunit_genes': np.array(subunit_genes, dtype=int),
+        'isozyme_starts': np.array(isozyme_starts, dtype=int),
+        'reaction_starts': np.array(reaction_starts, dtype=int),
+        'has_gpr': np.array(has_gpr, dtype=bool),
+    }
+
+
+def evaluate_gpr(compiled_gpr: dict, expression: pd.DataFrame) -> np.ndarray:
+    """Map gene expression of many conditions to enzyme activity in one vectorized pass.
+
+    Follows the conventions of gene_expression_to_enzyme_activity: an isozyme takes the minimum
+    expression of its measured subunits (infinity if none is measured), a reaction the sum over its
+    isozymes (NaN without a gene reaction rule), and NaN expression values propagate.
+    inputs:
+        compiled_gpr: dictionary returned by compile_gpr
+        expression: dataframe of gene expression, with genes as rows and conditions as columns
+    outputs:
+        enzyme_activity: array of enzyme activity with reactions as rows and conditions as columns
+    """
+    n_conditions = expression.shape[1]
+    gene_rows = expression.index.get_indexer(compiled_gpr['genes'])
+    measured = gene_rows >= 0
+
+    # Unmeasured genes are infinite, the identity of the minimum over subunits
+    gene_expression = np.full((len(gene_rows), n_conditions), np.inf)
+    gene_expression[measured] = expression.to_numpy(dtype=float)[gene_rows[measured]]
+
+    enzyme_activity = np.full((len(compiled_gpr['reactions']), n_conditions), np.nan)
+    if len(compiled_gpr['reaction_starts']):
+        subunits = gene_expression[compiled_gpr['subunit_genes']]
+        isozymes = np.minimum.reduceat(subunits, compiled_gpr['isozyme_starts'], axis=0)
+        enzyme_activity[compiled_gpr['has_gpr']] = np.add.reduceat(isozymes, compiled_gpr['reaction_starts'], axis=0)
+
+    return enzyme_activity
+
+
 # Function to convert transciptomics data to enzyme activity
 def convert_transcriptomics_to_enzyme_activity(transcriptomics_data: pd.DataFrame, model):  # gpr: dict[Reaction, list[list[Gene]]]):
     """Convert transcriptomics data to enzyme activity.
 
+    The gene reaction rules are compiled once and evaluated for all strains at the same time, with the
+    same results as applying gene_expression_to_enzyme_activity to each strain.
     inputs:
         transcriptomics_data: dataframe of transcriptomics data
         model: cobra model
@@ -95,29 +273,17 @@ def convert_transcriptomics_to_enzyme_activity(transcriptomics_data: pd.DataFram
     outputs:
         enzyme_activity_df: dataframe of enzyme activity converted from transcriptomics data
     """
-    # Initialize empty dataframe
-    enzyme_activity_df = pd.DataFrame()
-
     # Get gene production rules
-    gpr = get_gpr_dict(model)
-
-    # Loop through each strain to convert each column of transcriptomics data
-    for this_strain in transcriptomics_data.columns:
-        # Create dict of genes and corresponding float values using trancsciptomics data
-        expression_dict = {g: transcriptomics_data.loc[g][this_strain] for g in transcriptomics_data.index}
-
-        # Run the gene expression to enzyme activity converter for this_strain
-        enzyme_activity_dict = gene_expression_to_enzyme_activity(model, gpr, expression_dict)
-
-        # Initialize empty dataframe
-        if this_strain == transcriptomics_data.columns[0]:
-            # Use enzyme_activity_dict keys as the index
-            enzyme_activity_df = enzyme_activity_df.reindex(enzyme_activity_dict.keys())
-            # Add reaction ID column
-            enzyme_activity_df['Reaction_ID'] = [k.id for k in enzyme_activity_dict]
+    compiled_gpr = compile_gpr(model, get_gpr_dict(model))
 
-        # Add enzymze_activity to dataframe
-        enzyme_activity_df[this_strain] = enzyme_activity_dict
+    # Convert all strains of transcriptomics data at once
+    enzyme_activity_df = pd.DataFrame(
+        evaluate_gpr(compiled_gpr, transcriptomics_data),
+        index=pd.Index(compiled_gpr['reactions'], dtype=object),
+        columns=transcriptomics_data.columns,
+    )
+    # Add reaction ID column
+    enzyme_activity_df.insert(0, 'Reaction_ID', [r.id for r in compiled_gpr['reactions']])
 
     return enzyme_activity_df
 
@@ -0,0 +1,371 @@
+"""Variational inference runners for SynBMCA."""
+
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pymc as pm
+from fastprogress.fastprogress import progress_bar
+from pymc.blocking import DictToArrayBijection, RaveledVars
+from scipy import optimize
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZERS = {
+    "adadelta": pm.adadelta,
+    "adagrad": pm.adagrad,
+    "adagrad_window": pm.adagrad_window,
+    "adam": pm.adam,
+    "adamax": pm.adamax,
+    "momentum": pm.momentum,
+    "nesterov_momentum": pm.nesterov_momentum,
+    "rmsprop": pm.rmsprop,
+    "sgd": pm.sgd,
+}
+
+# Initial standard deviation of PyMC's mean-field approximation, softplus(0)
+ADVI_SIGMA = float(np.log(2))
+
+
+class ELBOConvergence:
+    """Callback stopping a fit once the windowed mean loss stops improving.
+
+    Every ``every`` iterations, the mean loss (negative ELBO) over the last ``window``
+    iterations is compared with the mean over the ``window`` iterations before it, and
+    the fit stops when their relative difference falls below ``tolerance``.
+    """
+
+    def __init__(self, window=1000, tolerance=1e-3, every=100):
+        """Initialize the convergence test."""
+        self.window = window
+        self.tolerance = tolerance
+        self.every = every
+
+    def __call__(self, approx, hist, i):
+        """Raise StopIteration if the fit has converged."""
+        if i % self.every or len(hist) < 2 * self.window:
+            return
+        current = np.mean(hist[-self.window :])
+        previous = np.mean(hist[-2 * self.window : -self.window])
+        if abs(current - previous) <= self.tolerance * abs(previous):
+            raise StopIteration(f"ELBO converged after {i} iterations")
+
+
+def save_checkpoint(path, approx, hist) -> None:
+    """Write the variational parameters and loss history of a fit.
+
+    The file is written next to its destination first and moved into place, so an
+    interrupted write never corrupts the previous checkpoint.
+
+    Parameters
+    ----------
+    path: str or Path
+        Destination ``.npz`` file.
+    approx: pm.Approximation
+        Approximation whose shared parameters are saved.
+    hist: array-like
+        Loss history of the fit so far.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    params = {f"param_{i}": p.get_value() for i, p in enumerate(approx.params)}
+    with open(tmp, "wb") as f:
+        np.savez(f, hist=np.asarray(hist), **params)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, approx) -> np.ndarray:
+    """Restore the variational parameters saved by ``save_checkpoint``.
+
+    Parameters
+    ----------
+    path: str or Path
+        Checkpoint ``.npz`` file.
+    approx: pm.Approximation
+        Approximation of the same model, updated in place.
+
+    Returns
+    -------
+    np.ndarray
+        Loss history stored in the checkpoint.
+    """
+    with np.load(path) as checkpoint:
+        for i, p in enumerate(approx.params):
+            p.set_value(checkpoint[f"param_{i}"])
+        return checkpoint["hist"]
+
+
+def hessian_diagonal(grad, x) -> np.ndarray:
+    """Return the diagonal of the Hessian of a function, by central differences of its gradient.
+
+    Each element costs two gradient evaluations, one on either side of ``x`` along its
+    unit vector, so only first derivatives are needed.
+
+    Parameters
+    ----------
+    grad: Callable
+        Gradient of the function, from and to flat arrays.
+    x: np.ndarray
+        Point at which the Hessian is evaluated.
+
+    Returns
+    -------
+    np.ndarray
+        Second derivatives of the function along each element of ``x``.
+    """
+    steps = np.cbrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(x))
+    diag = np.empty(len(x))
+    for i, step in enumerate(steps):
+        shift = np.zeros(len(x))
+        shift[i] = step
+        diag[i] = (grad(x + shift)[i] - grad(x - shift)[i]) / (2 * step)
+    return diag
+
+
+def map_start(model, start=None, maxeval=5000, max_sigma=ADVI_SIGMA):
+    """Find the MAP point of a model with L-BFGS, to start ADVI from.
+
+    The standard deviations are those of a diagonal Laplace approximation at the MAP
+    point: the inverse square roots of the diagonal of the Hessian of the negative log
+    density, in the unconstrained space, from ``hessian_diagonal``. Only first
+    derivatives of the model are needed, but two gradient evaluations per element of
+    the free variables.
+
+    Parameters
+    ----------
+    model: pm.Model
+        Model to optimize. Its log density must be deterministic, so not minibatched.
+    start: dict, optional
+        Starting point of the optimization, the model's initial point by default.
+    maxeval: int
+        Maximum number of evaluations of the log density.
+    max_sigma: float
+        Bound on the standard deviations, also used where the curvature is not positive.
+        By default ADVI's own initial standard deviation.
+
+    Returns
+    -------
+    tuple
+        The MAP point, keyed by value variable name, and the flat standard deviations of
+        each value variable, as the ``start`` and ``start_sigma`` of ``ADVIRunner``.
+    """
+    point = model.initial_point() | (start or {})
+    x0 = DictToArrayBijection.map({value.name: point[value.name] for value in model.value_vars})
+    logp_dlogp = model.compile_fn(
+        [-model.logp(jacobian=False), -model.dlogp(jacobian=False)],
+        inputs=model.value_vars,
+    )
+
+    def objective(x):
+        return logp_dlogp(DictToArrayBijection.rmap(RaveledVars(x, x0.point_map_info)))
+
+    result = optimize.minimize(
+        objective, x0.data, jac=True, method="L-BFGS-B", options={"maxfun": maxeval}
+    )
+    logger.info("MAP optimization: %s", result.message)
+
+    precision = hessian_diagonal(lambda x: objective(x)[1], result.x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.where(precision > 0, 1 / np.sqrt(precision), max_sigma)
+    sigma = RaveledVars(np.minimum(sigma, max_sigma), x0.point_map_info)
+
+    point = DictToArrayBijection.rmap(RaveledVars(result.x, x0.point_map_info))
+    start_sigma = {
+        name: values.ravel() for name, values in DictToArrayBijection.rmap(sigma).items()
+    }
+    return point, start_sigma
+
+
+class ADVIRunner:
+    """Mean-field ADVI fit with periodic checkpoints and early stopping.
+
+    The optimizer state (e.g. adagrad_window's gradient history) is not checkpointed, so
+    a resumed fit restarts its optimizer from the restored variational parameters.
+
+    The step function is compiled on the first run and reused by later runs of the same
+    runner, e.g. after the model's data were swapped with ``pm.set_data``. Every run
+    starts from the initial state of the approximation and optimizer, with the means and
+    standard deviations of the current ``start`` and ``start_sigma``, e.g. a MAP point of
+    the swapped data.
+    """
+
+    def __init__(
+        self,
+        model,
+        n_iter=40_000,
+        optimizer="adagrad_window",
+        learning_rate=0.005,
+        total_grad_norm_constraint=100,
+        checkpoint_path=None,
+        checkpoint_every=1000,
+        convergence_window=1000,
+        tolerance=1e-3,
+        random_seed=None,
+        start=None,
+        start_sigma=None,
+        callbacks=None,
+        progressbar=True,
+        profile=False,
+        mode=None,
+    ):
+        """Initialize the runner.
+
+        Parameters
+        ----------
+        model: pm.Model
+            Model to fit.
+        n_iter: int
+            Maximum number of iterations, including those restored from a checkpoint.
+        optimizer: str
+            Name of a PyMC optimizer in ``OPTIMIZERS``.
+        learning_rate: float
+            Learning rate of the optimizer.
+        total_grad_norm_constraint: float
+            Bound on the total gradient norm of each step.
+        checkpoint_path: str or Path, optional
+            File the fit is checkpointed to and resumed from.
+        checkpoint_every: int
+            Number of iterations between checkpoints.
+        convergence_window: int, optional
+            Window of the ELBO convergence test; ``None`` disables early stopping.
+        tolerance: float
+            Relative tolerance of the ELBO convergence test.
+        random_seed: int, optional
+            Seed of the ADVI Monte Carlo gradient estimates.
+        start: dict, optional
+            Initial means of the approximation, keyed by value variable name.
+        start_sigma: dict, optional
+            Initial standard deviations of the approximation, keyed likewise.
+        callbacks: list, optional
+            Additional callables with the ``(approx, hist, i)`` signature of ``pm.fit``.
+        progressbar: bool
+            Whether to display a progress bar.
+        profile: bool
+            Whether to profile the step function with pytensor, see ``step.profile``.
+        mode: str, optional
+            pytensor mode the step function is compiled with, e.g. "NUMBA" or "JAX".
+        """
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f"Unknown optimizer {optimizer!r}, expected one of {list(OPTIMIZERS)}")
+
+        self.model = model
+        self.n_iter = n_iter
+        self.optimizer = optimizer
+        self.learning_rate = learning_rate
+        self.total_grad_norm_constraint = total_grad_norm_constraint
+        self.checkpoint_path = None if checkpoint_path is None else Path(checkpoint_path)
+        self.checkpoint_every = checkpoint_every
+        self.random_seed = random_seed
+        self.start = start
+        self.start_sigma = start_sigma
+        self.progressbar = progressbar
+        self.profile = profile
+        self.mode = mode
+        # Time the last run spent compiling and in the step function, and its number of steps
+        self.compile_seconds = 0.0
+        self.step_seconds = 0.0
+        self.n_steps = 0
+
+        self.callbacks = list(callbacks or [])
+        if convergence_window is not None:
+            self.callbacks.append(ELBOConvergence(convergence_window, tolerance))
+
+        # Compiled by the first run
+        self.inference = None
+        self.step = None
+        self.initial_state = None
+
+    def step_function(self, inference):
+        """Compile the optimization step of an ADVI inference, returning the loss."""
+        return inference.objective.step_function(
+            obj_optimizer=OPTIMIZERS[self.optimizer](learning_rate=self.learning_rate),
+            total_grad_norm_constraint=self.total_grad_norm_constraint,
+            score=True,
+            fn_kwargs={"profile": self.profile, "mode": self.mode},
+        )
+
+    def compile(self):
+        """Compile the inference and its step function, or reset those of a previous run.
+
+        Returns
+        -------
+        tuple
+            The ``pm.ADVI`` inference and its step function.
+        """
+        if self.inference is None:
+            start = time.perf_counter()
+            with self.model:
+                self.inference = pm.ADVI(
+                    random_seed=self.random_seed, start=self.start, start_sigma=self.start_sigma
+                )
+                self.step = self.step_function(self.inference)
+            # Variational parameters, optimizer accumulators and random generators, but not
+            # the model's data, which may have been swapped since
+            data = set(self.model.named_vars.values())
+            self.initial_state = [
+                (shared, shared.get_value())
+                for shared in self.step.get_shared()
+                if shared not in data
+            ]
+            self.compile_seconds = time.perf_counter() - start
+        else:
+            self.compile_seconds = 0.0
+            for shared, value in self.initial_state:
+                shared.set_value(value)
+            if self.start is not None or self.start_sigma is not None:
+                (group,) = self.inference.approx.groups
+                with self.model:
+                    params = group.create_shared_params(self.start, self.start_sigma)
+                for name, param in params.items():
+                    group.params_dict[name].set_value(param.get_value())
+        return self.inference, self.step
+
+    def run(self):
+        """Run the fit, resuming from the checkpoint if one exists.
+
+        Returns
+        -------
+        tuple
+            The fitted ``pm.Approximation`` and its loss (negative ELBO) history. The
+            approximation is shared by all runs of this runner.
+        """
+        inference, step = self.compile()
+        approx = inference.approx
+
+        hist = np.empty(self.n_iter)
+        n_done = 0
+        if self.checkpoint_path is not None and self.checkpoint_path.exists():
+            restored = load_checkpoint(self.checkpoint_path, approx)[: self.n_iter]
+            n_done = len(restored)
+            hist[:n_done] = restored
+            logger.info("Resuming ADVI from iteration %d of %d", n_done, self.n_iter)
+
+        self.step_seconds, self.n_steps = 0.0, 0
+        progress = progress_bar(range(n_done, self.n_iter), display=self.progressbar)
+        try:
+            for i in progress:
+                start = time.perf_counter()
+                hist[i] = step()
+                self.step_seconds += time.perf_counter() - start
+                self.n_steps += 1
+                n_done = i + 1
+                if not np.isfinite(hist[i]):
+                    raise FloatingPointError(f"NaN occurred in optimization at iteration {i}")
+                if i % 100 == 0:
+                    progress.comment = f"Average Loss = {np.mean(hist[max(0, i - 99) : n_done]):,.5g}"
+                if self.checkpoint_path is not None and n_done % self.checkpoint_every == 0:
+                    save_checkpoint(self.checkpoint_path, approx, hist[:n_done])
+                for callback in self.callbacks:
+                    callback(approx, hist[:n_done], n_done)
+        except StopIteration as stop:
+            logger.info(str(stop))
+        finally:
+            # Keep the last finite state, e.g. when the fit is interrupted
+            if self.checkpoint_path is not None and n_done and np.isfinite(hist[n_done - 1]):
+                save_checkpoint(self.checkpoint_path, approx, hist[:n_done])
+
+        inference.hist = hist[:n_done]
+        return approx, inference.hist
@@ -0,0 +1,514 @@
+"""Linlog steady-state solvers used by SynBMCA in place of emll's dense Scan solve."""
+
+import hashlib
+
+import cobra
+import emll
+import numpy as np
+import pymc as pm
+import pytensor.sparse as ps
+import pytensor.tensor as pt
+from pytensor.gradient import grad_not_implemented
+from pytensor.graph.basic import Apply
+from pytensor.graph.op import Op
+from scipy import linalg, sparse
+from scipy.sparse.linalg import factorized
+
+
+def create_sparse_stoichiometric_matrix(model) -> sparse.csr_matrix:
+    """Return the stoichiometric matrix of a cobra model in CSR format."""
+    return cobra.util.create_stoichiometric_matrix(model, array_type="lil").tocsr()
+
+
+def create_sparse_elasticity_matrix(model) -> sparse.csr_matrix:
+    """Return the elasticity guess of ``emll.util.create_elasticity_matrix`` in CSR format.
+
+    Entry (j, i) is the sign of the elasticity of reaction j for metabolite i: every
+    participant of a reversible reaction, and only the substrates of an irreversible one.
+    """
+    m_ind = model.metabolites.index
+    rows, cols, vals = [], [], []
+    for j, reaction in enumerate(model.reactions):
+        for metabolite, stoich in reaction.metabolites.items():
+            if (
+                reaction.reversibility
+                or (reaction.upper_bound > 0 and stoich < 0)
+                or (reaction.lower_bound < 0 and stoich > 0)
+            ):
+                rows.append(j)
+                cols.append(m_ind(metabolite))
+                vals.append(-np.sign(stoich))
+
+    shape = (len(model.reactions), len(model.metabolites))
+    return sparse.csr_matrix((vals, (rows, cols)), shape=shape, dtype=float)
+
+
+def create_sparse_Ey_matrix(model) -> sparse.csr_matrix:  # noqa: N802
+    """Return the external elasticity matrix of ``emll.util.create_Ey_matrix`` in CSR format."""
+    return sparse.csr_matrix(emll.util.create_Ey_matrix(model))
+
+
+def elasticity_support(N, m_compartments, r_compartments) -> tuple[np.ndarray, np.ndarray]:  # noqa: N803
+    """Return the (reaction, metabolite) entries that ``emll.util.initialize_elasticity`` samples.
+
+    These are the stoichiometric entries of ``N.T`` plus the regulatory entries between
+    reactions and metabolites that share a compartment.
+
+    Parameters
+    ----------
+    N: sparse matrix
+        Stoichiometric matrix (metabolites x reactions).
+    m_compartments: list
+        Compartment of each metabolite.
+    r_compartments: list
+        Compartment(s) of each reaction.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Row (reaction) and column (metabolite) indices, sorted row-major.
+    """
+    nm, nr = N.shape
+    support = sparse.csr_matrix(N.T, dtype=bool)
+
+    m_compartments = np.asarray(m_compartments)
+    regulation = sparse.lil_matrix((nr, nm), dtype=bool)
+    for j, r_compartment in enumerate(r_compartments):
+        regulated = np.flatnonzero([m in r_compartment for m in m_compartments])
+        regulation.rows[j] = regulated.tolist()
+        regulation.data[j] = [True] * len(regulated)
+
+    rows, cols = (support + regulation.tocsr()).nonzero()
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order]
+
+
+def stoichiometric_support(N) -> tuple[np.ndarray, np.ndarray]:  # noqa: N803
+    """Return the (reaction, metabolite) entries where the metabolite takes part in the reaction.
+
+    These are the nonzeros of ``N.T``, sorted row-major.
+    """
+    rows, cols = sparse.csr_matrix(N).T.nonzero()
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order]
+
+
+def initialize_sparse_elasticity(
+    N,  # noqa: N803
+    name="ex",
+    sigma=1,
+    alpha=None,
+    rng=None,
+    b=0.01,
+    m_compartments=None,
+    r_compartments=None,
+):
+    """Elasticity prior on a sparse support, as a flat vector.
+
+    The entries of ``stoichiometric_support(N)`` get the kinetic prior of
+    ``emll.util.initialize_elasticity``: a half-normal (or skew-normal, with ``alpha``)
+    magnitude, negative for substrates and positive for products. Without compartments,
+    no regulatory entries are sampled, so the number of parameters is the number of
+    nonzeros of ``N`` rather than growing with the reactions times the metabolites.
+
+    With ``m_compartments`` and ``r_compartments``, the support is that of
+    ``elasticity_support`` instead, and its regulatory entries get emll's Laplace prior
+    of scale ``b``. This is emll's prior without its dense matrix, but the support is
+    still nearly dense for a model whose metabolites mostly share one compartment.
+
+    Parameters
+    ----------
+    N: np.ndarray or sparse matrix
+        Stoichiometric matrix (metabolites x reactions).
+    name: str
+        Prefix of the random variables, as in emll.
+    sigma: float
+        Scale of the elasticity magnitudes.
+    alpha: float, optional
+        Skewness of a skew-normal prior, a half-normal one if None.
+    rng: np.random.Generator, optional
+        Generator of the initial values.
+    b: float
+        Scale of the regulatory entries.
+    m_compartments, r_compartments: list, optional
+        Compartments of the metabolites and reactions, which enable regulatory entries.
+
+    Returns
+    -------
+    tuple
+        The elasticity values (TensorVariable) and their (rows, cols) support.
+    """
+    rng = np.random.default_rng(rng)
+    stoichiometry = sparse.csr_matrix(N).T.tocsr()
+    if m_compartments is None:
+        rows, cols = stoichiometric_support(N)
+    else:
+        rows, cols = elasticity_support(N, m_compartments, r_compartments)
+    entries = np.asarray(stoichiometry[rows, cols]).ravel()
+    kinetic = np.flatnonzero(entries)
+    regulatory = np.flatnonzero(entries == 0)
+    initval = 0.1 + np.abs(rng.standard_normal(len(kinetic)))
+
+    if alpha is None:
+        magnitudes = pm.HalfNormal(
+            f"{name}_kinetic_entries", sigma=sigma, shape=len(kinetic), initval=initval
+        )
+    else:
+        magnitudes = pm.SkewNormal(
+            f"{name}_kinetic_entries",
+            sigma=sigma,
+            alpha=alpha,
+            shape=len(kinetic),
+            initval=initval,
+        )
+    values = magnitudes * -np.sign(entries[kinetic])
+    if len(regulatory):
+        capacity = pm.Laplace(f"{name}_capacity_entries", mu=0, b=b, shape=len(regulatory))
+        indexer = np.concatenate([kinetic, regulatory]).argsort()
+        values = pt.concatenate([values, capacity])[indexer]
+    return values, (rows, cols)
+
+
+def _batched_pinv(A):  # noqa: N803
+    """Return the pseudoinverse of each matrix in a stack, with numpy's lstsq cutoff."""
+    rcond = max(A.shape[-2:]) * np.finfo(A.dtype).eps
+    return np.linalg.pinv(A, rcond=rcond)
+
+
+class BatchedLeastSquaresSolve(Op):
+    """Least-norm solutions of a stack of linear systems ``A[i] x[i] = b[i]``.
+
+    All systems are solved in one call through a stacked pseudoinverse, replacing a Scan
+    over emll's per-condition ``LeastSquaresSolve``.
+    """
+
+    __props__ = ()
+
+    def make_node(self, A, b):  # noqa: N803
+        """Create the Apply node for the (batch, m, n) matrices and (batch, m) vectors."""
+        A = pt.as_tensor_variable(A)  # noqa: N806
+        b = pt.as_tensor_variable(b)
+        x = pt.matrix(dtype=A.dtype)
+        return Apply(self, [A, b], [x])
+
+    def perform(self, node, inputs, output_storage):
+        """Solve every system."""
+        A, b = inputs  # noqa: N806
+        output_storage[0][0] = np.einsum("inm,im->in", _batched_pinv(A), b)
+
+    def infer_shape(self, fgraph, node, input_shapes):
+        """Return the (batch, n) output shape."""
+        A_shape, _ = input_shapes  # noqa: N806
+        return [(A_shape[0], A_shape[2])]
+
+    def L_op(self, inputs, outputs, output_grads):  # noqa: N802
+        """Return gradients with respect to the matrices and right-hand sides."""
+        return BatchedLeastSquaresSolveGrad()(*inputs, outputs[0], output_grads[0])
+
+
+class BatchedLeastSquaresSolveGrad(Op):
+    """Vector-Jacobian product of ``BatchedLeastSquaresSolve``.
+
+    Uses the derivative of the pseudoinverse (Golub & Pereyra, 1973), which holds for
+    rank-deficient systems of constant rank. With ``P = pinv(A)`` and ``r = b - A x``::
+
+        db = P.T g
+        dA = -(P.T g) x.T + r (P P.T g).T + (P.T x) ((I - P A) g).T
+    """
+
+    __props__ = ()
+
+    def make_node(self, A, b, x, g):  # noqa: N803
+        """Create the Apply node for the forward inputs, solution and output gradient."""
+        inputs = [pt.as_tensor_variable(v) for v in (A, b, x, g)]
+        return Apply(self, inputs, [inputs[0].type(), inputs[1].type()])
+
+    def perform(self, node, inputs, output_storage):
+        """Compute the gradients for every system."""
+        A, b, x, g = inputs  # noqa: N806
+        P = _batched_pinv(A)  # noqa: N806
+        Ptg = np.einsum("inm,in->im", P, g)  # noqa: N806
+        PPtg = np.einsum("inm,im->in", P, Ptg)  # noqa: N806
+        Ptx = np.einsum("inm,in->im", P, x)  # noqa: N806
+        r = b - np.einsum("imn,in->im", A, x)
+        null_g = g - np.einsum("inm,im->in", P, np.einsum("imn,in->im", A, g))
+
+        output_storage[0][0] = (
+            -np.einsum("im,in->imn", Ptg, x)
+            + np.einsum("im,in->imn", r, PPtg)
+            + np.einsum("im,in->imn", Ptx, null_g)
+        )
+        output_storage[1][0] = Ptg
+
+    def infer_shape(self, fgraph, node, input_shapes):
+        """Return the shapes of the matrices and right-hand sides."""
+        return input_shapes[:2]
+
+
+def steady_state_batched(ll, Ex, Ey, en, yn):  # noqa: N803
+    """Compute emll's ``steady_state_pytensor`` for all conditions without a Scan.
+
+    Parameters
+    ----------
+    ll: emll.LinLogLeastNorm
+        Linlog model providing the reduced stoichiometry and reference fluxes.
+    Ex, Ey: TensorVariable
+        Elasticity matrices (reactions x metabolites, reactions x external species).
+    en, yn: TensorVariable
+        Enzyme levels (n_exp x reactions) and external species (n_exp x ny).
+
+    Returns
+    -------
+    tuple
+        ``chi_ss`` (n_exp x nm) and ``vn_ss`` (n_exp x nr) tensors.
+    """
+    en = pt.as_tensor_variable(en)
+    yn = pt.as_tensor_variable(yn)
+
+    # N_hat[i] = Nr @ diag(en[i] * v_star)
+    N_hat = (en * ll.v_star)[:, None, :] * ll.Nr[None, :, :]  # noqa: N806
+    inner_v = 1.0 + pt.dot(yn, Ey.T)
+
+    As = pt.tensordot(N_hat, Ex, axes=[[2], [0]])  # noqa: N806
+    bs = -pt.sum(N_hat * inner_v[:, None, :], axis=2)
+    chi_ss = BatchedLeastSquaresSolve()(As, bs)
+
+    vn_ss = en * (1.0 + pt.dot(chi_ss, Ex.T) + pt.dot(yn, Ey.T))
+    return chi_ss, vn_ss
+
+
+def independent_rows(N) -> tuple[sparse.csr_matrix, sparse.csr_matrix]:  # noqa: N803
+    """Return the linearly independent rows of ``N`` and the link matrix ``L``.
+
+    The rows are chosen by a QR decomposition of ``N.T`` with column pivoting, so that
+    ``N = L Nr`` with ``Nr`` of full row rank, as emll's smallbone reduction does. The
+    decomposition is dense, but is only computed once per model.
+
+    Parameters
+    ----------
+    N: np.ndarray or sparse matrix
+        Stoichiometric matrix (metabolites x reactions).
+
+    Returns
+    -------
+    tuple[sparse.csr_matrix, sparse.csr_matrix]
+        ``Nr`` (rank x reactions) and ``L`` (metabolites x rank).
+    """
+    N = sparse.csr_matrix(N)  # noqa: N806
+    dense = N.T.toarray()
+    _, R, pivots = linalg.qr(dense, mode="economic", pivoting=True)  # noqa: N806
+    diagonal = np.abs(np.diag(R))
+    tolerance = max(dense.shape) * np.finfo(float).eps * (diagonal.max() if diagonal.size else 0)
+    rows = np.sort(pivots[: np.count_nonzero(diagonal > tolerance)])
+    Nr = N[rows]  # noqa: N806
+    L = linalg.lstsq(Nr.T.toarray(), dense)[0].T  # noqa: N806
+    L[np.abs(L) < 1e-10] = 0.0
+    return Nr, sparse.csr_matrix(L)
+
+
+class SparseSteadyStateSolve(Op):
+    """Least-norm linlog steady state for all conditions, using sparse factorizations.
+
+    For each condition ``i``, with ``D = diag(en[i] * v_star)``, solves
+    ``Nr D Ex chi = -Nr D c[i]`` for the metabolite deviations ``chi``, where ``Nr`` holds
+    the independent rows of the stoichiometric matrix, ``Ex`` is given by its values on a
+    fixed support and ``c = 1 + Ey yn``. With ``A = Nr D Ex`` of full row rank, the
+    least-norm solution is ``chi = A.T y`` with ``(A A.T) y = b``, which is solved with a
+    sparse LU factorization of ``A A.T``. It equals emll's least-squares solve.
+    """
+
+    __props__ = ("nm", "digest")
+
+    def __init__(self, Nr, v_star, rows, cols, nm):  # noqa: N803
+        """Initialize the Op with the constant structure of the linlog model."""
+        self.Nr = sparse.csr_matrix(Nr)
+        self.v_star = np.asarray(v_star, dtype=float)
+        self.rows = np.asarray(rows)
+        self.cols = np.asarray(cols)
+        self.nm = nm
+        # Hashable summary of the structure, so that equal Ops are merged by pytensor
+        digest = hashlib.sha256()
+        for array in (
+            self.Nr.indptr,
+            self.Nr.indices,
+            self.Nr.data,
+            np.asarray(self.Nr.shape),
+            self.v_star,
+            self.rows,
+            self.cols,
+        ):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        self.digest = digest.hexdigest()
+
+    def make_node(self, ex_values, en, c):
+        """Create the Apply node for the elasticity values, enzyme levels and external term."""
+        ex_values = pt.as_tensor_variable(ex_values)
+        en = pt.as_tensor_variable(en)
+        c = pt.as_tensor_variable(c)
+        chi = pt.matrix(dtype=en.dtype)
+        return Apply(self, [ex_values, en, c], [chi])
+
+    def _systems(self, ex_values, en, c):
+        """Yield the sparse system of each condition, with the factorization of ``A A.T``."""
+        Ex = sparse.csr_matrix(  # noqa: N806
+            (ex_values, (self.rows, self.cols)), shape=(self.Nr.shape[1], self.nm)
+        )
+        for en_i, c_i in zip(en, c, strict=True):
+            d = en_i * self.v_star
+            ND = self.Nr.multiply(d[np.newaxis, :]).tocsr()  # noqa: N806
+            A = (ND @ Ex).tocsr()  # noqa: N806
+            try:
+                solve = factorized((A @ A.T).tocsc())
+            except RuntimeError as error:
+                raise np.linalg.LinAlgError(
+                    "The linlog system has no full row rank, e.g. because of zero fluxes"
+                ) from error
+            yield Ex, d, c_i, A, -(ND @ c_i), solve
+
+    def perform(self, node, inputs, output_storage):
+        """Solve the steady state of every condition."""
+        ex_values, en, c = inputs
+        chi = np.empty((len(en), self.nm), dtype=node.outputs[0].dtype)
+        for i, (_, _, _, A, b, solve) in enumerate(self._systems(ex_values, en, c)):  # noqa: N806
+            chi[i] = A.T @ solve(b)
+        output_storage[0][0] = chi
+
+    def infer_shape(self, fgraph, node, input_shapes):
+        """Return the (n_exp, nm) output shape."""
+        return [(input_shapes[1][0], self.nm)]
+
+    def L_op(self, inputs, outputs, output_grads):  # noqa: N802
+        """Return gradients with respect to the elasticity values, enzyme levels and c."""
+        grad_op = SparseSteadyStateSolveGrad(self.Nr, self.v_star, self.rows, self.cols, self.nm)
+        return grad_op(*inputs, outputs[0], output_grads[0])
+
+
+class SparseSteadyStateSolveGrad(SparseSteadyStateSolve):
+    """Vector-Jacobian product of ``SparseSteadyStateSolve``.
+
+    The least-norm solution is ``chi = pinv(A) b`` with ``A`` of full row rank. With
+    ``y = (A A.T)^-1 b``, ``w = (A A.T)^-1 A g`` and ``h = g - A.T w``, the derivative of
+    the pseudoinverse gives ``dA = y h.T - w chi.T`` and ``db = w``, which are pulled back
+    through ``A = Nr D Ex`` and ``b = -Nr D c`` without forming either outer product.
+    """
+
+    def make_node(self, ex_values, en, c, chi, g_chi):
+        """Create the Apply node for the forward inputs, solution and output gradient."""
+        inputs = [pt.as_tensor_variable(x) for x in (ex_values, en, c, chi, g_chi)]
+        return Apply(self, inputs, [x.type() for x in inputs[:3]])
+
+    def perform(self, node, inputs, output_storage):
+        """Accumulate the gradients over all conditions."""
+        ex_values, en, c, chi, g_chi = inputs
+        g_ex = np.zeros_like(ex_values)
+        g_en = np.zeros_like(en)
+        g_c = np.zeros_like(c)
+        systems = self._systems(ex_values, en, c)
+        for i, (Ex, d, c_i, A, b, solve) in enumerate(systems):  # noqa: N806
+            w = solve(A @ g_chi[i])
+            h = g_chi[i] - A.T @ w
+            p = self.Nr.T @ solve(b)
+            q = self.Nr.T @ w
+
+            g_ex += d[self.rows] * (p[self.rows] * h[self.cols] - q[self.rows] * chi[i][self.cols])
+            g_en[i] = self.v_star * (p * (Ex @ h) - q * (Ex @ chi[i] + c_i))
+            g_c[i] = -d * q
+
+        output_storage[0][0] = g_ex
+        output_storage[1][0] = g_en
+        output_storage[2][0] = g_c
+
+    def infer_shape(self, fgraph, node, input_shapes):
+        """Return the shapes of the forward inputs."""
+        return input_shapes[:3]
+
+    def L_op(self, inputs, outputs, output_grads):  # noqa: N802
+        """Mark the second derivatives, which ADVI and L-BFGS do not need, as not implemented."""
+        return [grad_not_implemented(self, i, x) for i, x in enumerate(inputs)]
+
+
+class SparseLinLogLeastNorm:
+    """Sparse counterpart of ``emll.LinLogLeastNorm`` for the steady-state solve.
+
+    ``N``, ``Ex`` and ``Ey`` are kept as CSR matrices, and the steady state is solved on
+    the independent rows ``Nr`` of ``N`` (see ``independent_rows``), as in emll.
+    """
+
+    def __init__(self, N, Ex, Ey, v_star, support, Nr=None, L=None):  # noqa: N803
+        """Initialize the sparse linlog model.
+
+        Parameters
+        ----------
+        N: sparse matrix
+            Stoichiometric matrix (metabolites x reactions).
+        Ex: sparse matrix
+            Elasticity matrix guess (reactions x metabolites).
+        Ey: sparse matrix
+            External elasticity matrix (reactions x external species).
+        v_star: np.ndarray
+            Reference fluxes, which must be nonnegative.
+        support: tuple[np.ndarray, np.ndarray]
+            Entries of the elasticity matrix sampled in the PyMC model.
+        Nr, L: sparse matrix, optional
+            Precomputed output of ``independent_rows(N)``.
+        """
+        self.N = sparse.csr_matrix(N)
+        self.Ex = sparse.csr_matrix(Ex)
+        self.Ey = sparse.csr_matrix(Ey)
+        self.v_star = np.asarray(v_star, dtype=float)
+        self.nm, self.nr = self.N.shape
+        self.ny = self.Ey.shape[1]
+        if Nr is None:
+            Nr, L = independent_rows(self.N)  # noqa: N806
+        self.Nr = sparse.csr_matrix(Nr)
+        self.L = sparse.csr_matrix(L)
+        self.support = tuple(np.asarray(s) for s in support)
+
+        assert np.all(self.v_star >= 0), "reference fluxes should be nonnegative"
+        assert self.Ex.shape == (self.nr, self.nm), "Ex is the wrong shape"
+        assert self.Ey.shape == (self.nr, self.ny), "Ey is the wrong shape"
+        assert np.allclose(self.N @ self.v_star, 0), "reference not steady state"
+
+    def steady_state_pytensor(self, Ex, Ey=None, en=None, yn=None):  # noqa: N803
+        """Calculate the steady-state metabolite deviations and fluxes of every condition.
+
+        Only the entries of ``Ex`` on ``self.support`` enter the solve. ``Ey`` should be a
+        sparse variable, and defaults to the matrix stored on the model.
+
+        Returns
+        -------
+        tuple
+            ``chi_ss`` (n_exp x nm) and ``vn_ss`` (n_exp x nr) tensors.
+        """
+        rows, cols = self.support
+        return self.steady_state_values(Ex[rows, cols], Ey, en, yn)
+
+    def steady_state_values(self, ex_values, Ey=None, en=None, yn=None):  # noqa: N803
+        """Calculate the steady state from the values of ``Ex`` on ``self.support``.
+
+        The elasticities are never formed as a matrix, so the cost of the solve and its
+        gradient scales with the size of the support.
+
+        Returns
+        -------
+        tuple
+            ``chi_ss`` (n_exp x nm) and ``vn_ss`` (n_exp x nr) tensors.
+        """
+        rows, cols = self.support
+        en = pt.as_tensor_variable(en)
+        yn = pt.as_tensor_variable(yn)
+
+        if Ey is None:
+            Ey = ps.as_sparse_variable(self.Ey)  # noqa: N806
+
+        c = 1.0 + ps.dot(yn, Ey.T)
+        solve = SparseSteadyStateSolve(self.Nr, self.v_star, rows, cols, self.nm)
+        chi_ss = solve(ex_values, en, c)
+
+        # Ex @ chi_ss.T restricted to the support, accumulated by reaction
+        ex_chi = pt.inc_subtensor(
+            pt.zeros((self.nr, en.shape[0]))[rows], ex_values[:, None] * chi_ss.T[cols]
+        )
+        vn_ss = en * (c + ex_chi.T)
+
+        return chi_ss, vn_ss
@@ -0,0 +1,73 @@
+"""Helpers for running work across processes."""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+# Environment variables read by BLAS/OpenMP runtimes when a worker starts
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def available_cpus() -> int:
+    """Return the number of CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS and Windows
+        return os.cpu_count() or 1
+
+
+@contextmanager
+def _environment(variables: dict):
+    """Set environment variables inside the context, restoring their previous values."""
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def limit_threads(n_threads: int):
+    """Limit the BLAS/OpenMP threads of worker processes started inside the context.
+
+    Without the limit, each worker of a process pool uses every core for linear
+    algebra, and the workers oversubscribe the node.
+    """
+    return _environment({name: str(n_threads) for name in THREAD_VARIABLES})
+
+
+def compile_dir(path):
+    """Set the pytensor compile cache of worker processes started inside the context.
+
+    pytensor reads its compile directory once, when it is imported, so the directory of
+    a running process cannot be changed; spawned workers import pytensor anew. With
+    ``path`` None, the workers keep the default directory.
+    """
+    if path is None:
+        return _environment({})
+    flags = os.environ.get("PYTENSOR_FLAGS")
+    # Later flags take precedence over earlier ones
+    base_compiledir = f"base_compiledir={Path(path).resolve()}"
+    return _environment(
+        {"PYTENSOR_FLAGS": f"{flags},{base_compiledir}" if flags else base_compiledir}
+    )
+
+
+def process_pool(max_workers=None, initializer=None, initargs=()) -> ProcessPoolExecutor:
+    """Return a process pool using the 'spawn' start method.
+
+    Spawned workers do not inherit compiled pytensor functions or solver state from the
+    parent, so each one builds its own.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers or available_cpus(),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs,
+    )
@@ -0,0 +1,210 @@
+"""Streaming posterior draws of SynBMCA models to disk in bounded memory."""
+
+from datetime import datetime, timezone
+
+import h5netcdf
+import h5py
+import numpy as np
+import pymc as pm
+
+
+def compile_draws(approx, nodes, size):
+    """Compile a function returning ``size`` new posterior draws of each node per call.
+
+    Parameters
+    ----------
+    approx: pm.Approximation
+        Fitted approximation.
+    nodes: list
+        Tensors of the approximated model to draw.
+    size: int
+        Number of draws per call.
+
+    Returns
+    -------
+    callable
+        Function without arguments returning a list with an array of draws per node.
+    """
+    return pm.pytensorf.compile_pymc([], approx.sample_node(list(nodes), size=size))
+
+
+class RunningMoments:
+    """Mean, standard deviation, minimum and maximum over draws streamed in batches.
+
+    Batches are merged with the pairwise update of Chan et al. (1979), so only one batch
+    needs to be held in memory.
+    """
+
+    def __init__(self):
+        """Initialize empty moments."""
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def update(self, batch):
+        """Add a batch of draws, stacked along the first axis."""
+        batch = np.asarray(batch, dtype=float)
+        n = len(batch)
+        if n == 0:
+            return
+        batch_mean = batch.mean(axis=0)
+        batch_m2 = ((batch - batch_mean) ** 2).sum(axis=0)
+
+        if self.count == 0:
+            self.mean, self.m2 = batch_mean, batch_m2
+            self.min, self.max = batch.min(axis=0), batch.max(axis=0)
+        else:
+            total = self.count + n
+            delta = batch_mean - self.mean
+            self.mean = self.mean + delta * n / total
+            self.m2 = self.m2 + batch_m2 + delta**2 * self.count * n / total
+            self.min = np.minimum(self.min, batch.min(axis=0))
+            self.max = np.maximum(self.max, batch.max(axis=0))
+        self.count += n
+
+    def summary(self) -> dict:
+        """Return the mean, sample standard deviation, minimum and maximum."""
+        std = np.sqrt(self.m2 / max(self.count - 1, 1))
+        return {"mean": self.mean, "std": std, "min": self.min, "max": self.max}
+
+
+class DrawWriter:
+    """Append batches of draws to resizable, chunked HDF5 datasets.
+
+    Each dataset grows along its first (draw) axis and is chunked one draw at a time, so
+    single draws can later be read without loading the rest of the file.
+    """
+
+    def __init__(self, path, compression="lzf"):
+        """Open the HDF5 file at ``path`` for writing, replacing any existing file."""
+        self.file = h5py.File(path, "w")
+        self.compression = compression
+
+    def __enter__(self):
+        """Return the writer."""
+        return self
+
+    def __exit__(self, *exc):
+        """Close the file."""
+        self.close()
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+    def append(self, name, batch):
+        """Append a batch of draws to dataset ``name``, creating it on first use."""
+        batch = np.asarray(batch)
+        if name not in self.file:
+            self.file.create_dataset(
+                name,
+                shape=(0, *batch.shape[1:]),
+                maxshape=(None, *batch.shape[1:]),
+                chunks=(1, *batch.shape[1:]),
+                dtype=batch.dtype,
+                compression=self.compression,
+            )
+        dataset = self.file[name]
+        start = dataset.shape[0]
+        dataset.resize(start + len(batch), axis=0)
+        dataset[start:] = batch
+        self.file.flush()
+
+    def write_labels(self, **labels):
+        """Store the string labels of the dataset axes, e.g. reaction ids."""
+        for name, values in labels.items():
+            self.file.create_dataset(f"labels/{name}", data=np.asarray(values, dtype="S"))
+
+    def write_summary(self, name, moments: RunningMoments):
+        """Store the summary statistics of dataset ``name``."""
+        for stat, values in moments.summary().items():
+            self.file.create_dataset(f"summary/{name}/{stat}", data=values)
+
+
+class NetCDFDrawWriter:
+    """Append batches of draws to a group of a NetCDF file in ArviZ's InferenceData layout.
+
+    Variables have ("chain", "draw", *dims) dimensions with a single chain and an
+    unlimited "draw" dimension, and are chunked one draw at a time, so the file can be
+    opened lazily with ``az.from_netcdf``.
+    """
+
+    def __init__(self, path, dims, coords, group="posterior", compression="gzip"):
+        """Open the NetCDF file at ``path`` for writing, replacing any existing file.
+
+        Parameters
+        ----------
+        path: str or Path
+            NetCDF file to write.
+        dims: dict
+            Names of the dimensions of each variable after "chain" and "draw".
+        coords: dict
+            Labels of the named dimensions. Dimensions without labels are sized from the
+            first batch.
+        group: str
+            InferenceData group to write.
+        compression: str
+            HDF5 compression filter of the variables.
+        """
+        self.file = h5netcdf.File(path, "w")
+        self.group = self.file.create_group(group)
+        self.group.attrs["created_at"] = datetime.now(timezone.utc).isoformat()
+        self.group.attrs["inference_library"] = "pymc"
+        self.dims = dims
+        self.compression = compression
+        self.n_draws = 0
+
+        self.group.dimensions = {"chain": 1, "draw": None} | {
+            dim: len(labels) for dim, labels in coords.items()
+        }
+        self.group.create_variable("chain", ("chain",), data=np.zeros(1, dtype=int))
+        self.group.create_variable("draw", ("draw",), dtype=int)
+        for dim, labels in coords.items():
+            self.group.create_variable(
+                dim,
+                (dim,),
+                dtype=h5py.string_dtype(),
+                data=np.array([str(label) for label in labels], dtype=object),
+            )
+
+    def __enter__(self):
+        """Return the writer."""
+        return self
+
+    def __exit__(self, *exc):
+        """Close the file."""
+        self.close()
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+    def append(self, batch: dict):
+        """Append a batch of draws, stacked along the first axis, of each variable."""
+        n = len(next(iter(batch.values())))
+        for name, values in batch.items():
+            if name not in self.group.variables:
+                self._create(name, np.asarray(values))
+
+        start = self.n_draws
+        self.n_draws += n
+        self.group.resize_dimension("draw", self.n_draws)
+        self.group["draw"][start:] = np.arange(start, self.n_draws)
+        for name, values in batch.items():
+            self.group[name][0, start:] = values
+        self.file.flush()
+
+    def _create(self, name, values):
+        dims = tuple(self.dims.get(name, [f"{name}_dim_{i}" for i in range(values.ndim - 1)]))
+        for dim, size in zip(dims, values.shape[1:], strict=True):
+            if dim not in self.group.dimensions:
+                self.group.dimensions[dim] = size
+        self.group.create_variable(
+            name,
+            ("chain", "draw", *dims),
+            dtype=values.dtype,
+            chunks=(1, 1, *values.shape[1:]),
+            compression=self.compression,
+        )
@@ -0,0 +1,198 @@
+"""Timing and memory instrumentation of SynBMCA runs.
+
+Stages of a run (e.g. ``preprocess_data`` or ``run_emll``) record their wall time and the
+peak memory of the process to a ``RunLog``, ADVI fits add their iteration rate and step
+times, and NUTS runs their effective samples per second. The log is a JSON file holding
+every run in the same output directory, rewritten after every entry so that it is up to
+date while a long fit is still running.
+"""
+
+import functools
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Bump whenever the layout of the run log changes.
+RUN_LOG_VERSION = 1
+
+
+def peak_rss_mb() -> float | None:
+    """Return the peak resident memory of this process so far, in MiB, if available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in KiB on Linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class RunLog:
+    """Structured JSON log of the stages and fits of a run."""
+
+    def __init__(self, path=None):
+        """Log to the JSON file at ``path``, after its previous runs, or only in memory if None."""
+        self.path = None if path is None else Path(path)
+        self.entries = {
+            "id": uuid.uuid4().hex,
+            "started": datetime.now(timezone.utc).isoformat(),
+            "host": platform.node(),
+            "pid": os.getpid(),
+            "stages": [],
+            "fits": [],
+        }
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the wall time and peak memory of the code run inside the context.
+
+        The peak memory is that of the whole process. The increase of the peak is only
+        nonzero if the stage used more memory than any code before it.
+        """
+        peak_before = peak_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            peak_after = peak_rss_mb()
+            self.entries["stages"].append(
+                {
+                    "name": name,
+                    "wall_time_s": time.perf_counter() - start,
+                    "peak_rss_mb": peak_after,
+                    "peak_rss_increase_mb": (
+                        None if peak_after is None else peak_after - peak_before
+                    ),
+                }
+            )
+            self.save()
+
+    def record_fit(self, **fit) -> None:
+        """Record the statistics of a fit, e.g. from ``ADVIProfiler.summary``."""
+        self.entries["fits"].append(fit)
+        self.save()
+
+    def runs(self) -> list:
+        """Return the runs in the log file, including this one once it is saved."""
+        if self.path is None or not self.path.exists():
+            return []
+        with open(self.path) as f:
+            logged = json.load(f)
+        return logged["runs"] if logged.get("version") == RUN_LOG_VERSION else []
+
+    def save(self) -> None:
+        """Write the log, if it has a path, next to its destination first.
+
+        The file is read again before every write, so the runs other processes logged to
+        it in the meantime, e.g. fits in worker processes, are kept.
+        """
+        if self.path is None:
+            return
+        runs = self.runs()
+        ids = [run.get("id") for run in runs]
+        if self.entries["id"] in ids:
+            runs[ids.index(self.entries["id"])] = self.entries
+        else:
+            runs.append(self.entries)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": RUN_LOG_VERSION, "runs": runs}, f, indent=2, default=str)
+        os.replace(tmp, self.path)
+
+
+def logged_stage(method):
+    """Record each call of a method as a stage of the ``run_log`` of its instance."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.run_log.stage(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class ADVIProfiler:
+    """ADVI callback recording the iteration rate of a fit.
+
+    Every ``every`` iterations, the number of iterations per second since the previous
+    record is stored, so slowdowns during the fit show up.
+    """
+
+    def __init__(self, every=1000):
+        """Initialize the profiler."""
+        self.every = every
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the records of a previous fit."""
+        # (time, iteration) of the first and latest calls, and of the last record
+        self.first = None
+        self.latest = None
+        self.recorded = None
+        self.windows = []
+
+    def __call__(self, approx, hist, i):
+        """Record the time of iteration ``i``."""
+        now = (time.perf_counter(), i)
+        if self.first is None:
+            self.first = self.latest = self.recorded = now
+            return
+        self.latest = now
+        if i % self.every == 0:
+            (recorded_time, recorded_i) = self.recorded
+            self.windows.append(
+                {"iteration": i, "iterations_per_s": (i - recorded_i) / (now[0] - recorded_time)}
+            )
+            self.recorded = now
+
+    def summary(self) -> dict:
+        """Return the overall and windowed iteration rates."""
+        rate = None
+        if self.first is not None and self.latest[1] > self.first[1]:
+            rate = (self.latest[1] - self.first[1]) / (self.latest[0] - self.first[0])
+        return {"iterations_per_s": rate, "windows": self.windows}
+
+
+def ess_throughput(trace, var_names, seconds) -> dict:
+    """Return the effective sample sizes of a trace and their rate.
+
+    The bulk ESS of every element of the variables is computed with ArviZ over all
+    chains, and the smallest one, which limits the precision of the posterior means,
+    sets the rate.
+
+    Parameters
+    ----------
+    trace: az.InferenceData
+        Posterior draws of one or more chains.
+    var_names: list[str]
+        Variables whose ESS is computed.
+    seconds: float
+        Time the draws took, e.g. that of the slowest of chains run in parallel.
+
+    Returns
+    -------
+    dict
+        The smallest and median bulk ESS, and the smallest per second.
+    """
+    import arviz as az
+
+    ess = az.ess(trace, var_names=var_names, method="bulk")
+    values = np.concatenate([np.ravel(ess[name].values) for name in var_names])
+    return {
+        "min_ess_bulk": float(np.min(values)),
+        "median_ess_bulk": float(np.median(values)),
+        "ess_per_s": float(np.min(values) / seconds) if seconds > 0 else None,
+    }
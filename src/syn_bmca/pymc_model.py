@@ -1,15 +1,33 @@
 """Script to generate PyMC results for Synechococcus."""
 
-import gzip
+import hashlib
+import time
+import warnings
+from importlib.metadata import version
 from pathlib import Path
 
-import cloudpickle
+import arviz as az
 import cobra
 import emll
 import numpy as np
 import pandas as pd
 import pymc as pm
+import pytensor.sparse as ps
 import pytensor.tensor as pt
+from pymc.data import minibatch_index
+from pytensor.graph.basic import ancestors
+
+from syn_bmca import (
+    backends,
+    bundle,
+    cache,
+    inference,
+    linlog,
+    parallel,
+    posterior,
+    profiling,
+    results,
+)
 
 HERE = Path(__file__).parent.resolve()
 ROOT = HERE.parent.resolve()
@@ -19,6 +37,25 @@ METAB = DATA.joinpath("sucrose_metabolomics.csv")
 EFLUX = DATA.joinpath("enzyme_constrained_fluxes_no_zero.csv")
 PROT = DATA.joinpath("normalized_enzyme_activity_reduced_sucrose_optimized.csv")
 VSTAR = DATA.joinpath("v_star_sucrose_optimized.csv")
+CACHE = ROOT.joinpath(".cache/preprocess")
+
+# Intermediate arrays of the model that can be recorded in traces
+DETERMINISTICS = ("Ex", "log_en_t", "chi_ss", "vn_ss")
+
+# Starting points of ADVI: the random initial point of the priors, or the MAP point
+INITIALIZATIONS = (None, "map")
+
+# Posterior variables exported to InferenceData, with their dimensions after chain and draw
+POSTERIOR_DIMS = {
+    "Ex": ("reaction", "metabolite"),
+    "chi_ss": ("condition", "metabolite"),
+    "vn_ss": ("condition", "reaction"),
+    "log_en_t": ("condition", "reaction"),
+    "yn_t": ("condition", "external"),
+}
+
+# Compartment assigned to reactions touching the extracellular compartment and to exchanges
+COMPARTMENT_RULES = {"extracellular": "e", "transport": "t"}
 
 
 class SynBMCA:
@@ -33,38 +70,368 @@ class SynBMCA:
         fluxes_path,
         reference_state,
         run_inference=True,
+        cache_dir=None,
+        sparse=False,
+        batched=False,
+        sparse_elasticity=False,
+        backend="c",
+        batch_size=None,
+        init=None,
+        output_dir=".",
+        fit_kwargs=None,
+        random_seed=None,
+        n_restarts=1,
+        record_deterministics=None,
+        structure=None,
+        compile_dir=None,
+        profile=False,
+        build_model=True,
     ):
-        """Initialize the SynBMCA Class."""
-        self.model = cobra.io.load_json_model(model_path)
-        self.v_star = pd.read_csv(v_star_path, header=None, index_col=0)[1]
-        self.x = pd.read_csv(metabolite_concentrations_path, index_col=0)
-        self.v = pd.read_csv(fluxes_path, index_col=0)
-        self.e = pd.read_csv(enzyme_measurements_path, index_col=0)
+        """Initialize the SynBMCA Class.
+
+        If ``cache_dir`` is given, the matrices built from the cobra model are stored there
+        and reused by later runs on the same model, v_star and measurements.
+
+        If ``sparse`` is True, ``N``, ``Ex`` and ``Ey`` are kept as CSR matrices and the
+        steady state is solved with sparse factorizations (see ``linlog``), from the
+        elasticities sampled as a flat vector on their support. The dense ``Ex`` is never
+        built for the solve. emll's support includes a regulatory entry for every pair of
+        a reaction and a metabolite sharing a compartment, which is nearly dense for a
+        model of mostly one compartment, so ``sparse`` only saves memory together with
+        ``sparse_elasticity``.
+
+        If ``batched`` is True, the dense steady state of all conditions is solved in one
+        stacked least-squares call instead of emll's Scan over conditions. The sparse
+        solve is always batched.
+
+        If ``sparse_elasticity`` is True, only the elasticities of the metabolites taking
+        part in each reaction are sampled, as a flat vector, instead of emll's prior that
+        also samples regulatory entries (see ``linlog.initialize_sparse_elasticity``).
+        With either option, the dense ``Ex`` is not recorded with every draw by default.
+
+        ``backend`` selects how the ADVI step function is compiled: with pytensor's
+        default C backend ("c"), or through its "numba" or "jax" linkers (see
+        ``backends``). The JAX backend needs ``batched`` and cannot run the sparse solve.
+
+        If ``batch_size`` is given, each ADVI step only solves the steady state and
+        evaluates the likelihood of that many conditions, drawn at random, and scales the
+        likelihood to all conditions (see ``build_pymc_model``).
+
+        If ``init`` is "map", each ADVI fit starts from the MAP point of the model, found
+        with L-BFGS, and from the scales of a diagonal Laplace approximation there (see
+        ``map_initialization``), instead of the random initial point of the priors. Both
+        only need gradients, so work with the sparse and batched solves, but need the
+        full likelihood, so no ``batch_size``.
+
+        Results (see ``results.ResultStore``) and ADVI checkpoints are written to
+        ``output_dir``, and ``fit_kwargs`` are passed to ``run_emll`` (see
+        ``inference.ADVIRunner`` for the available options).
+
+        ``random_seed`` seeds the random initial elasticity guess and external
+        concentrations. If ``n_restarts`` is larger than one, that many independent ADVI
+        fits are run in parallel (see ``run_restarts``) and the best one is kept.
+
+        The reference fluxes and measurements are given as CSV paths or as the pandas
+        objects read from them (see ``from_bundle`` to load them from an input bundle).
+
+        ``record_deterministics`` names the intermediate arrays of ``DETERMINISTICS``
+        stored with every posterior draw, all of them by default. The others are left out
+        of traces and can be recomputed from the free variables with
+        ``recompute_deterministics``.
+
+        ``structure``, returned by ``structure()`` of a model built from the same cobra
+        model, v_star and measured ids, is reused instead of parsing the cobra model.
+
+        The normalized measurements are data containers of the PyMC model, so the model
+        can be fit to new measurements of the same ids and conditions without rebuilding
+        or recompiling it (see ``refit``). If ``compile_dir`` is given, worker processes
+        (see ``run_restarts`` and ``fit_references``) keep their pytensor compile cache in
+        a subdirectory keyed by the topology of the model, which persists between runs.
+
+        The wall time and peak memory of each stage, and the iteration rate and step
+        times of each ADVI fit, are logged to ``output_dir/run_log.json`` (see
+        ``profiling.RunLog``). If ``profile`` is True, the ADVI step function is also
+        profiled by pytensor, and its profile written to ``output_dir/pytensor_profile.txt``.
+
+        If ``build_model`` is False, only the data and structure are prepared: the PyMC
+        model is neither built nor saved, e.g. for a model that is fitted in a worker
+        process and only read back from its results (see ``fit_references``).
+        """
+        # Constructor arguments, used to rebuild this model in worker processes
+        self.init_kwargs = {k: v for k, v in locals().items() if k != "self"}
+
+        self.model_path = model_path
+        self.cache_dir = cache_dir
+        self.sparse = sparse
+        self.batched = batched
+        self.sparse_elasticity = sparse_elasticity
+        backends.check_backend(backend, sparse=sparse, batched=batched)
+        self.backend = backend
+        if batch_size is not None and batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        self.batch_size = batch_size
+        if init not in INITIALIZATIONS:
+            raise ValueError(f"Unknown init {init!r}, expected one of {INITIALIZATIONS}")
+        if init == "map" and batch_size is not None:
+            raise ValueError("The MAP initialization needs the full likelihood, not batch_size")
+        self.init = init
+        if run_inference and not build_model:
+            raise ValueError("Running inference needs the PyMC model, so build_model")
+        if record_deterministics is None:
+            record_deterministics = [
+                name
+                for name in DETERMINISTICS
+                if not ((sparse or sparse_elasticity) and name == "Ex")
+            ]
+        self.record_deterministics = set(record_deterministics)
+        if not self.record_deterministics <= set(DETERMINISTICS):
+            raise ValueError(
+                f"Unknown deterministics {self.record_deterministics - set(DETERMINISTICS)}, "
+                f"expected some of {DETERMINISTICS}"
+            )
+        # Tensors of all deterministics, recorded or not
+        self.deterministics = {}
+        self.output_dir = Path(output_dir)
+        self.results = results.ResultStore(self.output_dir.joinpath("results"))
+        self.run_log = profiling.RunLog(self.output_dir.joinpath("run_log.json"))
+        self.profile = profile
+        self.advi_profiler = profiling.ADVIProfiler()
+        self.fit_kwargs = fit_kwargs or {}
+        self.random_seed = random_seed
+        self.rng = np.random.default_rng(random_seed)
+        # Only loaded when the structural matrices are not found in the cache
+        self.model = None
+        self.v_star = bundle.read_v_star(v_star_path)
+        self.x = bundle.read_table(metabolite_concentrations_path)
+        self.v = bundle.read_table(fluxes_path)
+        self.e = bundle.read_table(enzyme_measurements_path)
 
         self.ref_state = reference_state
-        self.preprocess_data()
-        self.build_pymc_model()
-        self.save_pymc_data()
+        self.preprocess_data(structure)
+        self.compile_dir = (
+            None
+            if compile_dir is None
+            else Path(compile_dir).joinpath(
+                cache.topology_key(
+                    self.structure(),
+                    {
+                        "sparse": self.sparse,
+                        "batched": self.batched,
+                        "sparse_elasticity": self.sparse_elasticity,
+                        "backend": self.backend,
+                        "batch_size": self.batch_size,
+                        "record_deterministics": sorted(self.record_deterministics),
+                        "n_exp": self.n_exp,
+                        "pytensor": version("pytensor"),
+                    },
+                )
+            )
+        )
+        # ADVI runner of the last fit, reused by refit
+        self.runner = None
+        if build_model:
+            self.build_pymc_model()
+            self.save_pymc_data()
 
         # If only building PyMC model, set run_inference to False
         self.run_inference = run_inference
-        if self.run_inference:
-            self.approx, self.hist = self.run_emll()
+        if self.run_inference and n_restarts > 1:
+            self.restarts = self.run_restarts(n_restarts, **self.fit_kwargs)
+            self.approx, self.hist = self.restarts[0]["approx"], self.restarts[0]["hist"]
+            self.save_results(self.approx, self.hist)
+        elif self.run_inference:
+            self.approx, self.hist = self.run_emll(**self.fit_kwargs)
             self.save_results(self.approx, self.hist)
 
-    def preprocess_data(self):
-        """Read in cobra model as components."""
-        # Establish compartments for reactions and metabolites
-        self.r_compartments = [
-            r.compartments if "e" not in r.compartments else "t" for r in self.model.reactions
-        ]
-        # TODO: Find why these were included in Hackett
-        # self.r_compartments[self.model.reactions.index("SUCCt2r")] = "c"
-        # self.r_compartments[self.model.reactions.index("ACt2r")] = "c"
-        for rxn in self.model.exchanges:
-            self.r_compartments[self.model.reactions.index(rxn)] = "t"
-            self.m_compartments = [m.compartment for m in self.model.metabolites]
+    @classmethod
+    def from_bundle(cls, model_path, bundle_path, reference_state, **kwargs):
+        """Create a SynBMCA model from an input bundle.
+
+        Parameters
+        ----------
+        model_path: str or Path
+            Path to the cobra model file.
+        bundle_path: str or Path
+            Bundle written by ``bundle.save_bundle`` or ``bundle.convert_csvs``.
+        reference_state: str
+            Condition the measurements are normalized to.
+        **kwargs
+            Other arguments of ``SynBMCA``.
+        """
+        inputs = bundle.load_bundle(bundle_path)
+        return cls(
+            model_path,
+            inputs["v_star"],
+            inputs["metabolites"],
+            inputs["enzymes"],
+            inputs["fluxes"],
+            reference_state,
+            **kwargs,
+        )
+
+    @classmethod
+    def from_results(cls, path, model_path=None, **kwargs):
+        """Rebuild a SynBMCA model and its fit from a result store.
+
+        The model is rebuilt from the input bundle and arguments recorded in the store,
+        and the fitted variational parameters, if any, are restored into ``approx``.
+
+        Parameters
+        ----------
+        path: str or Path
+            Result store directory, ``output_dir/results`` of the original run.
+        model_path: str or Path, optional
+            Path to the cobra model file, the recorded one by default.
+        **kwargs
+            Arguments of ``SynBMCA`` overriding the recorded ones.
+        """
+        store = results.ResultStore(path)
+        metadata = store.metadata
+        model_path = model_path or metadata["model_path"]
+        if cache.file_digest(model_path) != metadata["model_digest"]:
+            warnings.warn(
+                f"{model_path} changed since the results in {path} were saved", stacklevel=2
+            )
+
+        bmca = cls.from_bundle(
+            model_path,
+            store.inputs_path,
+            metadata["reference_state"],
+            **metadata["build_kwargs"]
+            | {"run_inference": False, "output_dir": store.path.parent}
+            | kwargs,
+        )
+        bmca.load_fit()
+        return bmca
+
+    def load_fit(self):
+        """Restore ``approx`` and ``hist`` from the fit saved in the result store, if any."""
+        with self.results.open_arrays() as f:
+            if "fit" in f:
+                self.hist = f["fit/hist"][()]
+                n_params = sum(name.startswith("param_") for name in f["fit"])
+                self.approx = self.meanfield([f[f"fit/param_{i}"][()] for i in range(n_params)])
+
+    @classmethod
+    def fit_references(
+        cls,
+        model_path,
+        v_star_path,
+        metabolite_concentrations_path,
+        enzyme_measurements_path,
+        fluxes_path,
+        reference_states,
+        output_dir=".",
+        max_workers=None,
+        **kwargs,
+    ):
+        """Build and fit one model per reference state, sharing their structure.
+
+        The inputs are read and the cobra model is parsed once. Each reference state then
+        only normalizes the measurements again. The PyMC models are built and fitted
+        concurrently in worker processes, which write the results and run log of each to
+        ``output_dir/reference_<state>``. The returned models are rebuilt from the saved
+        fits afterwards, without compiling their ADVI step.
+
+        Parameters
+        ----------
+        model_path, v_star_path, metabolite_concentrations_path, enzyme_measurements_path, fluxes_path:
+            Inputs of ``SynBMCA``.
+        reference_states: list[str]
+            Conditions to normalize the measurements to, one model each.
+        output_dir: str or Path
+            Parent directory of the results of each reference state.
+        max_workers: int, optional
+            Number of worker processes, by default one per reference up to the available CPUs.
+        **kwargs
+            Other arguments of ``SynBMCA``; ``fit_kwargs`` are passed to ``run_emll``.
+
+        Returns
+        -------
+        dict
+            Fitted models by reference state.
+        """
+        inputs = (
+            bundle.read_v_star(v_star_path),
+            bundle.read_table(metabolite_concentrations_path),
+            bundle.read_table(enzyme_measurements_path),
+            bundle.read_table(fluxes_path),
+        )
+        structure = None
+        models = {}
+        for reference_state in reference_states:
+            models[reference_state] = cls(
+                model_path,
+                *inputs,
+                reference_state,
+                **kwargs
+                | {
+                    "run_inference": False,
+                    "build_model": False,
+                    "output_dir": Path(output_dir).joinpath(f"reference_{reference_state}"),
+                    "structure": structure,
+                },
+            )
+            structure = structure or models[reference_state].structure()
+
+        max_workers = max_workers or min(len(models), parallel.available_cpus())
+        compile_dir = next(iter(models.values())).compile_dir
+        with (
+            parallel.limit_threads(1),
+            parallel.compile_dir(compile_dir),
+            parallel.process_pool(max_workers) as pool,
+        ):
+            futures = [
+                pool.submit(
+                    _fit_reference,
+                    bmca.init_kwargs | {"structure": structure, "build_model": True},
+                    bmca.fit_kwargs,
+                )
+                for bmca in models.values()
+            ]
+            for future in futures:
+                future.result()
+
+        for bmca in models.values():
+            bmca.build_pymc_model()
+            bmca.load_fit()
+        return models
 
+    @profiling.logged_stage
+    def preprocess_data(self, structure=None):
+        """Normalize the data and read in cobra model as components, unless given its structure."""
+        self.normalize_data()
+        if structure is not None:
+            self.load_structure(structure)
+            return
+
+        cached = None
+        if self.cache_dir is not None:
+            cache_key = cache.preprocess_key(
+                self.model_path,
+                self.v_star,
+                COMPARTMENT_RULES,
+                {"x": self.xn.columns, "e": self.en.columns, "v": self.vn.columns},
+                layout="sparse" if self.sparse else "dense",
+                random_seed=self.random_seed,
+            )
+            cached = cache.load_preprocessed(self.cache_dir, cache_key)
+
+        if cached is None:
+            self.build_structure()
+            if self.cache_dir is not None:
+                structure = self.structure()
+                cache.save_preprocessed(
+                    self.cache_dir,
+                    cache_key,
+                    {name: structure.pop(name) for name in cache.STRUCTURE_ARRAYS},
+                    structure,
+                )
+        else:
+            self.load_structure(cached)
+
+    def normalize_data(self):
+        """Normalize the measurements to the reference state, which is dropped."""
         # Reindex arrays to have the same column ordering
         to_consider = self.x.columns
         self.v = self.v.loc[:, to_consider]
@@ -78,7 +445,7 @@ class SynBMCA:
         # TODO: Reintroduce normalization here, as we currently just take a normalized version as input
         self.en = self.e.T  # (2 ** np.abs(self.e.subtract(self.e[self.ref_state], 0))).T
 
-        v_star_df = pd.DataFrame(self.v_star).reset_index().rename(columns={0: "id", 1: "flux"})
+        v_star_df = pd.DataFrame({"id": self.v_star.index, "flux": self.v_star.to_numpy()})
         v_merge = self.v.merge(v_star_df, left_index=True, right_on="id").set_index("id")
         self.vn = v_merge.divide(v_merge.flux, axis=0).drop("flux", axis=1).T
 
@@ -87,6 +454,27 @@ class SynBMCA:
         self.xn = self.xn.drop(self.ref_state)
         self.en = self.en.drop(self.ref_state)
 
+    @profiling.logged_stage
+    def build_structure(self):
+        """Parse the cobra model into compartments, index arrays and the linlog model."""
+        self.model = cobra.io.load_json_model(self.model_path)
+        self.reaction_ids = [r.id for r in self.model.reactions]
+        self.metabolite_ids = [m.id for m in self.model.metabolites]
+
+        # Establish compartments for reactions and metabolites
+        self.r_compartments = [
+            r.compartments
+            if COMPARTMENT_RULES["extracellular"] not in r.compartments
+            else COMPARTMENT_RULES["transport"]
+            for r in self.model.reactions
+        ]
+        # TODO: Find why these were included in Hackett
+        # self.r_compartments[self.model.reactions.index("SUCCt2r")] = "c"
+        # self.r_compartments[self.model.reactions.index("ACt2r")] = "c"
+        for rxn in self.model.exchanges:
+            self.r_compartments[self.model.reactions.index(rxn)] = COMPARTMENT_RULES["transport"]
+        self.m_compartments = [m.compartment for m in self.model.metabolites]
+
         # Get indexes for measured values
         self.x_inds = np.array([self.model.metabolites.index(met) for met in self.xn.columns])
         self.e_inds = np.array([self.model.reactions.index(rxn) for rxn in self.en.columns])
@@ -97,44 +485,146 @@ class SynBMCA:
 
         for i, rxn in enumerate(self.model.reactions):
             if rxn.id not in self.en.columns:
-                if ("e" not in rxn.compartments) and (len(rxn.compartments) == 1):
+                if (COMPARTMENT_RULES["extracellular"] not in rxn.compartments) and (
+                    len(rxn.compartments) == 1
+                ):
                     self.e_laplace_inds += [i]
                 else:
                     self.e_zero_inds += [i]
 
-        self.e_laplace_inds = np.array(self.e_laplace_inds)
-        self.e_zero_inds = np.array(self.e_zero_inds)
+        self.e_laplace_inds = np.array(self.e_laplace_inds, dtype=int)
+        self.e_zero_inds = np.array(self.e_zero_inds, dtype=int)
         self.e_indexer = np.hstack([self.e_inds, self.e_laplace_inds, self.e_zero_inds]).argsort()
 
-        self.N = cobra.util.create_stoichiometric_matrix(self.model)
-        self.Ex = emll.util.create_elasticity_matrix(self.model)
-        self.Ey = emll.util.create_Ey_matrix(self.model)
+        if self.sparse:
+            self.N = linlog.create_sparse_stoichiometric_matrix(self.model)
+            self.Ex = linlog.create_sparse_elasticity_matrix(self.model)
+            self.Ey = linlog.create_sparse_Ey_matrix(self.model)
+            # Only perturb the structural nonzeros, as in the dense case
+            self.Ex.data *= 0.1 + 0.8 * self.rng.random(self.Ex.nnz)
+        else:
+            self.N = cobra.util.create_stoichiometric_matrix(self.model)
+            self.Ex = emll.util.create_elasticity_matrix(self.model)
+            self.Ey = emll.util.create_Ey_matrix(self.model)
+            self.Ex *= 0.1 + 0.8 * self.rng.random(self.Ex.shape)
+
+        self.ll = self.build_linlog()
+
+    def build_linlog(self, Nr=None, L=None):  # noqa: N803
+        """Create the linlog model, optionally from a precomputed reduction of N."""
+        # Reactions are oriented along the reference fluxes
+        v_star = self.v_star.abs().to_numpy()
+        if self.sparse:
+            support = (
+                linlog.stoichiometric_support(self.N)
+                if self.sparse_elasticity
+                else linlog.elasticity_support(self.N, self.m_compartments, self.r_compartments)
+            )
+            return linlog.SparseLinLogLeastNorm(
+                self.N, self.Ex, self.Ey, v_star, support, Nr=Nr, L=L
+            )
+        if Nr is None:
+            return emll.LinLogLeastNorm(self.N, self.Ex, self.Ey, v_star, driver="gelsy")
+
+        # Skip the reduction of N, restoring the given factorization instead
+        ll = emll.LinLogLeastNorm(
+            self.N, self.Ex, self.Ey, v_star, driver="gelsy", reduction_method=None
+        )
+        ll.Nr = Nr
+        ll.L = L
+        return ll
+
+    def structure(self) -> dict:
+        """Return the output of ``build_structure``: structural arrays and JSON-able labels."""
+        arrays = {
+            name: getattr(self, name) for name in cache.STRUCTURE_ARRAYS if name not in ("Nr", "L")
+        }
+        return arrays | {
+            "Nr": self.ll.Nr,
+            "L": self.ll.L,
+            "r_compartments": [c if isinstance(c, str) else sorted(c) for c in self.r_compartments],
+            "m_compartments": self.m_compartments,
+            "reaction_ids": self.reaction_ids,
+            "metabolite_ids": self.metabolite_ids,
+        }
+
+    def load_structure(self, cached):
+        """Restore the output of ``build_structure`` from ``structure()`` or a cache entry."""
+        self.reaction_ids = cached["reaction_ids"]
+        self.metabolite_ids = cached["metabolite_ids"]
+        self.r_compartments = [c if isinstance(c, str) else set(c) for c in cached["r_compartments"]]
+        self.m_compartments = cached["m_compartments"]
+
+        for name in cache.STRUCTURE_ARRAYS:
+            if name not in ("Nr", "L"):
+                setattr(self, name, cached[name])
 
-        self.Ex *= 0.1 + 0.8 * np.random.rand(*self.Ex.shape)
-        self.v_star = abs(self.v_star)
-        self.ll = emll.LinLogLeastNorm(self.N, self.Ex, self.Ey, self.v_star.values, driver="gelsy")
+        self.ll = self.build_linlog(cached["Nr"], cached["L"])
 
+    def deterministic(self, name, value):
+        """Keep the tensor of a deterministic, recording it in traces if requested."""
+        if name in self.record_deterministics:
+            value = pm.Deterministic(name, value)
+        self.deterministics[name] = value
+        return value
+
+    @profiling.logged_stage
     def build_pymc_model(self):
-        """Build the PyMC probabilistic model."""
+        """Build the PyMC probabilistic model.
+
+        With a ``batch_size`` smaller than the number of conditions, the likelihood of
+        the measurements is evaluated on a random minibatch of conditions, drawn with
+        replacement at every evaluation, and scaled by the number of conditions over
+        ``batch_size``. The latent enzyme levels and external concentrations of all
+        conditions are kept, with their priors evaluated in full, and the minibatch is
+        indexed out of them. The ELBO gradient stays unbiased, and the cost of the
+        steady-state solve scales with ``batch_size``. The deterministics still cover
+        every condition, but are only computed when recorded or drawn.
+        """
         with pm.Model() as pymc_model:
             # Priors on elasticity values
-            self.Ex_t = pm.Deterministic(
-                "Ex",
-                emll.util.initialize_elasticity(
-                    self.ll.N,
-                    b=0.01,
-                    sigma=1,
-                    alpha=None,
-                    m_compartments=self.m_compartments,
-                    r_compartments=self.r_compartments,
-                ),
+            with self.run_log.stage("initialize_elasticity"):
+                if self.sparse or self.sparse_elasticity:
+                    # The sparse solve takes the values on its support, without the matrix
+                    compartments = (
+                        {}
+                        if self.sparse_elasticity
+                        else {
+                            "m_compartments": self.m_compartments,
+                            "r_compartments": self.r_compartments,
+                        }
+                    )
+                    ex_values, (rows, cols) = linlog.initialize_sparse_elasticity(
+                        self.N, sigma=1, alpha=None, rng=self.rng, b=0.01, **compartments
+                    )
+                    self.ex_values_t = ex_values
+                    # Only evaluated when recorded or drawn, e.g. for control coefficients
+                    Ex = pt.set_subtensor(  # noqa: N806
+                        pt.zeros((len(self.reaction_ids), len(self.metabolite_ids)))[rows, cols],
+                        ex_values,
+                    )
+                else:
+                    Ex = emll.util.initialize_elasticity(  # noqa: N806
+                        self.ll.N,
+                        b=0.01,
+                        sigma=1,
+                        alpha=None,
+                        m_compartments=self.m_compartments,
+                        r_compartments=self.r_compartments,
+                    )
+                self.Ex_t = self.deterministic("Ex", Ex)
+
+            self.Ey_t = (
+                ps.as_sparse_variable(self.Ey) if self.sparse else pt.as_tensor_variable(self.Ey)
             )
 
-            self.Ey_t = pt.as_tensor_variable(self.Ey)
+            data = {
+                name: pm.MutableData(name, value) for name, value in self.observed_data().items()
+            }
 
             e_measured = pm.Normal(
                 "log_e_measured",
-                mu=np.log(self.en),
+                mu=data["log_en_data"],
                 sigma=0.2,
                 shape=(self.n_exp, len(self.e_inds)),
             )
@@ -145,7 +635,7 @@ class SynBMCA:
                 [e_measured, e_unmeasured, pt.zeros((self.n_exp, len(self.e_zero_inds)))], axis=1
             )[:, self.e_indexer]
 
-            pm.Deterministic("log_en_t", log_en_t)
+            self.deterministic("log_en_t", log_en_t)
 
             # Priors on external concentrations
             yn_t = pm.Normal(
@@ -153,15 +643,21 @@ class SynBMCA:
                 mu=0,
                 sigma=10,
                 shape=(self.n_exp, self.ll.ny),
-                initval=0.1 * np.random.randn(self.n_exp, self.ll.ny),
+                initval=0.1 * self.rng.standard_normal((self.n_exp, self.ll.ny)),
             )
 
-            # Returns Scan pytensor objects
-            chi_ss, vn_ss = self.ll.steady_state_pytensor(
-                self.Ex_t, self.Ey_t, pt.exp(log_en_t), yn_t
-            )
-            pm.Deterministic("chi_ss", chi_ss)
-            pm.Deterministic("vn_ss", vn_ss)
+            chi_ss, vn_ss = self.steady_state(log_en_t, yn_t)
+            self.deterministic("chi_ss", chi_ss)
+            self.deterministic("vn_ss", vn_ss)
+
+            total_size = None
+            xn_data, log_vn_data = data["xn_data"], data["log_vn_data"]
+            if self.batch_size is not None and self.batch_size < self.n_exp:
+                # Indexing shared data with a minibatch index marks it as a minibatch
+                batch = minibatch_index(0, self.n_exp, size=self.batch_size)
+                chi_ss, vn_ss = self.steady_state(log_en_t[batch], yn_t[batch])
+                xn_data, log_vn_data = xn_data[batch], log_vn_data[batch]
+                total_size = (self.n_exp, None)
 
             log_vn_ss = pt.log(pt.clip(vn_ss[:, self.v_inds], 1e-8, 1e8))
             log_vn_ss = pt.clip(log_vn_ss, -1.5, 1.5)
@@ -172,68 +668,671 @@ class SynBMCA:
                 "chi_obs",
                 mu=chi_clip,
                 sigma=0.2,
-                observed=self.xn.clip(
-                    lower=-1.5,
-                    upper=1.5,
-                ),
+                observed=xn_data,
+                total_size=total_size,
             )
 
             log_vn_obs = pm.Normal(
                 "vn_obs",
                 mu=log_vn_ss,
                 sigma=0.1,
-                observed=np.log(self.vn).clip(lower=-1.5, upper=1.5),
+                observed=log_vn_data,
+                total_size=total_size,
             )
 
         self.pymc_model = pymc_model
 
-    def run_emll(self):
-        """Build linlog model and run inference."""
-        with self.pymc_model:
-            approx = pm.ADVI()
-            hist = approx.fit(
-                n=1,
-                obj_optimizer=pm.adagrad_window(learning_rate=0.005),
-                total_grad_norm_constraint=100,
-            )
+    def steady_state(self, log_en, yn):
+        """Return the steady-state ``chi_ss`` and ``vn_ss`` tensors of the given conditions.
+
+        Parameters
+        ----------
+        log_en: TensorVariable
+            Log enzyme levels (conditions x reactions).
+        yn: TensorVariable
+            External concentrations (conditions x external species).
+        """
+        if self.sparse:
+            return self.ll.steady_state_values(self.ex_values_t, self.Ey_t, pt.exp(log_en), yn)
+        if self.batched and not self.sparse:
+            return linlog.steady_state_batched(self.ll, self.Ex_t, self.Ey_t, pt.exp(log_en), yn)
+        # Returns Scan pytensor objects in the dense case
+        return self.ll.steady_state_pytensor(self.Ex_t, self.Ey_t, pt.exp(log_en), yn)
+
+    def observed_data(self):
+        """Return the values of the model's data containers, from the normalized data."""
+        return {
+            "log_en_data": np.log(self.en).to_numpy(),
+            "xn_data": self.xn.clip(lower=-1.5, upper=1.5).to_numpy(),
+            "log_vn_data": np.log(self.vn).clip(lower=-1.5, upper=1.5).to_numpy(),
+        }
 
-            # trace = hist.sample(500)
-            # ppc = pm.sample_ppc(trace)
+    def set_data(self, metabolite_concentrations=None, enzyme_measurements=None, fluxes=None):
+        """Swap the measurements of the model in place, keeping its compiled graph.
+
+        Parameters
+        ----------
+        metabolite_concentrations, enzyme_measurements, fluxes: str, Path or pd.DataFrame, optional
+            New measurements, as CSV paths or tables with the same ids and conditions as
+            the current ones. Those not given are kept.
+        """
+        new = {}
+        for name, table in (
+            ("x", metabolite_concentrations),
+            ("e", enzyme_measurements),
+            ("v", fluxes),
+        ):
+            if table is None:
+                continue
+            table = bundle.read_table(table)
+            current = getattr(self, name)
+            if set(table.index) != set(current.index) or set(table.columns) != set(
+                current.columns
+            ):
+                raise ValueError(
+                    f"Measurements {name!r} must have the ids and conditions of the model"
+                )
+            new[name] = table.loc[current.index, current.columns]
+
+        for name, table in new.items():
+            setattr(self, name, table)
+        self.normalize_data()
+        pm.set_data(self.observed_data(), model=self.pymc_model)
+        self.save_pymc_data()
+
+    def refit(self, metabolite_concentrations=None, enzyme_measurements=None, fluxes=None):
+        """Fit the model to new measurements, reusing its compiled ADVI step function.
+
+        The measurements are swapped with ``set_data`` and the model is fit with
+        ``fit_kwargs`` from its initial state. Each dataset is checkpointed to its own
+        file, named after the content of the normalized data.
+
+        Returns
+        -------
+        tuple
+            The fitted approximation and its loss (negative ELBO) history.
+        """
+        self.set_data(metabolite_concentrations, enzyme_measurements, fluxes)
+        digest = hashlib.sha256()
+        for values in self.observed_data().values():
+            digest.update(values.tobytes())
+        checkpoint_name = f"advi_checkpoint_{digest.hexdigest()[:16]}.npz"
+        if self.runner is None:
+            self.approx, self.hist = self.run_emll(checkpoint_name, **self.fit_kwargs)
+        else:
+            self.runner.checkpoint_path = self.output_dir.joinpath(checkpoint_name)
+            if self.init == "map":
+                self.runner.start, self.runner.start_sigma = self.map_initialization()
+            with self.run_log.stage("refit"):
+                self.approx, self.hist = self.run_runner()
+        self.save_results(self.approx, self.hist)
+        return self.approx, self.hist
+
+    @profiling.logged_stage
+    def run_emll(self, checkpoint_name="advi_checkpoint.npz", **kwargs):
+        """Run ADVI on the PyMC model, checkpointing to ``output_dir``.
+
+        Keyword arguments are passed to ``inference.ADVIRunner``. With ``init`` "map",
+        its ``start`` and ``start_sigma`` default to ``map_initialization``. A fit interrupted before
+        ``n_iter`` iterations resumes from its checkpoint when rerun. The runner is kept
+        in ``runner``, and its compiled step function reused by ``refit``.
+
+        Returns
+        -------
+        tuple
+            The fitted approximation and its loss (negative ELBO) history.
+        """
+        kwargs = {"profile": self.profile, "mode": backends.get_mode(self.backend)} | kwargs
+        if self.init == "map" and "start" not in kwargs:
+            kwargs["start"], kwargs["start_sigma"] = self.map_initialization()
+        kwargs["callbacks"] = [*kwargs.get("callbacks", []), self.advi_profiler]
+        self.runner = inference.ADVIRunner(
+            self.pymc_model, checkpoint_path=self.output_dir.joinpath(checkpoint_name), **kwargs
+        )
+        approx, hist = self.run_runner()
+
+        # trace = approx.sample(500)
+        # ppc = pm.sample_ppc(trace)
 
         return approx, hist
 
-    def save_results(self, approx, hist):
-        """Save ADVI results in cloudpickle."""
-        with gzip.open("ADVI_DEBUG.pgz", "wb") as f:
-            cloudpickle.dump(
+    def map_initialization(self):
+        """Return the MAP point of the model and Laplace scales there, to start ADVI from.
+
+        The optimization starts from the model's initial point, and its wall time is
+        logged as the "initialize_map" stage of the run log.
+
+        Returns
+        -------
+        tuple
+            The ``start`` and ``start_sigma`` of ``inference.ADVIRunner``.
+        """
+        with self.run_log.stage("initialize_map"):
+            return inference.map_start(self.pymc_model)
+
+    def run_runner(self):
+        """Run ``runner``, logging its iteration rate and step times to the run log."""
+        self.advi_profiler.reset()
+        start = time.perf_counter()
+        approx, hist = self.runner.run()
+        runner = self.runner
+        self.run_log.record_fit(
+            checkpoint=runner.checkpoint_path,
+            init=self.init,
+            n_iter=len(hist),
+            n_steps=runner.n_steps,
+            wall_time_s=time.perf_counter() - start,
+            compile_time_s=runner.compile_seconds,
+            step_time_s=runner.step_seconds,
+            mean_step_time_s=runner.step_seconds / runner.n_steps if runner.n_steps else None,
+            **self.advi_profiler.summary(),
+        )
+        if runner.profile:
+            with open(self.output_dir.joinpath("pytensor_profile.txt"), "w") as f:
+                runner.step.profile.summary(file=f)
+        return approx, hist
+
+    def run_restarts(self, n_restarts, seeds=None, max_workers=None, **kwargs):
+        """Run independent ADVI fits in parallel processes and rank them by final ELBO.
+
+        Each worker rebuilds this model with its own seed, and so its own random initial
+        elasticities and compiled pytensor graph, and writes its checkpoint to
+        ``output_dir/restart_<seed>``. Keyword arguments are passed to ``run_emll``.
+
+        Parameters
+        ----------
+        n_restarts: int
+            Number of fits.
+        seeds: list[int], optional
+            Seed of each fit, drawn from this model's random generator by default.
+        max_workers: int, optional
+            Number of worker processes, by default one per fit up to the available CPUs.
+
+        Returns
+        -------
+        list[dict]
+            For each fit, its "seed", final "elbo" (mean over the last 100 iterations),
+            loss "hist" and "approx" on this model, sorted from the best ELBO.
+        """
+        if seeds is None:
+            seeds = self.rng.integers(2**31, size=n_restarts).tolist()
+        max_workers = max_workers or min(len(seeds), parallel.available_cpus())
+
+        with (
+            parallel.limit_threads(1),
+            parallel.compile_dir(self.compile_dir),
+            parallel.process_pool(max_workers) as pool,
+        ):
+            futures = [pool.submit(_fit_restart, self.init_kwargs, seed, kwargs) for seed in seeds]
+            fits = [future.result() for future in futures]
+
+        restarts = []
+        for seed, (hist, params) in zip(seeds, fits, strict=True):
+            # The variational parameters of every restart share this model's layout
+            restarts.append(
                 {
-                    "model": self.pymc_model,
-                    "approx": approx,
+                    "seed": seed,
+                    "elbo": -np.mean(hist[-100:]),
                     "hist": hist,
-                },
-                f,
+                    "approx": self.meanfield(params),
+                }
             )
 
-    def save_pymc_data(self, fname="pymcmodel_data_DEBUG.pgz"):
-        """Save PYMC model and info in cloudpickle."""
-        with gzip.open(fname, "wb") as f:
-            cloudpickle.dump(
-                {
-                    "model": self.pymc_model,
-                    "vn": self.vn,
-                    "en": self.en,
-                    # "yn_t": self.yn_t,
-                    "xn": self.xn,
-                    "x_inds": self.x_inds,
-                    "e_inds": self.e_inds,
-                    "v_inds": self.v_inds,
-                    # 'm_labels': m_labels,
-                    # 'r_labels': self.r_labels,
-                    "ll": self.ll,
-                    "v_star": self.v_star,
-                },
-                f,
-            )
+        return sorted(restarts, key=lambda fit: fit["elbo"], reverse=True)
+
+    def meanfield(self, params):
+        """Return a mean-field approximation of this model with the given parameter values."""
+        with self.pymc_model:
+            approx = pm.MeanField()
+        for param, value in zip(approx.params, params, strict=True):
+            param.set_value(value)
+        return approx
+
+    @staticmethod
+    def pool_posteriors(restarts, draws=1000, top=None):
+        """Pool posterior draws of the best restarts, one chain per restart.
+
+        Parameters
+        ----------
+        restarts: list[dict]
+            Fits returned by ``run_restarts``.
+        draws: int
+            Number of draws from each approximation.
+        top: int, optional
+            Number of best fits to pool, all of them by default.
+
+        Returns
+        -------
+        az.InferenceData
+            Posterior draws, with the restarts along the "chain" dimension.
+        """
+        return az.concat(
+            [fit["approx"].sample(draws) for fit in restarts[:top]], dim="chain", reset_dim=True
+        )
+
+    def sample_nuts(
+        self,
+        chains=4,
+        draws=1000,
+        tune=1000,
+        target_accept=0.9,
+        seeds=None,
+        max_workers=None,
+        flush_every=100,
+    ):
+        """Sample the posterior with NUTS, one chain per worker process.
+
+        Each worker rebuilds this model with its own seed, and so its own random initial
+        point, compiles it with ``backend`` and writes the draws of its chain to
+        ``output_dir/nuts/chain_<seed>/posterior_nuts.nc`` (see ``sample_chain``) as they
+        are taken, so a long run can be monitored and an interrupted one keeps its draws.
+        The throughput of the run is logged as a fit of the run log.
+
+        Parameters
+        ----------
+        chains: int
+            Number of chains.
+        draws: int
+            Number of draws of each chain after tuning.
+        tune: int
+            Number of tuning steps of each chain, which are not kept.
+        target_accept: float
+            Target acceptance rate of the step size adaptation.
+        seeds: list[int], optional
+            Seed of each chain, drawn from this model's random generator by default.
+        max_workers: int, optional
+            Number of worker processes, by default one per chain up to the available CPUs.
+        flush_every: int
+            Number of draws buffered by each worker before they are written.
+
+        Returns
+        -------
+        tuple
+            The posterior draws of all chains, as InferenceData, and the throughput of
+            the run: its ESS (see ``profiling.ess_throughput``), the wall time of the
+            slowest chain's sampling and the number of divergences.
+        """
+        if seeds is None:
+            seeds = self.rng.integers(2**31, size=chains).tolist()
+        max_workers = max_workers or min(len(seeds), parallel.available_cpus())
+        sample_kwargs = {
+            "draws": draws,
+            "tune": tune,
+            "target_accept": target_accept,
+            "flush_every": flush_every,
+        }
+
+        start = time.perf_counter()
+        with (
+            parallel.limit_threads(1),
+            parallel.compile_dir(self.compile_dir),
+            parallel.process_pool(max_workers) as pool,
+        ):
+            futures = [
+                pool.submit(_sample_chain, self.init_kwargs, seed, sample_kwargs) for seed in seeds
+            ]
+            samples = [future.result() for future in futures]
+        wall_time = time.perf_counter() - start
+
+        trace = az.concat(
+            [az.from_netcdf(sample["path"]) for sample in samples], dim="chain", reset_dim=True
+        )
+        sampling_time = max(sample["sampling_time_s"] for sample in samples)
+        stats = {
+            "method": "nuts",
+            "backend": self.backend,
+            "chains": len(seeds),
+            "draws": draws,
+            "tune": tune,
+            "wall_time_s": wall_time,
+            "compile_time_s": max(sample["compile_time_s"] for sample in samples),
+            "sampling_time_s": sampling_time,
+            "divergences": sum(sample["divergences"] for sample in samples),
+            **profiling.ess_throughput(
+                trace, [rv.name for rv in self.pymc_model.free_RVs], sampling_time
+            ),
+        }
+        self.run_log.record_fit(**stats)
+        return trace, stats
+
+    @profiling.logged_stage
+    def sample_chain(
+        self, seed=None, draws=1000, tune=1000, target_accept=0.9, flush_every=100, path=None
+    ):
+        """Sample one NUTS chain, writing its draws to a NetCDF file as they are taken.
+
+        The free variables and recorded deterministics of every ``flush_every`` draws
+        after tuning are appended to the "posterior" group of the file (see
+        ``posterior.NetCDFDrawWriter``), which is flushed to disk each time. The step
+        function is compiled with ``backend``. The minibatched likelihood of
+        ``batch_size`` is stochastic, which NUTS does not allow.
+
+        Parameters
+        ----------
+        seed: int, optional
+            Seed of the chain.
+        draws: int
+            Number of draws after tuning.
+        tune: int
+            Number of tuning steps, which are not written.
+        target_accept: float
+            Target acceptance rate of the step size adaptation.
+        flush_every: int
+            Number of draws buffered before they are written.
+        path: str or Path, optional
+            NetCDF file to write, ``output_dir/posterior_nuts.nc`` by default.
+
+        Returns
+        -------
+        dict
+            The "path" of the file, the number of "draws" written, the "compile_time_s"
+            and "sampling_time_s" of the chain and its number of "divergences".
+        """
+        if self.batch_size is not None:
+            raise ValueError("NUTS needs the full likelihood, not batch_size")
+        path = Path(path) if path is not None else self.output_dir.joinpath("posterior_nuts.nc")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        model = self.pymc_model
+        names = {rv.name for rv in model.free_RVs} | {var.name for var in model.deterministics}
+        outputs = [var for var in model.unobserved_value_vars if var.name in names]
+        # Values of the free variables and deterministics at a point of the sampler
+        values = model.compile_fn(outputs, inputs=model.value_vars, on_unused_input="ignore")
+
+        start = time.perf_counter()
+        with model:
+            step = pm.NUTS(target_accept=target_accept, mode=backends.get_mode(self.backend))
+        compile_time = time.perf_counter() - start
+
+        buffer = []
+        with posterior.NetCDFDrawWriter(path, POSTERIOR_DIMS, self.coords()) as writer:
+
+            def flush():
+                if buffer:
+                    writer.append(
+                        {
+                            var.name: np.stack([point[i] for point in buffer])
+                            for i, var in enumerate(outputs)
+                        }
+                    )
+                    buffer.clear()
+
+            def record(trace, draw):
+                if not draw.tuning:
+                    buffer.append(values(draw.point))
+                    if len(buffer) == flush_every:
+                        flush()
+
+            start = time.perf_counter()
+            try:
+                trace = pm.sample(
+                    draws=draws,
+                    tune=tune,
+                    step=step,
+                    chains=1,
+                    cores=1,
+                    random_seed=seed,
+                    # Draws are streamed by the callback, and only the sampler stats are read
+                    # back, so the in-memory trace only keeps the free variables
+                    trace=pm.backends.NDArray(model=model, vars=model.value_vars),
+                    callback=record,
+                    progressbar=False,
+                    compute_convergence_checks=False,
+                    return_inferencedata=False,
+                    model=model,
+                )
+            finally:
+                flush()
+            sampling_time = time.perf_counter() - start
+            n_draws = writer.n_draws
+
+        return {
+            "path": path,
+            "draws": n_draws,
+            "compile_time_s": compile_time,
+            "sampling_time_s": sampling_time,
+            "divergences": int(np.sum(trace.get_sampler_stats("diverging"))),
+        }
+
+    def coords(self) -> dict:
+        """Return the labels of the reaction, metabolite, condition and external dimensions.
+
+        External species are labelled with the id of their exchange reaction, the only
+        reaction with an elasticity for them in ``Ey``.
+        """
+        exchanges = np.asarray(abs(self.Ey).argmax(axis=0)).ravel()
+        return {
+            "reaction": self.reaction_ids,
+            "metabolite": self.metabolite_ids,
+            "condition": self.xn.index,
+            "external": [self.reaction_ids[i] for i in exchanges],
+        }
+
+    def dense_linlog(self):
+        """Return a dense emll linlog model, e.g. for its control coefficients in sparse mode."""
+        if not self.sparse:
+            return self.ll
+        return emll.LinLogLeastNorm(
+            self.N.toarray(), self.Ex.toarray(), self.Ey.toarray(), self.ll.v_star, driver="gelsy"
+        )
+
+    def compute_control_coefficients(self, path, draws=10_000, chunk_size=100):
+        """Stream posterior flux and concentration control coefficients to an HDF5 file.
+
+        Elasticities are drawn from ``self.approx`` ``chunk_size`` at a time, and the
+        control coefficients of each chunk are appended to the "fcc" (draws x reactions x
+        reactions) and "ccc" (draws x metabolites x reactions) datasets of the file, so
+        only one chunk is held in memory. Running summaries are stored under "summary".
+
+        Parameters
+        ----------
+        path: str or Path
+            HDF5 file to write.
+        draws: int
+            Total number of posterior draws.
+        chunk_size: int
+            Number of draws computed at a time.
+
+        Returns
+        -------
+        dict
+            Mean and standard deviation DataFrames of the "fcc" and "ccc".
+        """
+        ll = self.dense_linlog()
+        draw_ex = posterior.compile_draws(self.approx, [self.Ex_t], chunk_size)
+        moments = {"fcc": posterior.RunningMoments(), "ccc": posterior.RunningMoments()}
+
+        with posterior.DrawWriter(path) as writer:
+            writer.write_labels(reactions=self.reaction_ids, metabolites=self.metabolite_ids)
+            while moments["fcc"].count < draws:
+                (ex_draws,) = draw_ex()
+                ex_draws = ex_draws[: draws - moments["fcc"].count]
+                ccc = np.stack([ll.metabolite_control_coefficient(Ex=ex) for ex in ex_draws])
+                # At the reference state the flux control coefficients are I + Ex @ Cx
+                fcc = np.eye(ll.nr) + ex_draws @ ccc
+
+                for name, values in (("fcc", fcc), ("ccc", ccc)):
+                    writer.append(name, values)
+                    moments[name].update(values)
+
+            for name, running in moments.items():
+                writer.write_summary(name, running)
+
+        rows = {"fcc": self.reaction_ids, "ccc": self.metabolite_ids}
+        return {
+            name: {
+                stat: pd.DataFrame(values, index=rows[name], columns=self.reaction_ids)
+                for stat, values in running.summary().items()
+                if stat in ("mean", "std")
+            }
+            for name, running in moments.items()
+        }
+
+    def tensor(self, name):
+        """Return the tensor of a model variable or deterministic, recorded or not."""
+        if name in self.deterministics:
+            return self.deterministics[name]
+        return self.pymc_model[name]
+
+    def recompute_deterministics(self, trace, var_names=None, batch_size=100):
+        """Recompute deterministics from posterior draws of the free variables, in batches.
+
+        Parameters
+        ----------
+        trace: az.InferenceData, xr.Dataset or dict
+            Posterior draws of the free variables, with leading chain and draw
+            dimensions. Draws are read one batch at a time, so traces opened lazily from
+            disk are never loaded as a whole.
+        var_names: list[str], optional
+            Deterministics to compute, all of ``DETERMINISTICS`` by default.
+        batch_size: int
+            Number of draws computed at a time.
+
+        Yields
+        ------
+        dict
+            Values of each deterministic for the next draws of a chain, stacked along
+            the first axis. Batches follow the chains and draws in order.
+        """
+        var_names = list(var_names or DETERMINISTICS)
+        outputs = [self.deterministics[name] for name in var_names]
+        # Only the free variables the requested deterministics depend on are read
+        needed = set(ancestors(outputs))
+        inputs = [rv for rv in self.pymc_model.free_RVs if rv in needed]
+        fn = pm.pytensorf.compile_pymc(inputs, outputs)
+
+        draws = getattr(trace, "posterior", trace)
+        n_chains, n_draws = np.shape(draws[inputs[0].name])[:2]
+        for chain in range(n_chains):
+            for start in range(0, n_draws, batch_size):
+                stop = start + batch_size
+                batch = [np.asarray(draws[rv.name][chain, start:stop]) for rv in inputs]
+                values = [fn(*point) for point in zip(*batch, strict=True)]
+                yield {
+                    name: np.stack([value[i] for value in values])
+                    for i, name in enumerate(var_names)
+                }
+
+    def export_inference_data(self, path=None, draws=1000, chunk_size=100, var_names=None):
+        """Write posterior draws to a NetCDF file and open it as lazy InferenceData.
+
+        Draws are taken from ``self.approx`` ``chunk_size`` at a time and appended to the
+        "posterior" group of the file, so at most one chunk is held in memory. Dimensions
+        are labelled with the model's reaction and metabolite ids, the condition names and
+        the exchange reactions of the external species.
+
+        Parameters
+        ----------
+        path: str or Path, optional
+            NetCDF file to write, ``output_dir/posterior.nc`` by default.
+        draws: int
+            Total number of posterior draws.
+        chunk_size: int
+            Number of draws computed at a time.
+        var_names: list[str], optional
+            Variables to export, all of ``POSTERIOR_DIMS`` by default.
+
+        Returns
+        -------
+        az.InferenceData
+            The exported draws, read from disk on access.
+        """
+        path = Path(path) if path is not None else self.output_dir.joinpath("posterior.nc")
+        var_names = list(var_names or POSTERIOR_DIMS)
+        draw = posterior.compile_draws(
+            self.approx, [self.tensor(name) for name in var_names], chunk_size
+        )
+
+        with posterior.NetCDFDrawWriter(path, POSTERIOR_DIMS, self.coords()) as writer:
+            while writer.n_draws < draws:
+                n = min(chunk_size, draws - writer.n_draws)
+                batch = zip(var_names, draw(), strict=True)
+                writer.append({name: values[:n] for name, values in batch})
+
+        return az.from_netcdf(path)
+
+    @profiling.logged_stage
+    def save_results(self, approx, hist):
+        """Save the fitted variational parameters and loss history to the result store."""
+        self.results.write_arrays(
+            "fit",
+            {"hist": np.asarray(hist)}
+            | {f"param_{i}": param.get_value() for i, param in enumerate(approx.params)},
+        )
+
+    @profiling.logged_stage
+    def save_pymc_data(self):
+        """Save the inputs, normalized data and index arrays of the model to the result store.
+
+        The store records what ``from_results`` needs to rebuild the model: the input
+        bundle, the cobra model path and digest, and the arguments the model was built with.
+        """
+        bundle.save_bundle(self.results.inputs_path, self.v_star, self.x, self.e, self.v)
+        self.results.update_metadata(
+            model_path=str(Path(self.model_path).resolve()),
+            model_digest=cache.file_digest(self.model_path),
+            reference_state=self.ref_state,
+            build_kwargs={
+                "sparse": self.sparse,
+                "batched": self.batched,
+                "sparse_elasticity": self.sparse_elasticity,
+                "backend": self.backend,
+                "batch_size": self.batch_size,
+                "init": self.init,
+                "random_seed": self.random_seed,
+                "record_deterministics": sorted(self.record_deterministics),
+            },
+            fit_kwargs=self.fit_kwargs,
+            reaction_ids=list(self.reaction_ids),
+            metabolite_ids=list(self.metabolite_ids),
+            versions={name: version(name) for name in ("pymc", "pytensor", "emll")},
+        )
+        self.results.write_arrays(
+            "data",
+            {
+                "xn": self.xn,
+                "vn": self.vn,
+                "en": self.en,
+                "x_inds": self.x_inds,
+                "e_inds": self.e_inds,
+                "v_inds": self.v_inds,
+                "e_laplace_inds": self.e_laplace_inds,
+                "e_zero_inds": self.e_zero_inds,
+            },
+        )
+
+
+def _fit_restart(init_kwargs, seed, fit_kwargs):
+    """Build a SynBMCA model with the given seed in a worker process and fit it."""
+    bmca = SynBMCA(
+        **init_kwargs
+        | {
+            "run_inference": False,
+            "random_seed": seed,
+            "output_dir": Path(init_kwargs["output_dir"]).joinpath(f"restart_{seed}"),
+        }
+    )
+    approx, hist = bmca.run_emll(**fit_kwargs | {"random_seed": seed, "progressbar": False})
+    return hist, [param.get_value() for param in approx.params]
+
+
+def _sample_chain(init_kwargs, seed, sample_kwargs):
+    """Build a SynBMCA model with the given seed in a worker process and sample a NUTS chain."""
+    bmca = SynBMCA(
+        **init_kwargs
+        | {
+            "run_inference": False,
+            "random_seed": seed,
+            "output_dir": Path(init_kwargs["output_dir"]).joinpath("nuts", f"chain_{seed}"),
+        }
+    )
+    return bmca.sample_chain(seed=seed, **sample_kwargs)
+
+
+def _fit_reference(init_kwargs, fit_kwargs):
+    """Build a SynBMCA model from its shared structure in a worker process, fit and save it."""
+    bmca = SynBMCA(**init_kwargs | {"run_inference": False})
+    approx, hist = bmca.run_emll(**fit_kwargs | {"progressbar": False})
+    bmca.save_results(approx, hist)
 
 
 def main():
@@ -248,6 +1347,7 @@ def main():
         EFLUX,
         ref_state,
         run_inference=True,
+        cache_dir=CACHE,
     )
 
 
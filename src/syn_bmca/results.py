@@ -0,0 +1,105 @@
+"""Structured on-disk store of SynBMCA inputs and results.
+
+A result store is a directory holding
+
+- ``arrays.h5``: normalized data, index arrays and fitted parameters as chunked,
+  compressed HDF5 datasets, read lazily one dataset at a time;
+- ``metadata.json``: labels of the array axes, the arguments the model was built with
+  and the library versions of the run;
+- ``inputs.npz``: the measurements the model was built from, as an input bundle.
+
+Unlike a pickle of the PyMC model, the store does not depend on pytensor internals:
+the model is rebuilt from its recorded inputs (see ``SynBMCA.from_results``).
+"""
+
+import json
+import os
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pandas as pd
+
+# Bump whenever the layout of the store changes.
+STORE_VERSION = 1
+
+
+class ResultStore:
+    """Directory of SynBMCA arrays, metadata and inputs."""
+
+    def __init__(self, path):
+        """Use the store in directory ``path``, created on first write."""
+        self.path = Path(path)
+        self.arrays_path = self.path.joinpath("arrays.h5")
+        self.metadata_path = self.path.joinpath("metadata.json")
+        self.inputs_path = self.path.joinpath("inputs.npz")
+
+    @property
+    def metadata(self) -> dict:
+        """Metadata of the store, empty if none was written yet."""
+        if not self.metadata_path.exists():
+            return {}
+        with open(self.metadata_path) as f:
+            return json.load(f)
+
+    def update_metadata(self, **metadata) -> None:
+        """Merge top-level entries into the metadata file.
+
+        Values that are not JSON serializable (e.g. paths) are stored as strings.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        merged = self.metadata | metadata | {"version": STORE_VERSION}
+        tmp = self.metadata_path.with_name(f".{self.metadata_path.name}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(merged, f, indent=2, default=str)
+        os.replace(tmp, self.metadata_path)
+
+    def write_arrays(self, group: str, arrays: dict, labels: dict | None = None) -> None:
+        """Write arrays to an HDF5 group, replacing the group's previous contents.
+
+        Parameters
+        ----------
+        group: str
+            Name of the group, e.g. "data" or "fit".
+        arrays: dict
+            Arrays or DataFrames by name. The row and column labels of DataFrames are
+            recorded in the metadata, under "labels".
+        labels: dict, optional
+            Axis labels of other arrays, as lists by name, e.g. {"x_inds": [...]}.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        labels = dict(labels or {})
+        with h5py.File(self.arrays_path, "a") as f:
+            if group in f:
+                del f[group]
+            for name, value in arrays.items():
+                if isinstance(value, pd.DataFrame):
+                    labels[f"{group}/{name}"] = {
+                        "index": value.index.astype(str).tolist(),
+                        "columns": value.columns.astype(str).tolist(),
+                    }
+                value = np.asarray(value)
+                # Scalars and empty arrays cannot be chunked
+                chunked = value.ndim and value.size
+                f.create_dataset(
+                    f"{group}/{name}",
+                    data=value,
+                    chunks=True if chunked else None,
+                    compression="gzip" if chunked else None,
+                )
+        if labels:
+            self.update_metadata(labels=self.metadata.get("labels", {}) | labels)
+
+    def open_arrays(self) -> h5py.File:
+        """Open the arrays read-only; datasets are only read when indexed."""
+        return h5py.File(self.arrays_path, "r")
+
+    def read(self, name: str) -> np.ndarray:
+        """Read a single dataset, e.g. "fit/hist"."""
+        with self.open_arrays() as f:
+            return f[name][()]
+
+    def frame(self, name: str) -> pd.DataFrame:
+        """Read a dataset written from a DataFrame, with its row and column labels."""
+        labels = self.metadata["labels"][name]
+        return pd.DataFrame(self.read(name), index=labels["index"], columns=labels["columns"])
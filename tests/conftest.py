@@ -0,0 +1,57 @@
+"""Fixtures of the test suite."""
+
+import sys
+from pathlib import Path
+
+import cobra
+import numpy as np
+import pandas as pd
+import pytest
+
+# The data build scripts import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).parents[1].joinpath("data")))
+
+# SynBMCA options of the test models, which keep the build and the fits small
+SMALL_MODEL = {"sparse": True, "sparse_elasticity": True}
+
+
+@pytest.fixture(scope="session")
+def chain_model_path(tmp_path_factory):
+    """Save a linear pathway S -> m0 -> m1 -> m2 -> m3 -> P as a cobra JSON model."""
+    model = cobra.Model("chain")
+    s_e = cobra.Metabolite("s_e", compartment="e")
+    p_e = cobra.Metabolite("p_e", compartment="e")
+    chain = [cobra.Metabolite(f"m{i}_c", compartment="c") for i in range(4)]
+    stoichiometry = {
+        "EX_s_e": {s_e: 1},
+        "T_s": {s_e: -1, chain[0]: 1},
+        **{f"R{i}": {chain[i - 1]: -1, chain[i]: 1} for i in range(1, 4)},
+        "T_p": {chain[-1]: -1, p_e: 1},
+        "EX_p_e": {p_e: -1},
+    }
+    for rxn_id, metabolites in stoichiometry.items():
+        rxn = cobra.Reaction(rxn_id, lower_bound=0.0, upper_bound=10.0)
+        rxn.add_metabolites(metabolites)
+        model.add_reactions([rxn])
+
+    path = tmp_path_factory.mktemp("models").joinpath("chain.json")
+    cobra.io.save_json_model(model, path)
+    return path
+
+
+@pytest.fixture
+def chain_inputs():
+    """Return unit reference fluxes and random measurements of the chain in four conditions."""
+    rng = np.random.default_rng(0)
+    reactions = ["EX_s_e", "T_s", "R1", "R2", "R3", "T_p", "EX_p_e"]
+    conditions = ["c0", "c1", "c2", "c3"]
+
+    def table(ids, values):
+        return pd.DataFrame(values, index=pd.Index(ids, dtype=object), columns=conditions)
+
+    return {
+        "v_star": pd.Series(np.ones(len(reactions)), index=reactions),
+        "metabolites": table(["m1_c", "m3_c"], rng.normal(size=(2, 4))),
+        "enzymes": table(["R1", "R2"], rng.lognormal(0, 0.2, (2, 4))),
+        "fluxes": table(["EX_p_e"], rng.lognormal(0, 0.1, (1, 4))),
+    }
@@ -0,0 +1,37 @@
+"""Test of the compilation backends."""
+
+import numpy as np
+import pytensor
+import pytensor.tensor as pt
+import pytest
+from syn_bmca import backends
+from syn_bmca.linlog import BatchedLeastSquaresSolve
+
+
+def test_check_backend():
+    """Test that unsupported combinations of backend and solve are rejected."""
+    backends.check_backend("numba", sparse=True)
+    with pytest.raises(ValueError, match="Unknown backend"):
+        backends.check_backend("cuda")
+    with pytest.raises(ValueError, match="sparse"):
+        backends.check_backend("jax", sparse=True, batched=True)
+    with pytest.raises(ValueError, match="batched"):
+        backends.check_backend("jax")
+
+
+@pytest.mark.parametrize("backend", ["numba", "jax"])
+def test_batched_solve_backend(backend):
+    """Test that the batched solve and its gradient match the C backend."""
+    pytest.importorskip(backend)
+    rng = np.random.default_rng(0)
+    A_value = rng.normal(size=(3, 2, 4))  # noqa: N806
+    b_value = rng.normal(size=(3, 2))
+
+    A, b = pt.tensor3("A"), pt.matrix("b")  # noqa: N806
+    x = BatchedLeastSquaresSolve()(A, b)
+    outputs = [x, *pytensor.grad((x**2).sum(), [A, b])]
+    expected = pytensor.function([A, b], outputs)(A_value, b_value)
+    result = pytensor.function([A, b], outputs, mode=backends.get_mode(backend))(A_value, b_value)
+
+    for res, exp in zip(result, expected, strict=True):
+        np.testing.assert_allclose(res, exp, rtol=1e-6, atol=1e-10)
@@ -0,0 +1,54 @@
+"""Test of the cleaning steps of the processed data build."""
+
+import logging
+
+import numpy as np
+import pandas as pd
+from build import _clean_metabolomics, _experiment_to_bigg_map
+
+KEGG_TO_BIGG = {"C00031": "glc__D", "C00002": "atp"}
+
+# Experiment IDs with their KEGG and BIGG IDs, as in the experiment's ID table
+EXP_MAP = pd.DataFrame(
+    {
+        "Kegg": ["C00031", "C00031", "C00002", "C99999", "C00003", ""],
+        "BiGG": ["", "", "", "fallback", "nad", "pyr"],
+    },
+    index=["Glucose", "Glc (JHU)", "ATP", "Other", "unk-NAD", "Pyruvate"],
+)
+
+
+def test_experiment_to_bigg_map():
+    """Test that KEGG mappings take precedence over the table's BIGG IDs."""
+    exp_to_bigg_map = _experiment_to_bigg_map(EXP_MAP, KEGG_TO_BIGG)
+    # Unknown metabolites and those without a KEGG ID are left out
+    assert exp_to_bigg_map.to_dict() == {
+        "Glucose": "glc__D",
+        "Glc (JHU)": "glc__D",
+        "ATP": "atp",
+        "Other": "fallback",
+    }
+
+
+def test_clean_metabolomics_keeps_preferred_source(caplog):
+    """Test that redundant metabolites keep the row of the preferred source, wherever it is."""
+    columns = ["Se_ax_d1_1", "Se_ax_d2_1", "Se_Rt_d1_1"]
+    # The JHU tables come first, and share the "ATP" label with the EMSL table
+    labels = ["Glc (JHU)", "ATP", "Pyruvate", "Glucose", "ATP", "Other"]
+    sources = ["JHU", "JHU", "JHU", "EMSL", "EMSL", "EMSL"]
+    metabolomics = pd.DataFrame(
+        np.arange(18.0).reshape(6, 3), index=pd.Index(labels, name="Sample"), columns=columns
+    )
+
+    with caplog.at_level(logging.INFO):
+        cleaned = _clean_metabolomics(metabolomics, [24, 48], KEGG_TO_BIGG, EXP_MAP, sources)
+
+    assert list(cleaned.columns) == ["Se_ax_d1_1", "Se_ax_d2_1"]
+    assert list(cleaned.index) == ["glc__D", "atp", "fallback"]
+    np.testing.assert_array_equal(cleaned.to_numpy(), metabolomics.iloc[[3, 4, 5], :2])
+
+    assert "Removed 2 redundant rows" in caplog.text
+    report = [line.split() for line in caplog.text.splitlines()]
+    assert ["BiGG", "Sample", "Source"] in report
+    assert ["glc__D", "Glc", "(JHU)", "JHU"] in report
+    assert ["atp", "ATP", "JHU"] in report
@@ -0,0 +1,36 @@
+"""Test of the input bundle."""
+
+import pandas as pd
+from syn_bmca import bundle
+
+
+def test_bundle_round_trip_matches_csvs(tmp_path):
+    """Test that a bundle converted from CSVs loads the same inputs without loss."""
+    conditions = ["ref", "c1"]
+    v_star = pd.Series([0.1 + 0.2, 1 / 3], index=["R1", "R2"])
+    metabolites = pd.DataFrame([[1 / 7, 2e-17]], index=["m1_c"], columns=conditions)
+    enzymes = pd.DataFrame(
+        [[1.0, 1.1]], index=pd.Index(["R1"], name="Reaction_ID"), columns=conditions
+    )
+    fluxes = pd.DataFrame(
+        [[0.3, 0.1 + 0.2], [1 / 3, 2 / 3]], index=["R1", "R2"], columns=conditions
+    )
+
+    paths = [tmp_path.joinpath(f"{name}.csv") for name in ("v_star", *bundle.TABLES)]
+    v_star.to_csv(paths[0], header=False)
+    for path, table in zip(paths[1:], (metabolites, enzymes, fluxes), strict=True):
+        table.to_csv(path)
+
+    path = bundle.convert_csvs(tmp_path.joinpath("inputs.npz"), *paths)
+    inputs = bundle.load_bundle(path)
+
+    pd.testing.assert_series_equal(inputs["v_star"], bundle.read_v_star(paths[0]))
+    for name, table_path in zip(bundle.TABLES, paths[1:], strict=True):
+        pd.testing.assert_frame_equal(inputs[name], bundle.read_table(table_path))
+
+    # Values written directly to a bundle round-trip exactly
+    inputs = bundle.load_bundle(
+        bundle.save_bundle(tmp_path.joinpath("exact.npz"), v_star, metabolites, enzymes, fluxes)
+    )
+    pd.testing.assert_series_equal(inputs["v_star"], v_star, check_exact=True)
+    pd.testing.assert_frame_equal(inputs["fluxes"], fluxes, check_exact=True)
@@ -0,0 +1,37 @@
+"""Test of the preprocessing cache."""
+
+import numpy as np
+import pandas as pd
+from syn_bmca import cache
+
+
+def test_preprocess_cache_round_trip(tmp_path):
+    """Test that cached arrays are restored and the key tracks its inputs."""
+    model_path = tmp_path.joinpath("model.json")
+    model_path.write_text("{}")
+    v_star = pd.Series([1.0, 2.0], index=["R1", "R2"])
+    measured = {"x": ["m1"], "e": ["R1"], "v": ["R2"]}
+    rules = {"extracellular": "e", "transport": "t"}
+
+    key = cache.preprocess_key(model_path, v_star, rules, measured)
+    assert cache.load_preprocessed(tmp_path, key) is None
+    assert key != cache.preprocess_key(model_path, 2 * v_star, rules, measured)
+
+    arrays = {name: np.arange(3) for name in cache.STRUCTURE_ARRAYS}
+    cache.save_preprocessed(tmp_path, key, arrays, {"reaction_ids": ["R1", "R2"]})
+    cached = cache.load_preprocessed(tmp_path, key)
+
+    assert cached["reaction_ids"] == ["R1", "R2"]
+    for name in cache.STRUCTURE_ARRAYS:
+        assert isinstance(cached[name], np.memmap)
+        np.testing.assert_array_equal(cached[name], arrays[name])
+
+
+def test_topology_key_ignores_initial_elasticities():
+    """Test that the topology key depends on the structure but not on the values of Ex."""
+    arrays = {name: np.arange(4.0).reshape(2, 2) for name in cache.STRUCTURE_ARRAYS}
+    key = cache.topology_key(arrays, {"n_exp": 3})
+
+    assert key == cache.topology_key(arrays | {"Ex": 2 * arrays["Ex"]}, {"n_exp": 3})
+    assert key != cache.topology_key(arrays | {"N": 2 * arrays["N"]}, {"n_exp": 3})
+    assert key != cache.topology_key(arrays, {"n_exp": 4})
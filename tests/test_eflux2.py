@@ -0,0 +1,37 @@
+"""Test of E-Flux2."""
+
+import cobra
+import numpy as np
+import pandas as pd
+import pytest
+from syn_bmca.eflux2 import EFlux2, EFlux2Engine, eflux2_batch
+
+
+@pytest.fixture(scope="module")
+def textbook_qp_model():
+    """Return the cobra textbook model with a solver of quadratic programs."""
+    available = [s for s in cobra.util.solver.qp_solvers if s in cobra.util.solver.solvers]
+    if not available:
+        pytest.skip("No solver of quadratic programs installed")
+    model = cobra.io.load_model("textbook")
+    model.solver = available[0]
+    return model
+
+
+def test_engine_matches_single_conditions(textbook_qp_model):
+    """Test that reusing one engine across conditions gives the fluxes of separate solves."""
+    rng = np.random.default_rng(0)
+    genes = [g.id for g in textbook_qp_model.genes]
+    transcriptomics = pd.DataFrame(
+        rng.lognormal(3, 0.5, (len(genes), 3)), index=genes, columns=["c0", "c1", "c2"]
+    )
+
+    fluxes = EFlux2Engine(textbook_qp_model).solve_many(transcriptomics)
+    assert (fluxes.abs().sum() > 0).all()
+    batch = eflux2_batch(textbook_qp_model, transcriptomics, max_workers=2)
+    pd.testing.assert_frame_equal(batch, fluxes, rtol=1e-4, atol=1e-4)
+    for condition in transcriptomics.columns:
+        expected = EFlux2(textbook_qp_model, transcriptomics[condition]).fluxes
+        np.testing.assert_allclose(
+            fluxes[condition].loc[expected.index], expected, rtol=1e-4, atol=1e-4
+        )
@@ -0,0 +1,134 @@
+"""Test of the ADVI runner."""
+
+import numpy as np
+import pymc as pm
+import pytest
+from pymc.data import minibatch_index
+from syn_bmca.inference import ADVI_SIGMA, ADVIRunner, ELBOConvergence, hessian_diagonal, map_start
+
+
+def test_elbo_convergence():
+    """Test that the windowed test only stops a flat loss history."""
+    check = ELBOConvergence(window=10, tolerance=1e-3, every=1)
+    check(None, np.linspace(100, 50, 20), 20)
+    with pytest.raises(StopIteration):
+        check(None, np.full(20, 50.0), 20)
+
+
+def test_advi_runner_resumes_from_checkpoint(tmp_path):
+    """Test that a second run continues the loss history of the first."""
+    with pm.Model() as model:
+        pm.Normal("x", mu=1, sigma=2, shape=3)
+
+    checkpoint = tmp_path.joinpath("advi.npz")
+    kwargs = {"checkpoint_path": checkpoint, "checkpoint_every": 10, "progressbar": False}
+    _, first = ADVIRunner(model, n_iter=30, convergence_window=None, **kwargs).run()
+    _, second = ADVIRunner(model, n_iter=50, convergence_window=None, **kwargs).run()
+
+    assert checkpoint.exists()
+    assert len(second) == 50
+    np.testing.assert_array_equal(second[:30], first)
+
+
+def test_advi_runner_reuses_step_after_set_data():
+    """Test that a rerun on swapped data keeps the compiled step and restarts the fit."""
+    with pm.Model() as model:
+        y = pm.MutableData("y", np.zeros(3))
+        x = pm.Normal("x", mu=0, sigma=1)
+        pm.Normal("y_obs", mu=x, sigma=1, observed=y)
+
+    runner = ADVIRunner(model, n_iter=20, convergence_window=None, random_seed=1, progressbar=False)
+    _, first = runner.run()
+    first, step = first.copy(), runner.step
+    _, again = runner.run()
+    np.testing.assert_array_equal(again, first)
+
+    pm.set_data({"y": np.full(3, 5.0)}, model=model)
+    approx, shifted = runner.run()
+    assert runner.step is step
+    assert shifted[-1] > first[-1]
+    assert approx.mean.eval() > 0
+
+
+def test_minibatch_likelihood_is_unbiased():
+    """Test that the rescaled likelihood of minibatches of conditions averages the full one."""
+    y = np.arange(4.0)
+    with pm.Model() as full:
+        mu = pm.Normal("mu", mu=0, sigma=1, shape=4)
+        pm.Normal("y_obs", mu=mu, sigma=1, observed=y)
+    with pm.Model() as batched:
+        mu = pm.Normal("mu", mu=0, sigma=1, shape=4)
+        batch = minibatch_index(0, 4, size=2)
+        y_data = pm.MutableData("y", y)
+        pm.Normal("y_obs", mu=mu[batch], sigma=1, observed=y_data[batch], total_size=4)
+
+    point = {"mu": np.full(4, 0.5)}
+    batched_logp = batched.compile_logp()
+    draws = [batched_logp(point) for _ in range(2000)]
+    assert np.std(draws) > 0
+    np.testing.assert_allclose(np.mean(draws), full.compile_logp()(point), rtol=0.05)
+
+
+def test_map_start_seeds_advi():
+    """Test that ADVI starts from the MAP point and Laplace scales of a conjugate model."""
+    with pm.Model() as model:
+        x = pm.Normal("x", mu=0, sigma=1, shape=2)
+        pm.HalfNormal("s", sigma=1)
+        pm.Normal("y_obs", mu=x, sigma=1, observed=np.full((4, 2), 2.0))
+
+    start, start_sigma = map_start(model)
+    assert set(start) == {"x", "s_log__"}
+    np.testing.assert_allclose(start["x"], 1.6, rtol=1e-4)
+    np.testing.assert_allclose(start_sigma["x"], 1 / np.sqrt(5), rtol=1e-4)
+    # The MAP of s is at zero, where its log density has no curvature left
+    np.testing.assert_allclose(start_sigma["s_log__"], [ADVI_SIGMA])
+
+    runner = ADVIRunner(
+        model,
+        n_iter=0,
+        convergence_window=None,
+        start=start,
+        start_sigma=start_sigma,
+        progressbar=False,
+    )
+    approx, _ = runner.run()
+    x_slice = approx.groups[0].ordering["x"][1]
+    np.testing.assert_allclose(approx.mean.eval()[x_slice], start["x"])
+    np.testing.assert_allclose(approx.std.eval()[x_slice], start_sigma["x"])
+
+    runner.start = {"x": np.zeros(2)}
+    approx, _ = runner.run()
+    np.testing.assert_allclose(approx.mean.eval()[x_slice], 0)
+
+
+def test_map_start_of_matrix_variable():
+    """Test that the scales of a 2-D variable are flat, as ADVI fills its flat slice."""
+    sigma = np.arange(1, 7).reshape(2, 3) / 4
+    with pm.Model() as model:
+        z = pm.Normal("z", mu=0, sigma=1, shape=(2, 3))
+        pm.Normal("y_obs", mu=z, sigma=sigma, observed=np.ones((5, 2, 3)))
+
+    start, start_sigma = map_start(model, max_sigma=0.9)
+    np.testing.assert_allclose(start["z"], 5 / (sigma**2 + 5), rtol=1e-4)
+    np.testing.assert_allclose(start_sigma["z"], (sigma / np.sqrt(sigma**2 + 5)).ravel(), rtol=1e-4)
+
+    approx, _ = ADVIRunner(
+        model,
+        n_iter=0,
+        convergence_window=None,
+        start=start,
+        start_sigma=start_sigma,
+        progressbar=False,
+    ).run()
+    np.testing.assert_allclose(approx.mean.eval(), start["z"].ravel())
+    np.testing.assert_allclose(approx.std.eval(), start_sigma["z"])
+
+
+def test_hessian_diagonal():
+    """Test the finite-difference Hessian diagonal of a non-quadratic function."""
+    rng = np.random.default_rng(0)
+    a = rng.normal(size=(5, 5))
+    hessian = a @ a.T
+    x = rng.normal(size=5)
+    diag = hessian_diagonal(lambda x: hessian @ x + np.sinh(x), x)
+    np.testing.assert_allclose(diag, np.diag(hessian) + np.cosh(x), rtol=1e-6)
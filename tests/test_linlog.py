@@ -0,0 +1,135 @@
+"""Test of the linlog steady-state solvers."""
+
+import emll
+import numpy as np
+import pymc as pm
+import pytensor.tensor as pt
+import pytest
+from pytensor.gradient import NullTypeGradError, verify_grad
+from scipy import sparse
+from syn_bmca.linlog import (
+    BatchedLeastSquaresSolve,
+    SparseLinLogLeastNorm,
+    SparseSteadyStateSolve,
+    elasticity_support,
+    independent_rows,
+    initialize_sparse_elasticity,
+    steady_state_batched,
+)
+
+
+def _random_system(seed=0):
+    """Return a small rank-deficient linlog system."""
+    rng = np.random.default_rng(seed)
+    N = rng.normal(size=(4, 6))  # noqa: N806
+    N[3] = N[0] + N[1]  # dependent row, so the steady state has no unique solution
+    rows, cols = np.nonzero(rng.random((6, 4)) < 0.7)
+    ex_values = rng.normal(size=len(rows))
+    en = rng.uniform(0.5, 2.0, size=(3, 6))
+    c = 1 + 0.1 * rng.normal(size=(3, 6))
+    v_star = rng.uniform(0.5, 2.0, size=6)
+    return N, v_star, rows, cols, ex_values, en, c
+
+
+def test_sparse_steady_state_matches_least_norm():
+    """Test that the sparse solve returns the least-norm steady state of each condition."""
+    N, v_star, rows, cols, ex_values, en, c = _random_system()  # noqa: N806
+    Nr, L = independent_rows(N)  # noqa: N806
+    np.testing.assert_allclose((L @ Nr).toarray(), N, atol=1e-12)
+    op = SparseSteadyStateSolve(Nr, v_star, rows, cols, nm=4)
+    chi = op(pt.as_tensor(ex_values), pt.as_tensor(en), pt.as_tensor(c)).eval()
+
+    Ex = sparse.csr_matrix((ex_values, (rows, cols)), shape=(6, 4)).toarray()  # noqa: N806
+    for i in range(len(en)):
+        ND = N * (en[i] * v_star)  # noqa: N806
+        expected = np.linalg.lstsq(ND @ Ex, -ND @ c[i], rcond=None)[0]
+        np.testing.assert_allclose(chi[i], expected, rtol=1e-5, atol=1e-8)
+
+
+def test_sparse_steady_state_gradient():
+    """Test the analytic gradient of the sparse solve against finite differences."""
+    N, v_star, rows, cols, ex_values, en, c = _random_system(seed=1)  # noqa: N806
+    op = SparseSteadyStateSolve(independent_rows(N)[0], v_star, rows, cols, nm=4)
+    assert op == SparseSteadyStateSolve(independent_rows(N)[0], v_star, rows, cols, nm=4)
+    verify_grad(op, [ex_values, en, c], rng=np.random.default_rng(2))
+
+
+def test_batched_steady_state_matches_scan():
+    """Test that the batched solve reproduces emll's Scan-based steady state."""
+    rng = np.random.default_rng(3)
+    # Linear pathway -> A -> B ->, at steady state with unit fluxes
+    N = np.array([[1.0, -1.0, 0.0], [0.0, 1.0, -1.0]])  # noqa: N806
+    Ex = np.array([[0.0, 0.0], [-0.8, 0.2], [0.0, -0.6]])  # noqa: N806
+    Ey = np.array([[1.0], [0.0], [0.0]])  # noqa: N806
+    ll = emll.LinLogLeastNorm(N, Ex, Ey, np.ones(3), driver="gelsy")
+
+    en = rng.uniform(0.5, 2.0, size=(4, 3))
+    yn = rng.normal(size=(4, 1))
+    Ex_t, Ey_t = pt.as_tensor(Ex), pt.as_tensor(Ey)  # noqa: N806
+    expected = ll.steady_state_pytensor(Ex_t, Ey_t, en, yn)
+    result = steady_state_batched(ll, Ex_t, Ey_t, en, yn)
+
+    for res, exp in zip(result, expected, strict=True):
+        np.testing.assert_allclose(res.eval(), exp.eval(), rtol=1e-8, atol=1e-10)
+
+
+def test_batched_least_squares_gradient():
+    """Test the pseudoinverse gradient of the batched solve against finite differences."""
+    rng = np.random.default_rng(4)
+    A = rng.normal(size=(3, 2, 4))  # noqa: N806
+    b = rng.normal(size=(3, 2))
+    verify_grad(BatchedLeastSquaresSolve(), [A, b], rng=np.random.default_rng(5))
+
+
+def test_sparse_elasticity_prior():
+    """Test that only stoichiometric entries are sampled, with substrate/product signs."""
+    # Linear pathway -> A -> B ->, at steady state with unit fluxes
+    N = np.array([[1.0, -1.0, 0.0], [0.0, 1.0, -1.0]])  # noqa: N806
+    Ey = sparse.csr_matrix(np.array([[1.0], [0.0], [0.0]]))  # noqa: N806
+    with pm.Model() as model:
+        ex_values, support = initialize_sparse_elasticity(N, rng=0)
+
+    assert model.free_RVs[0].type.shape == (np.count_nonzero(N),)
+    values = ex_values.eval()
+    Ex = sparse.csr_matrix((values, support), shape=(3, 2)).toarray()  # noqa: N806
+    np.testing.assert_array_equal(np.sign(Ex), -np.sign(N.T))
+
+    # The steady state from the values matches the one from the scattered matrix
+    ll = SparseLinLogLeastNorm(sparse.csr_matrix(N), Ex, Ey, np.ones(3), support)
+    en = np.full((2, 3), 1.5)
+    yn = np.array([[0.2], [-0.1]])
+    expected = ll.steady_state_pytensor(pt.as_tensor(Ex), None, en, yn)
+    result = ll.steady_state_values(pt.as_tensor(values), None, en, yn)
+    for res, exp in zip(result, expected, strict=True):
+        np.testing.assert_allclose(res.eval(), exp.eval())
+
+
+def test_sparse_elasticity_prior_with_regulation():
+    """Test that compartments add Laplace regulatory entries on the support of emll's prior."""
+    N = np.array([[1.0, -1.0, 0.0], [0.0, 1.0, -1.0]])  # noqa: N806
+    m_compartments, r_compartments = ["c", "c"], [{"c"}, {"c"}, {"c"}]
+    with pm.Model() as model:
+        ex_values, support = initialize_sparse_elasticity(
+            N, rng=0, m_compartments=m_compartments, r_compartments=r_compartments
+        )
+
+    rows, cols = support
+    expected = elasticity_support(sparse.csr_matrix(N), m_compartments, r_compartments)
+    np.testing.assert_array_equal(rows, expected[0])
+    np.testing.assert_array_equal(cols, expected[1])
+    assert [rv.name for rv in model.free_RVs] == ["ex_kinetic_entries", "ex_capacity_entries"]
+    assert model.free_RVs[1].type.shape == (len(rows) - np.count_nonzero(N),)
+
+    values = ex_values.eval()
+    kinetic = N.T[rows, cols] != 0
+    np.testing.assert_array_equal(np.sign(values[kinetic]), -np.sign(N.T[rows, cols][kinetic]))
+
+
+def test_sparse_steady_state_has_no_second_derivative():
+    """Test that differentiating the gradient fails with pytensor's standard error."""
+    N, v_star, rows, cols, _, en, c = _random_system()  # noqa: N806
+    op = SparseSteadyStateSolve(independent_rows(N)[0], v_star, rows, cols, nm=4)
+    ex = pt.vector("ex")
+    grad = pt.grad(op(ex, pt.as_tensor(en), pt.as_tensor(c)).sum(), ex)
+    with pytest.raises(NullTypeGradError):
+        pt.grad(grad.sum(), ex)
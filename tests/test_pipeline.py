@@ -0,0 +1,92 @@
+"""Test of the incremental build pipeline of the processed data."""
+
+import os
+
+import pandas as pd
+from build import parse_args
+from pipeline import Stage, read_excel_cached, run_pipeline
+
+
+def make_stages(tmp_path, runs):
+    """Return a chain a -> b of stages on one input, and a stage c on another."""
+    paths = {name: tmp_path.joinpath(f"{name}.txt") for name in ("in", "other", "a", "b", "c")}
+    paths["in"].write_text("1")
+    paths["other"].write_text("2")
+
+    def copy(name, source):
+        def run():
+            runs.append(name)
+            paths[name].write_text(f"{name}({paths[source].read_text()})")
+
+        return Stage(name, run, inputs=[paths[source]], outputs=[paths[name]])
+
+    return [copy("a", "in"), copy("b", "a"), copy("c", "other")], paths
+
+
+def test_pipeline_skips_up_to_date_stages(tmp_path):
+    """Test that only stages with changed inputs or missing outputs are rerun."""
+    runs = []
+    stages, paths = make_stages(tmp_path, runs)
+    manifest = tmp_path.joinpath("manifest.json")
+
+    run_pipeline(stages, manifest)
+    assert runs == ["a", "b", "c"]
+    runs.clear()
+    run_pipeline(stages, manifest)
+    assert runs == []
+
+    # Stages are keyed by content, not by modification time
+    os.utime(paths["in"])
+    run_pipeline(stages, manifest)
+    assert runs == []
+
+    # A changed input reruns its stage and the stages downstream of it only
+    paths["in"].write_text("3")
+    run_pipeline(stages, manifest)
+    assert runs == ["a", "b"]
+    assert paths["b"].read_text() == "b(a(3))"
+    runs.clear()
+
+    paths["c"].unlink()
+    run_pipeline(stages, manifest)
+    assert runs == ["c"]
+    runs.clear()
+
+    run_pipeline(stages, manifest, force=True)
+    assert runs == ["a", "b", "c"]
+
+
+def test_force_option(monkeypatch):
+    """Test that ``--force`` of the build scripts requests a full rebuild."""
+    monkeypatch.setattr("sys.argv", ["build.py", "--force"])
+    assert parse_args("build").force
+    monkeypatch.setattr("sys.argv", ["build.py"])
+    assert not parse_args("build").force
+
+
+def test_read_excel_cached_misses_changed_workbook(tmp_path, monkeypatch):
+    """Test that the parsed sheet is cached until the workbook or the read options change."""
+    parsed = []
+
+    def read_excel(path, **kwargs):
+        parsed.append(path)
+        return pd.read_csv(path, **kwargs)
+
+    # The cache only depends on the workbook's bytes, so any parser stands in for openpyxl
+    monkeypatch.setattr(pd, "read_excel", read_excel)
+    workbook = tmp_path.joinpath("sheet.xlsx")
+    workbook.write_text("id,value\na,1\nb,2\n")
+    cache_dir = tmp_path.joinpath("cache")
+
+    first = read_excel_cached(workbook, cache_dir, index_col=0)
+    pd.testing.assert_frame_equal(read_excel_cached(workbook, cache_dir, index_col=0), first)
+    assert len(parsed) == 1
+
+    read_excel_cached(workbook, cache_dir)
+    assert len(parsed) == 2
+
+    workbook.write_text("id,value\na,1\nb,3\n")
+    changed = read_excel_cached(workbook, cache_dir, index_col=0)
+    assert len(parsed) == 3
+    assert changed.loc["b", "value"] == 3
+    assert len(list(cache_dir.iterdir())) == 3
@@ -0,0 +1,53 @@
+"""Test of the posterior streaming helpers."""
+
+import arviz as az
+import h5py
+import numpy as np
+from syn_bmca.posterior import DrawWriter, NetCDFDrawWriter, RunningMoments
+
+
+def test_running_moments_match_full_batch():
+    """Test that moments merged over batches equal those of all draws at once."""
+    draws = np.random.default_rng(0).normal(size=(25, 3, 2))
+    moments = RunningMoments()
+    for batch in np.array_split(draws, [4, 5, 17]):
+        moments.update(batch)
+
+    summary = moments.summary()
+    np.testing.assert_allclose(summary["mean"], draws.mean(axis=0))
+    np.testing.assert_allclose(summary["std"], draws.std(axis=0, ddof=1))
+    np.testing.assert_array_equal(summary["min"], draws.min(axis=0))
+    np.testing.assert_array_equal(summary["max"], draws.max(axis=0))
+
+
+def test_draw_writer_appends_batches(tmp_path):
+    """Test that appended batches are stored in order along the draw axis."""
+    path = tmp_path.joinpath("draws.h5")
+    draws = np.arange(24.0).reshape(6, 2, 2)
+    with DrawWriter(path) as writer:
+        writer.append("fcc", draws[:4])
+        writer.append("fcc", draws[4:])
+        writer.write_labels(reactions=["R1", "R2"])
+
+    with h5py.File(path) as f:
+        np.testing.assert_array_equal(f["fcc"][:], draws)
+        assert [label.decode() for label in f["labels/reactions"]] == ["R1", "R2"]
+
+
+def test_netcdf_draw_writer_opens_as_inference_data(tmp_path):
+    """Test that appended batches form a labelled InferenceData posterior."""
+    path = tmp_path.joinpath("posterior.nc")
+    chi = np.arange(30.0).reshape(5, 2, 3)
+    yn = np.ones((5, 2, 1))
+    dims = {"chi_ss": ("condition", "metabolite"), "yn_t": ("condition", "external")}
+    coords = {"condition": ["c1", "c2"], "metabolite": ["a", "b", "c"]}
+    with NetCDFDrawWriter(path, dims, coords) as writer:
+        writer.append({"chi_ss": chi[:3], "yn_t": yn[:3]})
+        writer.append({"chi_ss": chi[3:], "yn_t": yn[3:]})
+
+    posterior = az.from_netcdf(path).posterior
+    assert posterior["chi_ss"].dims == ("chain", "draw", "condition", "metabolite")
+    assert list(posterior["metabolite"].values) == ["a", "b", "c"]
+    np.testing.assert_array_equal(posterior["draw"], np.arange(5))
+    np.testing.assert_array_equal(posterior["chi_ss"].sel(condition="c2")[0], chi[:, 1])
+    assert posterior["yn_t"].shape == (1, 5, 2, 1)
@@ -0,0 +1,58 @@
+"""Test of the run log."""
+
+import json
+
+import arviz as az
+import numpy as np
+from syn_bmca.profiling import ADVIProfiler, RunLog, ess_throughput
+
+
+def test_run_log_appends_runs(tmp_path):
+    """Test that stages and fits are written to the log after the previous runs."""
+    path = tmp_path.joinpath("run_log.json")
+    first = RunLog(path)
+    with first.stage("preprocess_data"):
+        pass
+
+    second = RunLog(path)
+    profiler = ADVIProfiler(every=2)
+    for i in range(1, 6):
+        profiler(None, None, i)
+    second.record_fit(n_iter=5, **profiler.summary())
+
+    runs = json.loads(path.read_text())["runs"]
+    assert [stage["name"] for stage in runs[0]["stages"]] == ["preprocess_data"]
+    assert runs[0]["stages"][0]["wall_time_s"] >= 0
+    assert runs[1]["stages"] == []
+    assert runs[1]["fits"][0]["iterations_per_s"] > 0
+    assert [window["iteration"] for window in runs[1]["fits"][0]["windows"]] == [2, 4]
+
+
+def test_run_log_keeps_concurrent_runs(tmp_path):
+    """Test that a log saved again keeps the runs written since it was opened."""
+    path = tmp_path.joinpath("run_log.json")
+    parent = RunLog(path)
+    with parent.stage("preprocess_data"):
+        pass
+    worker = RunLog(path)
+    worker.record_fit(n_iter=5)
+    with parent.stage("build_pymc_model"):
+        pass
+
+    runs = json.loads(path.read_text())["runs"]
+    assert [run["id"] for run in runs] == [parent.entries["id"], worker.entries["id"]]
+    assert [stage["name"] for stage in runs[0]["stages"]] == [
+        "preprocess_data",
+        "build_pymc_model",
+    ]
+    assert runs[1]["fits"] == [{"n_iter": 5}]
+
+
+def test_ess_throughput():
+    """Test that independent draws have an ESS close to their number."""
+    rng = np.random.default_rng(0)
+    trace = az.from_dict(posterior={"x": rng.normal(size=(4, 500, 3))})
+    throughput = ess_throughput(trace, ["x"], seconds=10.0)
+
+    assert 1500 < throughput["min_ess_bulk"] <= throughput["median_ess_bulk"] < 2500
+    assert throughput["ess_per_s"] == throughput["min_ess_bulk"] / 10
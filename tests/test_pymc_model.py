@@ -0,0 +1,184 @@
+"""Test of the SynBMCA model on a small synthetic pathway."""
+
+import json
+import os
+
+import arviz as az
+import numpy as np
+import pymc as pm
+from conftest import SMALL_MODEL
+from syn_bmca.pymc_model import SynBMCA
+
+FIT = {"n_iter": 200, "convergence_window": None, "progressbar": False}
+
+
+def build(model_path, inputs, reference_state="c0", **kwargs):
+    """Build a SynBMCA model of the chain without fitting it."""
+    return SynBMCA(
+        model_path,
+        inputs["v_star"],
+        inputs["metabolites"],
+        inputs["enzymes"],
+        inputs["fluxes"],
+        reference_state,
+        run_inference=False,
+        **SMALL_MODEL | kwargs,
+    )
+
+
+def test_restarts_are_ranked_and_pooled(chain_model_path, chain_inputs, tmp_path):
+    """Test that restarts are sorted by final ELBO and pooled one chain per restart."""
+    bmca = build(chain_model_path, chain_inputs, output_dir=tmp_path, random_seed=0)
+    restarts = bmca.run_restarts(3, max_workers=3, **FIT)
+
+    assert len({fit["seed"] for fit in restarts}) == 3
+    elbos = [fit["elbo"] for fit in restarts]
+    assert elbos == sorted(elbos, reverse=True)
+    for fit in restarts:
+        assert len(fit["hist"]) == FIT["n_iter"]
+        assert fit["elbo"] == -np.mean(fit["hist"][-100:])
+        assert tmp_path.joinpath(f"restart_{fit['seed']}", "advi_checkpoint.npz").exists()
+
+    pooled = SynBMCA.pool_posteriors(restarts, draws=50, top=2).posterior
+    # Every pooled restart contributes the same number of draws, as its own chain
+    assert dict(pooled.sizes)["chain"] == 2
+    assert dict(pooled.sizes)["draw"] == 50
+    np.testing.assert_array_equal(pooled.chain, [0, 1])
+    np.testing.assert_array_equal(pooled.draw, np.arange(50))
+    assert {rv.name for rv in bmca.pymc_model.free_RVs} <= set(pooled.data_vars)
+
+
+def test_skipped_deterministics_are_recomputed(chain_model_path, chain_inputs, tmp_path):
+    """Test that deterministics left out of traces are recomputed equal to recorded ones."""
+    recorded = build(
+        chain_model_path, chain_inputs, output_dir=tmp_path.joinpath("recorded"), random_seed=0
+    )
+    skipped = build(
+        chain_model_path,
+        chain_inputs,
+        output_dir=tmp_path.joinpath("skipped"),
+        random_seed=0,
+        record_deterministics=["log_en_t"],
+    )
+    with recorded.pymc_model:
+        trace = pm.MeanField().sample(7)
+    with skipped.pymc_model:
+        skipped_trace = pm.MeanField().sample(2)
+
+    assert {"chi_ss", "vn_ss", "log_en_t"} <= set(trace.posterior)
+    assert "log_en_t" in skipped_trace.posterior
+    assert not {"Ex", "chi_ss", "vn_ss"} & set(skipped_trace.posterior)
+
+    names = ["chi_ss", "vn_ss"]
+    batches = list(skipped.recompute_deterministics(trace, names, batch_size=3))
+    assert [len(batch["chi_ss"]) for batch in batches] == [3, 3, 1]
+    for name in names:
+        np.testing.assert_allclose(
+            np.concatenate([batch[name] for batch in batches]), trace.posterior[name][0]
+        )
+
+
+def test_fit_references_normalizes_and_fits_each_reference(
+    chain_model_path, chain_inputs, tmp_path
+):
+    """Test that every reference state is normalized, fitted and saved on its own."""
+    references = ["c0", "c1"]
+    models = SynBMCA.fit_references(
+        chain_model_path,
+        chain_inputs["v_star"],
+        chain_inputs["metabolites"],
+        chain_inputs["enzymes"],
+        chain_inputs["fluxes"],
+        references,
+        output_dir=tmp_path,
+        max_workers=2,
+        fit_kwargs=FIT,
+        random_seed=0,
+        **SMALL_MODEL,
+    )
+
+    assert list(models) == references
+    x = chain_inputs["metabolites"]
+    for reference, bmca in models.items():
+        expected = (x.subtract(x[reference], axis=0) * np.log(2)).T.drop(reference)
+        np.testing.assert_allclose(bmca.xn.to_numpy(), expected.loc[bmca.xn.index].to_numpy())
+        assert reference not in bmca.xn.index
+        assert len(bmca.hist) == FIT["n_iter"]
+
+        store = tmp_path.joinpath(f"reference_{reference}", "results")
+        assert bmca.results.path == store
+        assert bmca.results.metadata["reference_state"] == reference
+        np.testing.assert_array_equal(bmca.results.read("fit/hist"), bmca.hist)
+        np.testing.assert_allclose(bmca.results.frame("data/xn").to_numpy(), bmca.xn.to_numpy())
+
+        # The run log keeps the fit of the worker next to the stages of the parent
+        runs = json.loads(tmp_path.joinpath(f"reference_{reference}", "run_log.json").read_text())
+        assert len(runs["runs"]) == 2
+        parent, worker = sorted(runs["runs"], key=lambda run: run["pid"] != os.getpid())
+        # The parent only builds the PyMC model once the fit is saved, to read it back
+        assert parent["stages"][-1]["name"] == "build_pymc_model"
+        assert parent["fits"] == []
+        assert [fit["n_iter"] for fit in worker["fits"]] == [FIT["n_iter"]]
+        assert "save_results" in [stage["name"] for stage in worker["stages"]]
+
+    # Each reference gets its own fit, not a copy of another's
+    assert not np.array_equal(models["c0"].hist, models["c1"].hist)
+
+
+def test_map_initialization_of_sparse_model(chain_model_path, chain_inputs, tmp_path):
+    """Test that the sparse solve, which only has gradients, starts ADVI from its MAP point."""
+    bmca = build(chain_model_path, chain_inputs, output_dir=tmp_path, random_seed=0, init="map")
+    start, start_sigma = bmca.map_initialization()
+    assert set(start) == {value.name for value in bmca.pymc_model.value_vars}
+    for name, values in start.items():
+        assert start_sigma[name].shape == (np.size(values),)
+
+    _, hist = bmca.run_emll(**FIT | {"n_iter": 10})
+    assert np.all(np.isfinite(hist))
+    for name, values in start.items():
+        np.testing.assert_allclose(bmca.runner.start[name], values)
+        np.testing.assert_allclose(bmca.runner.start_sigma[name], start_sigma[name])
+
+
+def test_sparse_solve_samples_elasticities_on_its_support(chain_model_path, chain_inputs, tmp_path):
+    """Test that the sparse solve with emll's regulatory support never builds the dense Ex."""
+    bmca = build(chain_model_path, chain_inputs, output_dir=tmp_path, sparse_elasticity=False)
+    free = {rv.name: rv for rv in bmca.pymc_model.free_RVs}
+    rows, _ = bmca.ll.support
+    n_kinetic = bmca.N.nnz
+    assert free["ex_kinetic_entries"].type.shape == (n_kinetic,)
+    assert free["ex_capacity_entries"].type.shape == (len(rows) - n_kinetic,)
+    assert "Ex" not in bmca.pymc_model.named_vars
+
+
+def test_exported_draws_are_labelled(chain_model_path, chain_inputs, tmp_path):
+    """Test that every dimension of the exported draws has labels, including external."""
+    bmca = build(chain_model_path, chain_inputs, output_dir=tmp_path, random_seed=0)
+    bmca.approx, bmca.hist = bmca.run_emll(**FIT | {"n_iter": 10})
+    idata = bmca.export_inference_data(draws=3, chunk_size=2, var_names=["yn_t", "chi_ss"])
+
+    posterior = idata.posterior
+    assert sorted(posterior.external.values) == ["EX_p_e", "EX_s_e"]
+    assert list(posterior.condition.values) == ["c1", "c2", "c3"]
+    assert list(posterior.metabolite.values) == bmca.metabolite_ids
+    assert dict(posterior.yn_t.sizes) == {"chain": 1, "draw": 3, "condition": 3, "external": 2}
+
+
+def test_nuts_chain_streams_deterministics(chain_model_path, chain_inputs, tmp_path, monkeypatch):
+    """Test that NUTS draws are streamed to disk while its trace only keeps free variables."""
+    bmca = build(chain_model_path, chain_inputs, output_dir=tmp_path, random_seed=0)
+    traces = []
+    sample = pm.sample
+
+    def spy(*args, **kwargs):
+        traces.append(sample(*args, **kwargs))
+        return traces[-1]
+
+    monkeypatch.setattr(pm, "sample", spy)
+    stats = bmca.sample_chain(seed=0, draws=6, tune=5, flush_every=4)
+
+    assert stats["draws"] == 6
+    assert set(traces[0].varnames) == {value.name for value in bmca.pymc_model.value_vars}
+    streamed = az.from_netcdf(stats["path"]).posterior
+    assert dict(streamed.sizes)["draw"] == 6
+    assert {"chi_ss", "vn_ss", "log_en_t"} <= set(streamed.data_vars)
@@ -0,0 +1,26 @@
+"""Test of the result store."""
+
+import numpy as np
+import pandas as pd
+from syn_bmca.results import ResultStore
+
+
+def test_result_store_round_trip(tmp_path):
+    """Test that arrays, labels and metadata are restored from the store."""
+    store = ResultStore(tmp_path.joinpath("results"))
+    xn = pd.DataFrame(np.arange(6.0).reshape(2, 3), index=["c1", "c2"], columns=["a", "b", "c"])
+    store.update_metadata(reference_state="ref")
+    store.write_arrays("data", {"xn": xn, "x_inds": np.array([2, 0, 1])})
+    store.write_arrays("fit", {"hist": np.linspace(10, 1, 5), "param_0": np.ones(4)})
+
+    pd.testing.assert_frame_equal(store.frame("data/xn"), xn)
+    np.testing.assert_array_equal(store.read("data/x_inds"), [2, 0, 1])
+    with store.open_arrays() as f:
+        assert f["fit/hist"].shape == (5,)
+        assert f["fit/hist"].compression == "gzip"
+    assert store.metadata["reference_state"] == "ref"
+
+    # Rewriting a group replaces its contents
+    store.write_arrays("fit", {"hist": np.zeros(2)})
+    with store.open_arrays() as f:
+        assert sorted(f["fit"]) == ["hist"]
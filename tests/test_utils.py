@@ -1,9 +1,16 @@
 """Test of fba_utils."""
 
+import cobra
 import numpy as np
 import pandas as pd
 import pytest
-from syn_bmca.fba_utils import prepare_data_for_bmca
+from syn_bmca.fba_utils import (
+    convert_transcriptomics_to_enzyme_activity,
+    flux_variability,
+    gene_expression_to_enzyme_activity,
+    get_gpr_dict,
+    prepare_data_for_bmca,
+)
 
 
 @pytest.fixture(scope="module")
@@ -40,3 +47,45 @@ def test_prepare_data_for_bmca():
 
     # Compare
     assert result.equals(expected_result)
+
+
+def test_convert_transcriptomics_matches_per_strain_evaluation():
+    """Test the vectorized GPR evaluation against the per-strain loop."""
+    model = cobra.Model("toy")
+    rules = {
+        "R1": "(g1 and g2) or g3",  # complex or isozyme
+        "R2": "g4",  # unmeasured gene
+        "R3": "",  # no rule
+        "R4": "g5 and g1",  # NaN expression
+        "R5": "g2 or g3 or g6",
+    }
+    for rxn_id, rule in rules.items():
+        rxn = cobra.Reaction(rxn_id)
+        rxn.gene_reaction_rule = rule
+        model.add_reactions([rxn])
+
+    transcriptomics = pd.DataFrame(
+        {"strain_1": [1.0, 2.0, 0.5, np.nan, 3.0], "strain_2": [4.0, 1.0, 2.0, 1.0, 0.0]},
+        index=["g1", "g2", "g3", "g5", "g6"],
+    )
+
+    result = convert_transcriptomics_to_enzyme_activity(transcriptomics, model)
+
+    gpr = get_gpr_dict(model)
+    assert list(result["Reaction_ID"]) == list(rules)
+    for strain in transcriptomics.columns:
+        expected = gene_expression_to_enzyme_activity(model, gpr, transcriptomics[strain].to_dict())
+        np.testing.assert_array_equal(result[strain], [expected[rxn] for rxn in result.index])
+
+
+def test_flux_variability_matches_cobra():
+    """Test the solver-reusing FVA against cobra's implementation."""
+    model = cobra.io.load_model("textbook")
+    reaction_list = [r.id for r in model.reactions]
+
+    result = flux_variability(model, reaction_list, fraction_of_optimum=0.85, processes=1)
+    expected = cobra.flux_analysis.flux_variability_analysis(
+        model, reaction_list, fraction_of_optimum=0.85, processes=1
+    )
+
+    pd.testing.assert_frame_equal(result, expected.loc[reaction_list], atol=1e-6, check_exact=False)